@@ -33,25 +33,25 @@ bl_info = {
     "category": "Node",
     "tracker_url": "https://github.com/wildiness/NodeSharer#supporthelp-and-bug-reports",
 }
-# (In your __init__.py)
-# When bpy is already in local, we know this is not the initial import...
-if "bpy" in locals():
-    # ...so we need to reload our submodule(s) using importlib
+
+import os
+
+# Reloading the add-on's modules when Blender reloads scripts, so code changes show up,
+#  is only needed when working on the add-on. Set the NODESHARER_DEV environment variable to turn it on
+if os.environ.get('NODESHARER_DEV') and "operators" in locals():
     import importlib
-    if "nodesharer" in locals():
-        importlib.reload(nodesharer)
-        print("hot reload")
-else:
-    print("bpy was not in locals")
+    # dependencies before the modules using them
+    for _module in ('nslog', 'nscodec_items', 'nsbinary', 'nscodec', 'nsdelta', 'compfixer', 'nsstream', 'nodesharer', 'operators'):
+        if _module in locals():
+            importlib.reload(locals()[_module])
 
-import importlib
 
 def register():
-    from . import nodesharer
-    importlib.reload(nodesharer)
-    nodesharer.register()
+    # Only the operators and menu, the rest of Node Sharer is imported the first time it's used
+    from . import operators
+    operators.register()
 
 
 def unregister():
-    from . import nodesharer
-    nodesharer.unregister()
+    from . import operators
+    operators.unregister()
@@ -0,0 +1,170 @@
+"""
+Node Sharer batch export
+
+Exports every material and node group of a .blend file without opening Blender's interface:
+    blender --background library.blend --python batch_export.py -- --out exported/
+
+Materials are written as Node Sharer text strings, materials/<name>.txt, node groups as
+node tree JSON files, node_groups/<name>.json, the same files the Save Nodetree to File menu makes.
+
+A manifest.json in the output folder remembers a hash of what was exported for every datablock,
+datablocks that haven't changed since the last run are skipped. Use --force to export everything.
+Files of datablocks that aren't in the .blend file anymore are removed. Datablocks that failed to
+export this run are listed in the manifest under "failed", {kind: {name: error message}}.
+"""
+
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import re
+import sys
+import time
+
+import bpy  # type: ignore
+
+
+def load_addon():
+    """Import the add-on package this file lives in, Blender runs this file as __main__"""
+    addon_dir = os.path.dirname(os.path.abspath(__file__))
+    if os.path.dirname(addon_dir) not in sys.path:
+        sys.path.insert(0, os.path.dirname(addon_dir))
+    return importlib.import_module(os.path.basename(addon_dir))
+
+
+addon = load_addon()
+nodesharer = importlib.import_module(addon.__name__ + '.nodesharer')
+nscodec = importlib.import_module(addon.__name__ + '.nscodec')
+nsstream = importlib.import_module(addon.__name__ + '.nsstream')
+
+MANIFEST = 'manifest.json'
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='blender --background <file.blend> --python batch_export.py --',
+                                     description='Export every material and node group as Node Sharer files')
+    parser.add_argument('--out', required=True, help='output folder')
+    parser.add_argument('--only', choices=('materials', 'node_groups'), help='only export one kind of datablock')
+    parser.add_argument('--codec', choices=list(nscodec.CODECS), default=nscodec.DEFAULT_CODEC,
+                        help='compression of the material text strings')
+    parser.add_argument('--binary', action='store_true', help='compact binary material strings, see nsbinary')
+    parser.add_argument('--gzip', action='store_true', help='gzip the node group files')
+    parser.add_argument('--force', action='store_true', help='export everything, even if it has not changed')
+    return parser.parse_args(argv)
+
+
+def file_name(name):
+    """A file name for a datablock name, names that had to be changed get a bit of their hash,
+        so 'a/b' and 'a_b' don't end up in the same file
+    """
+    safe = re.sub(r'[^\w.-]+', '_', name)
+    if safe != name:
+        safe += '-' + hashlib.sha1(name.encode('utf8')).hexdigest()[:8]
+    return safe
+
+
+def export_material(mat, args):
+    """Returns (JSON payload, function that returns the file content)"""
+    ns_mat = nodesharer.NS_material(mat)
+    payload = ns_mat.dump_mat_JSON().encode('utf8')
+
+    def content():
+        # Not NS_material.compress(), that also puts the string on the clipboard
+        payload_format = nscodec.FORMAT_BINARY if args.binary else nscodec.FORMAT_JSON
+        data = ns_mat.dump_mat_binary() if args.binary else payload
+        return (ns_mat.prefix(args.codec, payload_format) + nscodec.compress(data, args.codec)).encode('ascii')
+    return payload, content
+
+
+def export_node_group(group, args):
+    """Returns (JSON payload, function that returns the file content)"""
+    ns_tree = nodesharer.NS_nodetree(group)
+    payload = ns_tree.dump_JSON(ns_tree.make_nodetree_dict()).encode('utf8')
+    return payload, lambda: payload
+
+
+def main():
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    args = parse_args(argv)
+
+    manifest_path = os.path.join(args.out, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+    failures = manifest['failed'] = {}  # only this run's
+    # Changing the settings changes every file
+    settings = '{} {} {} {}'.format(addon.bl_info['version'], args.codec, args.binary, args.gzip).encode('utf8')
+
+    kinds = []
+    if args.only in (None, 'materials'):
+        kinds.append(('materials', [mat for mat in bpy.data.materials if mat.use_nodes and mat.node_tree],
+                      export_material, '.txt'))
+    if args.only in (None, 'node_groups'):
+        kinds.append(('node_groups', list(bpy.data.node_groups), export_node_group,
+                      '.json.gz' if args.gzip else '.json'))
+
+    exported = skipped = failed = removed = 0
+    captured_bytes = written_bytes = 0
+    start = time.perf_counter()
+    for kind, datablocks, export, extension in kinds:
+        os.makedirs(os.path.join(args.out, kind), exist_ok=True)
+        entries = manifest.setdefault(kind, {})
+        for datablock in datablocks:
+            name = datablock.name_full
+            try:
+                payload, content = export(datablock, args)
+            except Exception as e:
+                print('Failed to export {} {}: {}'.format(kind, name, e))
+                failures.setdefault(kind, {})[name] = str(e)
+                failed += 1
+                continue
+            captured_bytes += len(payload)
+
+            digest = hashlib.sha1(settings + payload).hexdigest()
+            path = os.path.join(kind, file_name(name) + extension)
+            entry = entries.get(name)
+            if (not args.force and entry is not None and entry['hash'] == digest and entry['file'] == path
+                    and os.path.exists(os.path.join(args.out, path))):
+                skipped += 1
+                continue
+
+            data = content()
+            if extension.endswith('.gz'):
+                with nsstream.open_tree_file(os.path.join(args.out, path), 'w') as file:
+                    file.write(data.decode('utf8'))
+            else:
+                with open(os.path.join(args.out, path), 'wb') as file:
+                    file.write(data)
+            if entry is not None and entry['file'] != path and os.path.exists(os.path.join(args.out, entry['file'])):
+                os.remove(os.path.join(args.out, entry['file']))  # the settings changed the file name
+            entries[name] = {'hash': digest, 'file': path}
+            written_bytes += len(data)
+            exported += 1
+
+        # Datablocks deleted or renamed since the last run, their files go too
+        names = {datablock.name_full for datablock in datablocks}
+        for name in [name for name in entries if name not in names]:
+            old_file = os.path.join(args.out, entries.pop(name)['file'])
+            if os.path.exists(old_file):
+                os.remove(old_file)
+            removed += 1
+
+    # Write the manifest through a temporary file, an interrupted run shouldn't lose it
+    with open(manifest_path + '.tmp', 'w') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    elapsed = time.perf_counter() - start
+    trees = exported + skipped
+    print('Node Sharer batch export: {} exported, {} unchanged, {} removed, {} failed in {:.2f} s'.format(
+        exported, skipped, removed, failed, elapsed))
+    if elapsed > 0:
+        print('  {:.1f} trees/s, {:.1f} KB/s captured, {:.1f} KB/s written'.format(
+            trees / elapsed, captured_bytes / 1024 / elapsed, written_bytes / 1024 / elapsed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,520 @@
+"""
+Node Sharer benchmarks
+
+Needs Blender, run it from the add-on folder with:
+    blender --background --factory-startup --python benchmark.py -- [benchmark names]
+
+Without any names every benchmark is run. Timings are the best of a few runs, in milliseconds.
+"""
+
+import importlib
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+import bpy  # type: ignore
+
+
+def load_addon():
+    """Import the add-on package this file lives in, Blender runs this file as __main__"""
+    addon_dir = os.path.dirname(os.path.abspath(__file__))
+    if os.path.dirname(addon_dir) not in sys.path:
+        sys.path.insert(0, os.path.dirname(addon_dir))
+    return importlib.import_module(os.path.basename(addon_dir))
+
+
+addon = load_addon()
+nodesharer = importlib.import_module(addon.__name__ + '.nodesharer')
+nscodec = importlib.import_module(addon.__name__ + '.nscodec')
+nsbinary = importlib.import_module(addon.__name__ + '.nsbinary')
+nsdelta = importlib.import_module(addon.__name__ + '.nsdelta')
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """Register a benchmark under its function name"""
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def best_of(func, repeat=5):
+    """Run func repeat times, returns the fastest run in milliseconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = (time.perf_counter() - start) * 1000
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def report(name, ms, baseline_ms=None):
+    if baseline_ms:
+        print('  {:<40} {:>10.2f} ms  ({:.1f}x)'.format(name, ms, baseline_ms / ms))
+    else:
+        print('  {:<40} {:>10.2f} ms'.format(name, ms))
+
+
+def make_material(node_count, name='NS benchmark'):
+    """Make a material with a chain of node_count math nodes feeding a Principled BSDF,
+        every math node also feeds a color ramp, so outputs have a few links each
+    """
+    mat = bpy.data.materials.new(name)
+    mat.use_nodes = True
+    nodes = mat.node_tree.nodes
+    links = mat.node_tree.links
+    bsdf = nodes.get('Principled BSDF')
+
+    previous = None
+    for i in range(node_count):
+        math = nodes.new('ShaderNodeMath')
+        math.location = (i * 200, 0)
+        math.operation = ('ADD', 'MULTIPLY', 'POWER')[i % 3]
+        math.inputs[1].default_value = i * 0.5
+        if previous is not None:
+            links.new(previous.outputs[0], math.inputs[0])
+            if i % 10 == 0:
+                ramp = nodes.new('ShaderNodeValToRGB')
+                ramp.location = (i * 200, -300)
+                links.new(previous.outputs[0], ramp.inputs[0])
+        previous = math
+    if previous is not None and bsdf is not None:
+        links.new(previous.outputs[0], bsdf.inputs['Roughness'])
+    return mat
+
+
+def make_group(node_count, name='NS benchmark group', child=None):
+    """Make a shader node group with a chain of node_count math nodes,
+        and a group node using child, if given
+    """
+    group = bpy.data.node_groups.new(name, 'ShaderNodeTree')
+    previous = None
+    for i in range(node_count):
+        math = group.nodes.new('ShaderNodeMath')
+        math.location = (i * 200, 0)
+        if previous is not None:
+            group.links.new(previous.outputs[0], math.inputs[0])
+        previous = math
+    if child is not None:
+        group_node = group.nodes.new('ShaderNodeGroup')
+        group_node.node_tree = child
+    return group
+
+
+def add_group_nodes(mat, group, count):
+    for i in range(count):
+        group_node = mat.node_tree.nodes.new('ShaderNodeGroup')
+        group_node.node_tree = group
+        group_node.location = (i * 200, 400)
+
+
+@benchmark
+def capture():
+    """Capture time with and without the per node type schema cache"""
+    mat = make_material(1000)
+    print('capture, {} nodes'.format(len(mat.node_tree.nodes)))
+
+    nodesharer.NS_node.use_schema_cache = False
+    uncached = best_of(lambda: nodesharer.NS_material(mat), 3)
+    report('uncached', uncached)
+
+    nodesharer.NS_node.use_schema_cache = True
+    nodesharer.NS_node._schema_cache.clear()
+    nodesharer.NS_material(mat)  # warm up the cache
+    cached = best_of(lambda: nodesharer.NS_material(mat), 3)
+    report('cached', cached, uncached)
+
+    bpy.data.materials.remove(mat)
+
+
+@benchmark
+def group_capture():
+    """Capture time should depend on the number of distinct groups, not group nodes"""
+    print('group capture, 200 node group')
+    group = make_group(200)
+    for instances in (1, 10, 50):
+        mat = make_material(10)
+        add_group_nodes(mat, group, instances)
+        ms = best_of(lambda: nodesharer.NS_material(mat), 3)
+        report('{} group nodes'.format(instances), ms)
+        bpy.data.materials.remove(mat)
+    bpy.data.node_groups.remove(group)
+
+
+@benchmark
+def nested_groups():
+    """Copy and paste a library of groups nested depth deep, every level also used twice"""
+    print('nested groups, 20 nodes per group')
+    for depth in (10, 50, 100):
+        groups = []
+        child = None
+        for level in range(depth):
+            child = make_group(20, 'NS nested {}'.format(level), child)
+            if level > 0:
+                # a second group node using the same child
+                child.nodes.new('ShaderNodeGroup').node_tree = groups[-1]
+            groups.append(child)
+        mat = make_material(10)
+        add_group_nodes(mat, child, 2)
+
+        ns_string = nodesharer.NS_material(mat).compress()[0]
+        copy_ms = best_of(lambda: nodesharer.NS_material(mat).compress(), 3)
+        report('depth {}, copy'.format(depth), copy_ms)
+
+        before = set(bpy.data.node_groups)
+        start = time.perf_counter()
+        pasted = nodesharer.NS_mat_constructor(ns_string).b_mat
+        report('depth {}, paste'.format(depth), (time.perf_counter() - start) * 1000)
+
+        for datablock in (mat, pasted):
+            bpy.data.materials.remove(datablock)
+        for group in set(bpy.data.node_groups) - before:
+            bpy.data.node_groups.remove(group)
+        for group in reversed(groups):
+            bpy.data.node_groups.remove(group)
+
+
+def link_by_name(mat_name, edges):
+    """How pasted nodes were linked before the builders kept handles,
+        the material and both nodes looked up by name for every link
+    """
+    for key, output, name, i in edges:
+        bpy.data.materials[mat_name].node_tree.links.new(
+            bpy.data.materials[mat_name].node_tree.nodes[key].outputs[output],
+            bpy.data.materials[mat_name].node_tree.nodes[name].inputs[i])
+
+
+@benchmark
+def paste():
+    """Paste time for growing trees, time per link should stay flat. Then the links of the
+        same pasted material made again, by name like before versus through the node handles
+    """
+    print('paste')
+    for node_count in (250, 500, 1000, 2000):
+        mat = make_material(node_count)
+        link_count = len(mat.node_tree.links)
+        ns_string = nodesharer.NS_material(mat).compress()[0]
+        bpy.data.materials.remove(mat)
+
+        pasted = []
+        ms = best_of(lambda: pasted.append(nodesharer.NS_mat_constructor(ns_string).b_mat), 3)
+        report('{} nodes, {} links'.format(node_count, link_count), ms)
+        print('  {:<40} {:>10.4f} ms'.format('  per link', ms / link_count))
+
+        # Same tree and edges for both, only the links are made again
+        b_mat = pasted.pop()
+        b_tree = b_mat.node_tree
+        stored = nscodec.decode(ns_string)[1]['nodes']
+        edges = nodesharer.NS_nodetree.make_edges([(name, node['outputs']) for name, node in stored.items()
+                                                   if 'outputs' in node])
+        b_created = {node.name: node for node in b_tree.nodes}
+        by_name = best_of(lambda: (b_tree.links.clear(), link_by_name(b_mat.name, edges)), 3)
+        report('  links by name', by_name)
+        linker = nodesharer.NS_nodetree()
+        handles = best_of(lambda: (b_tree.links.clear(), linker.link_blender_nodes(b_tree, b_created, edges)), 3)
+        report('  links through handles', handles, by_name)
+        pasted.append(b_mat)
+        for pasted_mat in pasted:
+            bpy.data.materials.remove(pasted_mat)
+
+
+@benchmark
+def repeat_paste():
+    """Pasting the same string again, the decode and version fix step with and without the payload cache"""
+    mat = make_material(500)
+    ns_string = nodesharer.NS_material(mat).compress()[0]
+    bpy.data.materials.remove(mat)
+    cache = nodesharer.NS_mat_constructor.payload_cache
+    print('repeat paste, 500 nodes')
+
+    uncached = best_of(lambda: (cache.clear(), cache.get(ns_string, bpy.app.version)))
+    report('decode and fix', uncached)
+    cached = best_of(lambda: cache.get(ns_string, bpy.app.version))
+    report('cached', cached, uncached)
+
+
+@benchmark
+def big_paste():
+    """Pasting a 5000 node tree, checking every stored attribute of every node against Blender
+        versus the per node type attribute cache and the build plan of the payload
+    """
+    mat = make_material(5000)
+    ns_string = nodesharer.NS_material(mat).compress()[0]
+    bpy.data.materials.remove(mat)
+    plans = nodesharer.NS_build_plan
+    print('paste, 5000 nodes')
+
+    def paste():
+        bpy.data.materials.remove(nodesharer.NS_mat_constructor(ns_string).b_mat)
+
+    # Build plans are kept with the decoded payload, forgetting them leaves the payload cached
+    cache = nodesharer.NS_mat_constructor.payload_cache
+    payload_plans = cache.extras(cache.get(ns_string, bpy.app.version))
+
+    plans.use_attribute_cache = False
+    try:
+        unchecked = best_of(lambda: (payload_plans.clear(), paste()), 3)
+    finally:
+        plans.use_attribute_cache = True
+    report('attributes checked for every node', unchecked)
+    plans._attribute_cache.clear()
+    first = best_of(lambda: (payload_plans.clear(), paste()), 1)
+    report('attribute cache, first paste', first, unchecked)
+    again = best_of(paste, 3)
+    report('attribute cache and build plan', again, unchecked)
+
+
+@benchmark
+def paste_in_steps():
+    """Pasting a 2000 node material in one go versus in 50 ms steps like the modal paste,
+        building in steps shouldn't be slower overall
+    """
+    mat = make_material(2000)
+    ns_string = nodesharer.NS_material(mat).compress()[0]
+    bpy.data.materials.remove(mat)
+    print('paste in steps, 2000 nodes')
+
+    def in_steps():
+        new_mat = nodesharer.NS_mat_constructor(ns_string, build=False)
+        steps = new_mat.build_steps()
+        while True:
+            new_mat.deadline = time.perf_counter() + 0.05
+            try:
+                next(steps)
+            except StopIteration:
+                break
+        bpy.data.materials.remove(new_mat.b_mat)
+
+    blocking = best_of(lambda: bpy.data.materials.remove(nodesharer.NS_mat_constructor(ns_string).b_mat), 3)
+    report('one go', blocking)
+    stepped = best_of(in_steps, 3)
+    report('50 ms steps', stepped, blocking)
+
+
+@benchmark
+def background_decode():
+    """Time Blender is blocked before the first node of an 8000 node material is built, reading the
+        string on the main thread like the blocking paste versus in the background like the modal paste
+    """
+    mat = make_material(8000)
+    ns_string = nodesharer.NS_material(mat).compress()[0]
+    bpy.data.materials.remove(mat)
+    print('main thread blocked before the first node, {} KB string'.format(len(ns_string) // 1000))
+
+    def first_step(new_mat):
+        new_mat.deadline = 0.0
+        steps = new_mat.build_steps()
+        next(steps)
+        steps.close()
+        new_mat.rollback()
+
+    def on_main():
+        nodesharer.NS_mat_constructor.payload_cache.clear()  # read it every time
+        first_step(nodesharer.NS_mat_constructor(ns_string, build=False))
+
+    def in_background():
+        # Only the time spent on the main thread counts, waiting is Blender carrying on
+        start = time.perf_counter()
+        future = nscodec.decode_in_background(ns_string, bpy.app.version)
+        blocked = time.perf_counter() - start
+        payload = future.result()
+        start = time.perf_counter()
+        first_step(nodesharer.NS_mat_constructor(ns_string, build=False, payload=payload))
+        return (blocked + time.perf_counter() - start) * 1000
+
+    blocking = best_of(on_main, 3)
+    report('read on the main thread', blocking)
+    background = min(in_background() for _ in range(3))
+    report('read in the background', background, blocking)
+    nscodec.shutdown_background()
+
+
+@benchmark
+def incremental_export():
+    """Exporting a 2000 node material again after changing one node, a full capture
+        versus NS_incremental_exporter, which should only take the time of checking every node
+    """
+    mat = make_material(2000)
+    exporter = nodesharer.NS_incremental_exporter()
+    exporter.export_material(mat)
+    math = next(node for node in mat.node_tree.nodes if node.bl_idname == 'ShaderNodeMath')
+    print('re-export after one change, 2000 nodes')
+
+    def change():
+        math.inputs[1].default_value += 1.0
+
+    full = best_of(lambda: (change(), nodesharer.NS_material(mat).dump_mat_JSON()))
+    report('full capture', full)
+    incremental = best_of(lambda: (change(), exporter.export_material(mat)))
+    report('incremental, {} captured'.format(exporter.captured), incremental, full)
+    bpy.data.materials.remove(mat)
+
+
+@benchmark
+def apply_delta():
+    """Sharing a one node change to a 2000 node material, pasting the whole material again
+        versus applying a delta string to the material pasted before
+    """
+    mat = make_material(2000)
+    base = json.loads(nodesharer.NS_material(mat).dump_mat_JSON())
+    ns_string = nodesharer.NS_material(mat).compress()[0]
+    target = nodesharer.NS_mat_constructor(ns_string).b_mat
+    math = next(node for node in mat.node_tree.nodes if node.bl_idname == 'ShaderNodeMath')
+    math.inputs[1].default_value += 1.0
+    new = json.loads(nodesharer.NS_material(mat).dump_mat_JSON())
+    ns_string = nodesharer.NS_material(mat).compress()[0]
+    delta_string = nsdelta.encode(nsdelta.diff(base, new), bpy.app.version)
+    print('share one change, 2000 nodes')
+    print('  string length {}, delta string length {}'.format(len(ns_string), len(delta_string)))
+
+    full = best_of(lambda: bpy.data.materials.remove(nodesharer.NS_mat_constructor(ns_string).b_mat), 3)
+    report('paste whole material', full)
+    patched = best_of(lambda: nodesharer.NS_delta_patcher(delta_string, target))
+    report('apply delta', patched, full)
+    bpy.data.materials.remove(target)
+    bpy.data.materials.remove(mat)
+
+
+@benchmark
+def migration():
+    """Fixing Principled BSDF heavy payloads copied in Blender 2.90 for this version,
+        time per node should stay flat
+    """
+    compfixer = importlib.import_module(addon.__name__ + '.compfixer')
+    print('version fix 2.90 -> {}.{}'.format(*bpy.app.version[:2]))
+    for bsdf_count in (250, 500, 1000, 2000, 4000):
+        nodes = {}
+        for i in range(bsdf_count):
+            bsdf = 'BSDF.{}'.format(i)
+            nodes[bsdf] = {'bl_idname': 'ShaderNodeBsdfPrincipled', 'name': bsdf,
+                           'inputs': {str(j): 0.5 for j in range(22)}}
+            # every BSDF is linked to from a few other nodes, like a library material
+            for j in range(4):
+                value = 'Value.{}.{}'.format(i, j)
+                nodes[value] = {'bl_idname': 'ShaderNodeValue', 'name': value,
+                                'outputs': {'0': {bsdf: [j, 18 + j % 3]}}}
+        # fixing changes the nodes, every run gets a copy of its own
+        data = json.dumps(nodes)
+        copies = [json.loads(data) for _ in range(5)]
+        ms = best_of(lambda: compfixer.CompFixer.fix('NS0B2900', copies.pop(), bpy.app.version))
+        report('{} BSDFs, {} nodes'.format(bsdf_count, len(nodes)), ms)
+        print('  {:<40} {:>10.4f} ms'.format('  per node', ms / len(nodes)))
+
+
+def material_corpus():
+    """JSON payloads of the example materials in the README and every material in the open .blend file"""
+    corpus = []
+    readme = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'README.md')
+    if os.path.exists(readme):
+        with open(readme) as file:
+            for ns_string in re.findall(r'NS\d+B\d+!\S+', file.read()):
+                prefix, body = ns_string.split('!', 1)
+                try:
+                    corpus.append(nscodec.decompress(body, nscodec.parse_prefix(prefix)[2]))
+                except Exception:
+                    continue
+    for mat in bpy.data.materials:
+        if mat.use_nodes:
+            corpus.append(nodesharer.NS_material(mat).dump_mat_JSON().encode('utf8'))
+    return corpus
+
+
+@benchmark
+def codecs():
+    """String length against encode and decode speed for every codec, for JSON and nsbinary payloads"""
+    corpus = material_corpus()
+    if not corpus:
+        print('codecs, no materials found')
+        return
+    raw = sum(len(data) for data in corpus)
+    print('codecs, {} materials, {} bytes of JSON'.format(len(corpus), raw))
+    print('  {:<18} {:>10} {:>8} {:>12} {:>12}'.format('codec', 'chars', 'ratio', 'encode ms', 'decode ms'))
+    for name, codec in nscodec.CODECS.items():
+        encoded = [nscodec.compress(data, name) for data in corpus]
+        chars = sum(len(text) for text in encoded)
+        encode_ms = best_of(lambda: [nscodec.compress(data, name) for data in corpus])
+        decode_ms = best_of(lambda: [nscodec.decompress(text, codec[0]) for text in encoded])
+        print('  {:<18} {:>10} {:>8.3f} {:>12.2f} {:>12.2f}'.format(name, chars, chars / raw, encode_ms, decode_ms))
+
+    # The same payloads in the nsbinary encoding, encode and decode times include JSON parsing and writing
+    payloads = [json.loads(data) for data in corpus]
+    binary = [nsbinary.dumps(payload) for payload in payloads]
+    assert [nsbinary.loads(data) for data in binary] == payloads
+    print('  {:<18} {:>10} {:>8.3f} {:>12.2f} {:>12.2f}'.format(
+        'binary raw', sum(len(data) for data in binary), sum(len(data) for data in binary) / raw,
+        best_of(lambda: [nsbinary.dumps(payload) for payload in payloads]),
+        best_of(lambda: [nsbinary.loads(data) for data in binary])))
+    print('  {:<18} {:>10} {:>8} {:>12.2f} {:>12.2f}'.format(
+        'json raw', raw, '1.000',
+        best_of(lambda: [json.dumps(payload, separators=(',', ':')).encode('utf8') for payload in payloads]),
+        best_of(lambda: [json.loads(data) for data in corpus])))
+    for name, codec in nscodec.CODECS.items():
+        encoded = [nscodec.compress(data, name) for data in binary]
+        chars = sum(len(text) for text in encoded)
+        print('  {:<18} {:>10} {:>8.3f}'.format('binary ' + name.lower(), chars, chars / raw))
+
+
+@benchmark
+def transcode():
+    """Node Sharer strings read, checked and written again per second, all without Blender"""
+    corpus = material_corpus()
+    if not corpus:
+        print('transcode, no materials found')
+        return
+    strings = [nscodec.make_prefix((2, 90, 0)) + nscodec.compress(data) for data in corpus]
+    print('transcode, {} strings'.format(len(strings)))
+    for name, func in (('decode', lambda: [nscodec.decode(s) for s in strings]),
+                       ('transcode to 4.2 fast', lambda: [nscodec.transcode(s, (4, 2, 0), 'FAST') for s in strings])):
+        ms = best_of(func)
+        report(name, ms)
+        print('  {:<40} {:>10.0f} strings/s'.format('', len(strings) / ms * 1000))
+
+
+@benchmark
+def startup():
+    """Time a fresh Blender spends importing and registering the add-on,
+        and importing the rest of it the first time an operator runs
+    """
+    addon_dir = os.path.dirname(os.path.abspath(__file__))
+    code = (
+        'import importlib, sys, time\n'
+        'sys.path.insert(0, {parent!r})\n'
+        'start = time.perf_counter()\n'
+        'addon = importlib.import_module({name!r})\n'
+        'addon.register()\n'
+        'registered = time.perf_counter()\n'
+        'importlib.import_module({name!r} + ".nodesharer")\n'
+        'print("NS_STARTUP", registered - start, time.perf_counter() - registered)\n'
+    ).format(parent=os.path.dirname(addon_dir), name=os.path.basename(addon_dir))
+    register_ms = first_use_ms = None
+    for _ in range(3):
+        result = subprocess.run([bpy.app.binary_path, '--background', '--factory-startup', '--python-expr', code],
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        for line in result.stdout.decode('utf8', 'replace').splitlines():
+            if line.startswith('NS_STARTUP'):
+                register_s, first_use_s = map(float, line.split()[1:])
+                register_ms = min(register_ms or register_s * 1000, register_s * 1000)
+                first_use_ms = min(first_use_ms or first_use_s * 1000, first_use_s * 1000)
+    if register_ms is None:
+        print('startup, could not run Blender')
+        return
+    print('startup')
+    report('import and register', register_ms)
+    report('rest of the add-on, on first use', first_use_ms)
+
+
+def main():
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    names = argv or list(BENCHMARKS)
+    print('Node Sharer benchmarks, Blender ' + bpy.app.version_string)
+    for name in names:
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
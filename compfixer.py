@@ -21,123 +21,209 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
-import pprint
-import bpy
-
-
-def upgrade_to_blender2910(nodes):
-    """
-    Blender 2.91 adds a new input to the BSDF node, emit strength in slot 18, moving the previous slot 18 up etc.
-    Anything that connect to slot 18 or above from before 2.91 will have it's slot number increased by one.
-    The input default values will also be updated to match
-    :param nodes: node tree as dict, nodes or groups
-    """
-    _BSDF_node_names = []
-    print('Upgrading nodes to Blender 2.91...')
-    for n in nodes:
-        node = nodes[n]
-
-        if node['bl_idname'] == 'ShaderNodeBsdfPrincipled':
-            # Save the node name for so connections can be updated
-            _BSDF_node_names.append(node['name'])
-
-            # Shift the input default values slots up
-            for i in reversed(range(18, 22 + 1)):
-                nodes[n]['inputs'][str(i)] = node['inputs'][str(i-1)]
-            del nodes[n]['inputs']['18']
-
-    for n in nodes:
-        node = nodes[n]
-        try:
-            for output, targets in node['outputs'].items():
-                for name, ids in targets.items():
-                    if name in _BSDF_node_names:
-                        # increment if the slot is 18 or higher
-                        if isinstance(ids, int) and ids >= 18:
-                            nodes[n]['outputs'][output][name] = ids + 1
-                        elif isinstance(ids, list):
-                            tmp_ids = ids.copy()
-                            for pos, i in enumerate(ids):
-                                if i >= 18:
-                                    tmp_ids[pos] = i + 1
-                            nodes[n]['outputs'][output][name] = tmp_ids
-
-        except KeyError:
-            print('No outputs in node: {}'.format(node['name']))
-
-    print('Nodes upgraded to comply with Blender 2.91')
-
-
-def downgrade_from_blender2910(nodes):
-    """
-    Blender 2.91 adds a new input to the BSDF node, emit strength in slot 18, moving the previous slot 18 up etc.
-    Anything that connect to slot 18 or above from 2.91 or after will have it's slot number decreased by one.
-    The input default values will also be updated to match
-    :param nodes: node tree as dict, nodes or groups
-    """
-    _BSDF_node_names = []
-    print('Downgrading nodes from Blender 2.91...')
-    for n in nodes:
-        node = nodes[n]
-
-        if node['bl_idname'] == 'ShaderNodeBsdfPrincipled':
-            # Save the node name for so connections can be updated
-            _BSDF_node_names.append(node['name'])
-
-            # Shift the input default values slots down
-            for i in range(18, 22):
-                nodes[n]['inputs'][str(i)] = node['inputs'][str(i+1)]
-            del nodes[n]['inputs']['22']
-
-    for n in nodes:
-        node = nodes[n]
-        try:
-            for output, targets in node['outputs'].items():
-                for name, ids in targets.items():
-                    if name in _BSDF_node_names:
-                        # decrement if the slot is 19 or higher
-                        if isinstance(ids, int) and ids >= 19:
-                            nodes[n]['outputs'][output][name] = ids - 1
-                        elif isinstance(ids, list):
-                            tmp_ids = ids.copy()
-                            for pos, i in enumerate(ids):
-                                if i >= 19:
-                                    tmp_ids[pos] = i - 1
-                            nodes[n]['outputs'][output][name] = tmp_ids
-
-        except KeyError:
-            print('No outputs in node: {}'.format(node['name']))
-
-    print('Nodes downgraded to comply with pre Blender 2.91')
-
-
-def version_difference(prefix):
+# Version compatibility fixing, for Node Sharer strings copied in another version of Blender.
+#  Doesn't need Blender, the version to fix for is passed in.
+from . import nscodec
+from .nslog import log
+
+# Socket changes between Blender versions, oldest first. Each one is
+#  (Blender version that made it, node type, 'inputs' or 'outputs', index the new sockets are at, number of new sockets)
+#  sockets from that index on moved up to make room. Going back to an older version the new sockets are dropped,
+#  their values and links with them.
+MIGRATIONS = (
+    # Emission Strength
+    ((2, 91, 0), 'ShaderNodeBsdfPrincipled', 'inputs', 18, 1),
+    # Subsurface IOR and Subsurface Anisotropy (undocumented)
+    ((3, 0, 0), 'ShaderNodeBsdfPrincipled', 'inputs', 4, 2),
+)
+
+# Strings from before this have no version fixing
+_OLDEST = (2, 80, 0)
+
+
+class _SocketRemap(dict):
+    """Old socket index -> new socket index, None if the socket is gone, for one kind of socket
+        of one node type. Indices are worked out the first time they're looked up
     """
-    Not used atm
-    :param prefix:
-    :return:
-    """
-    bv = bpy.app.version
-    blender_version = int(str(bv[0]) + str(bv[1]) + str(bv[2]))
-
-    ns_bv = int(prefix.split('B')[1])
-    if ns_bv != blender_version:
-        return True
-    else:
-        return False
-
 
-def fix(prefix, nodes):
+    def __init__(self, steps):
+        """
+        :param steps: (index, number of sockets) of every change from the old to the new version in order,
+                      a negative number of sockets for changes undone
+        """
+        super().__init__()
+        self.steps = steps
+
+    def __missing__(self, index):
+        new = index
+        for at, count in self.steps:
+            if count > 0:
+                if new >= at:
+                    new += count
+            elif new >= at - count:
+                new += count
+            elif new >= at:
+                new = None
+                break
+        self[index] = new
+        return new
+
+
+class NodeIndex:
+    """Indexed view of the stored nodes of one tree, so changes to some nodes only touch those nodes
+        and the links going into them
     """
-    Fix compatibility
-    :param prefix: Node Sharer prefix
-    :param nodes: Node Sharer node dict
-    """
-    bv = bpy.app.version
-
-    if bv >= (2, 91, 0):
-        if int(prefix.split('B')[1]) < 2910:
-            upgrade_to_blender2910(nodes)
-    elif bv < (2, 91, 0):
-        if int(prefix.split('B')[1]) >= 2910:
-            downgrade_from_blender2910(nodes)
+
+    def __init__(self, nodes):
+        """
+        :param nodes: node tree as dict, nodes or a group, changes made through the index are made to it
+        """
+        self.nodes = nodes
+        self.by_type = {}  # bl_idname -> set of node names
+        for name, node in nodes.items():
+            self.by_type.setdefault(node.get('bl_idname'), set()).add(name)
+
+    def links_to(self, names):
+        """
+        Reverse links of some of the nodes, the other nodes' links are only looked at, not kept
+        :param names: names of the nodes
+        :return: node name -> the link targets of the outputs linked to it, the {to node: input index or indices}
+                 dicts of the nodes the links come from
+        """
+        wanted = set(names)
+        links_to = {}
+        for node in self.nodes.values():
+            for targets in node.get('outputs', {}).values():
+                # plain values are unconnected outputs of old strings
+                if isinstance(targets, dict):
+                    for name in targets:
+                        if name in wanted:
+                            links_to.setdefault(name, []).append(targets)
+        return links_to
+
+    def of_type(self, bl_idname):
+        """Names of the nodes of a type"""
+        return self.by_type.get(bl_idname, ())
+
+
+class CompFixer:
+    """Version compatibility fixing code"""
+
+    # (version of the string, version of Blender) -> remap table, see remap_table()
+    _remap_tables = {}
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def remap_table(cls, from_version, to_version):
+        """
+        All the MIGRATIONS between two versions put together, whichever way round they are
+        :param from_version: version tuple the nodes were copied in
+        :param to_version: version tuple of the Blender they're for
+        :return: {'inputs': {node type: _SocketRemap}, 'outputs': {...}}, empty if nothing changed in between
+        """
+        key = (from_version, to_version)
+        table = cls._remap_tables.get(key)
+        if table is None:
+            if from_version <= to_version:
+                changes = [(m, m[4]) for m in MIGRATIONS if from_version < m[0] <= to_version]
+            else:
+                changes = [(m, -m[4]) for m in reversed(MIGRATIONS) if to_version < m[0] <= from_version]
+            steps = {}
+            for (version, bl_idname, kind, at, _), count in changes:
+                steps.setdefault((kind, bl_idname), []).append((at, count))
+            table = {}
+            for (kind, bl_idname), node_steps in steps.items():
+                table.setdefault(kind, {})[bl_idname] = _SocketRemap(node_steps)
+            cls._remap_tables[key] = table
+        return table
+
+    @staticmethod
+    def remap_sockets(sockets, remap):
+        """Socket dict with its index keys remapped, sockets that are gone left out"""
+        remapped = {}
+        for i, value in sockets.items():
+            new = remap[int(i)]
+            if new is not None:
+                remapped[str(new)] = value
+        return remapped
+
+    @staticmethod
+    def remap_nodes(nodes, table):
+        """
+        Remaps the sockets of one tree, its stored values and links. Only the nodes of the types in the table
+            and the links going into them are changed, the rest of the links are looked at once to find those
+        :param nodes: node tree as dict, nodes or a group
+        :param table: from remap_table()
+        """
+        index = NodeIndex(nodes)
+        # Sockets of nodes stored with their identifiers are found by identifier when they're built,
+        #  see NS_node.__init__(), their indices are left as they are
+        for bl_idname, remap in table.get('outputs', {}).items():
+            for name in index.of_type(bl_idname):
+                node = nodes[name]
+                if 'out_ids' in node:
+                    continue
+                for key in ('outputs', 'out_dv'):
+                    if key in node:
+                        node[key] = CompFixer.remap_sockets(node[key], remap)
+        input_remaps = {name: remap for bl_idname, remap in table.get('inputs', {}).items()
+                        for name in index.of_type(bl_idname) if 'in_ids' not in nodes[name]}
+        if not input_remaps:
+            return
+        # Links are stored on the node they come from
+        links_to = index.links_to(input_remaps)
+        for name, remap in input_remaps.items():
+            node = nodes[name]
+            if 'inputs' in node:
+                node['inputs'] = CompFixer.remap_sockets(node['inputs'], remap)
+            for targets in links_to.get(name, ()):
+                ids = targets[name]
+                if isinstance(ids, int):
+                    ids = remap[ids]
+                else:
+                    ids = [remap[i] for i in ids if remap[i] is not None] or None
+                if ids is None:
+                    del targets[name]
+                else:
+                    targets[name] = ids
+
+    @staticmethod
+    def version_difference(prefix, blender_version):
+        """
+        Not used atm
+        :param prefix:
+        :param blender_version: version tuple, like bpy.app.version
+        :return:
+        """
+        blender_version = int(nscodec.blender_version_code(blender_version))
+
+        ns_bv = nscodec.parse_prefix(prefix)[1]
+        if ns_bv != blender_version:
+            return True
+        else:
+            return False
+
+    @staticmethod
+    def fix(prefix, nodes, blender_version, groups=None):
+        """
+        Fix compatibility
+        :param prefix: Node Sharer prefix
+        :param nodes: Node Sharer node dict
+        :param blender_version: version tuple of the Blender the nodes are for, like bpy.app.version
+        :param groups: the groups of the payload, group name -> node dict, fixed too
+        """
+        bv = tuple(blender_version)[:3]
+        ns_bv = nscodec.blender_version_tuple(nscodec.parse_prefix(prefix)[1])
+        if ns_bv < _OLDEST:
+            return
+
+        table = CompFixer.remap_table(ns_bv, bv)
+        if not table:
+            return
+        log.info('Fixing nodes copied in Blender %s for Blender %s...',
+                 '.'.join(map(str, ns_bv)), '.'.join(map(str, bv)))
+        CompFixer.remap_nodes(nodes, table)
+        for group_nodes in (groups or {}).values():
+            CompFixer.remap_nodes(group_nodes, table)
@@ -23,20 +23,24 @@ SOFTWARE.
 """
 
 import bpy # type: ignore
-import pprint
 import json
-import inspect
-import zlib
-import base64
-import os
-from bpy.props import StringProperty, BoolProperty # type: ignore
-from bpy_extras.io_utils import ImportHelper, ExportHelper # type: ignore
+import time
+from functools import partial
+from operator import attrgetter
 
-# from . import compfixer
+from . import nscodec, nsdelta, nsstream
+from .nslog import log, timings
 
+_MISSING = object()  # getattr() default for attributes a node doesn't have
+_PLAIN_TYPES = frozenset((int, str, bool, float, type(None)))  # attribute values stored as they are
+
+# Stored node properties NS_build_plan handles itself, everything else is set with setattr
+_BUILD_HANDLED = frozenset(('bl_idname', 'name', 'location', 'node_tree', 'inputs', 'out_dv',
+                            'outputs', 'color_ramp', 'mapping', 'parent', 'in_ids', 'out_ids'))
 
 def dump(obj):
     """Dumps class variables and functions for debug"""
+    import inspect  # debug only, not worth importing with the add-on
     print('\n')
     for attr in dir(obj):
         if hasattr(obj, attr):
@@ -74,184 +78,326 @@ class NS_node:
                             'width_hidden', 'interface', 'object', 'text', 'color', 'height', 'image',
                             'width', 'filepath')  # never saved cus they are useless or created with the node by blender
 
-    def __init__(self, node, *args, **kwargs):
+    # Capture schemas, (bl_idname, blender version) -> tuple of (attribute, handler) pairs.
+    #  Working out which attributes of a node matter means calling dir() and sorting
+    #  every attribute against the lists above, which is slow, so it is only done
+    #  for the first node of each type and reused for every other node of that type
+    _schema_cache = {}
+    use_schema_cache = True  # False works the schema out again for every node, for benchmarking
+
+    # Socket default values of new nodes, (tree type, bl_idname, blender version) ->
+    #  {'inputs': ((identifier, value), ...), 'outputs': ...}, or None for types that can't be made
+    #  in a scratch tree. Socket values that are still the
+    #  same as on a new node aren't stored, a node built from the string has them already
+    _socket_defaults_cache = {}
+    diff_socket_defaults = True  # False stores every socket value, like older versions did
+
+    # (bl_idname, blender version) -> split schema, see get_signature_schema()
+    _signature_schema_cache = {}
+
+    def __init__(self, node, links_from=None, socket_identifiers=False, *args, **kwargs):
+        """
+        :param node: blender node to store
+        :param links_from: links of the node's tree from NS_nodetree.index_links(),
+                           worked out here if not given
+        :param socket_identifiers: also store the identifiers of the sockets that have values or links stored,
+                                   as 'in_ids'/'out_ids': {index: identifier}. Identifiers stay the same when
+                                   a version of Blender adds sockets before them, so nodes are built by
+                                   identifier and the indices only are a fallback
+        """
         self.properties = {}
         self.blender_source_node = node
+        self.store_socket_identifiers = socket_identifiers
+        if links_from is None:
+            links_from = NS_nodetree.index_links(node.id_data)
+        self._links_from = links_from
 
         # Store the node properties into self.properties,
-        #  self.nodetree_inside_node is used in case this
+        #  self.nodetree_inside_node is the blender node tree in case this
         #  node is actually a node tree with more nodes inside it
         self.nodetree_inside_node = self.store_blender_node_properties()
         self.name = self.properties['name']
 
+    @classmethod
+    def get_schema(cls, node):
+        """Returns the capture schema for the node's type, building it if it isn't cached yet"""
+        key = (node.bl_idname, bpy.app.version)
+        schema = cls._schema_cache.get(key) if cls.use_schema_cache else None
+        if schema is None:
+            schema = cls.build_schema(node)
+            if cls.use_schema_cache:
+                cls._schema_cache[key] = schema
+        return schema
+
+    @classmethod
+    def build_schema(cls, node):
+        """Sort every attribute of a node into how it should be saved,
+            attributes that are never saved are left out of the schema
+        """
+        schema = []
+        for attr in dir(node):
+            if attr in cls._prop_common_ignored:  # Sort out all unwanted properties
+                continue
+            if attr[:1] == '_':  # Sort out double underscore
+                continue
+            if not hasattr(node, attr):
+                continue
+
+            if attr in cls._prop_common:
+                if attr in ('inputs', 'outputs', 'location'):
+                    schema.append((attr, attr))
+                else:
+                    schema.append((attr, 'common'))
+            elif attr in cls._prop_optional:
+                schema.append((attr, 'optional'))
+            elif attr in ('node_tree', 'color_ramp', 'mapping'):
+                schema.append((attr, attr))
+            elif callable(getattr(node, attr)):  # functions are never saved
+                continue
+            else:  # Catch all. for the random named attributes
+                schema.append((attr, 'catch_all'))
+        return tuple(schema)
+
+    @staticmethod
+    def socket_value(socket):
+        """A socket's default_value the way it's stored, rounded, or _MISSING if it doesn't have one"""
+        value = getattr(socket, 'default_value', None)
+        if value is None:
+            return _MISSING
+        if type(value) == str:
+            return value
+        try:
+            # default values, like if you manually set a Transform
+            #  geo node to specific values, are also inputs/outputs
+            return round(value, 5)
+        except:
+            try:
+                return tuple(round(tmp_v, 5) for tmp_v in value)
+            except Exception:
+                return _MISSING
+
+    @classmethod
+    def get_socket_defaults(cls, node):
+        """
+        The socket values of a new node of the node's type, worked out once per type with a
+            scratch node, see _socket_defaults_cache
+        :return: {'inputs': ((identifier, value), ...), 'outputs': ...}, or None if they can't be worked out
+        """
+        key = (node.id_data.bl_idname, node.bl_idname, bpy.app.version)
+        defaults = cls._socket_defaults_cache.get(key, _MISSING)
+        if defaults is _MISSING:
+            # None is cached too, so a type that can't be made isn't tried again for every node
+            defaults = None
+            scratch_tree = None
+            try:
+                scratch_tree = bpy.data.node_groups.new('.NS socket defaults', key[0])
+                scratch = scratch_tree.nodes.new(key[1])
+                defaults = {kind: tuple((socket.identifier, cls.socket_value(socket))
+                                        for socket in getattr(scratch, kind))
+                            for kind in ('inputs', 'outputs')}
+            except (RuntimeError, TypeError) as e:
+                # bpy raises RuntimeError for node types it can't make, TypeError for unknown tree types
+                log.debug('No socket defaults for %s: %s', key[1], e)
+            finally:
+                if scratch_tree is not None:
+                    bpy.data.node_groups.remove(scratch_tree)
+            cls._socket_defaults_cache[key] = defaults
+        return defaults
+
+    @staticmethod
+    def is_default(defaults, index, socket, value):
+        """True if the socket at index has the value a new node has there"""
+        if defaults is None or index >= len(defaults):
+            return False
+        identifier, default = defaults[index]
+        # Nodes with sockets that come and go can have other sockets at the same index
+        return identifier == socket.identifier and default == value
+
+    @classmethod
+    def get_signature_schema(cls, node):
+        """
+        The capture schema split for signature(): a getter of all the plain attributes at once,
+            and the (attribute, handler) pairs that need more than that
+        """
+        key = (node.bl_idname, bpy.app.version)
+        signature_schema = cls._signature_schema_cache.get(key)
+        if signature_schema is None:
+            schema = cls.get_schema(node)
+            plain = tuple(k for k, handler in schema if handler in ('common', 'optional', 'catch_all'))
+            # attrgetter returns a bare value for a single attribute
+            getter = attrgetter(*plain) if len(plain) > 1 else (lambda n, keys=plain: tuple(getattr(n, k) for k in keys))
+            signature_schema = (getter, 'use_custom_color' in plain,
+                                tuple((k, handler) for k, handler in schema if k not in plain))
+            cls._signature_schema_cache[key] = signature_schema
+        return signature_schema
+
+    @classmethod
+    def signature(cls, node, links_from, socket_identifiers=False):
+        """
+        A value that changes whenever what store_blender_node_properties() stores for the node would,
+            made from the same attributes, but without any of the rounding, dicts or JSON
+        :param links_from: links of the node's tree from NS_nodetree.index_links()
+        :param socket_identifiers: what the node is captured with, see __init__()
+        """
+        getter, custom_color, other = cls.get_signature_schema(node)
+        try:
+            plain = getter(node)
+        except AttributeError:
+            # An attribute this type of node usually has is missing, a new object is never
+            #  equal to the last signature, so the node is always captured again
+            return object()
+        # Parents, groups and other datablocks are stored by name
+        signature = [cls.diff_socket_defaults, socket_identifiers,
+                     tuple(value if value.__class__ in _PLAIN_TYPES else getattr(value, 'name', None)
+                           for value in plain)]
+        if custom_color and node.use_custom_color:
+            signature.append(tuple(node.color))
+        for k, handler in other:
+            value = getattr(node, k, _MISSING)
+            if value is _MISSING or value is None:
+                signature.append(value)
+            elif handler == 'inputs':
+                signature.append(tuple((socket.identifier, cls.socket_value(socket)) for socket in value))
+                if socket_identifiers:
+                    signature.append(tuple(socket.is_linked for socket in value))
+            elif handler == 'outputs':
+                for socket in value:
+                    targets = links_from.get(socket.as_pointer())
+                    signature.append((socket.identifier, cls.socket_value(socket),
+                                      tuple((name, tuple(ids)) for name, ids in targets.items()) if targets else None))
+            elif handler == 'location':
+                signature.append(tuple(value))
+            elif handler == 'node_tree':
+                signature.append(value.name)
+            elif handler == 'color_ramp':
+                signature.append((value.color_mode, value.hue_interpolation, value.interpolation,
+                                  tuple((element.position, tuple(element.color)) for element in value.elements)))
+            elif handler == 'mapping':
+                signature.append((value.clip_max_x, value.clip_max_y, value.clip_min_x, value.clip_min_y,
+                                  value.extend, value.tone, value.use_clip,
+                                  tuple(tuple(tuple(point.location) for point in curve.points)
+                                        for curve in value.curves)))
+        return tuple(signature)
+
     def store_blender_node_properties(self):
         """Store a node's properties  - returns the sub-tree
             if this node is actually a sub-tree as an NS_group
         """
         to_return = None
-        tmp_prop = {}
-        # fill the dict tmp_prop with all the node's properties
-        for attr in dir(self.blender_source_node):
-#            print(attr, end=" : ")  #DEBUG
-            # No idea why this is wrapped like this,
-            #  but don't see the harm?
-            ### AHH we do this to make it iterable
-            if hasattr(self.blender_source_node, attr):
-#                print(attr) #DEBUG
-                tmp_prop[attr] = getattr(self.blender_source_node, attr)
-#            else: #DEBUG
-#                print("!!!!!!!!!!!!!!!!!") #DEBUG
-
-        for k in tmp_prop:  # for key in node properties
-            if k in self._prop_common:
-                if k == 'inputs':
-                    tmp_inputs = {}
-                    for index, node_inputs in enumerate(self.blender_source_node.inputs):
-                        # key = '' + str(idx)
-                        key = index
-                        # save default values a node has
-                        if hasattr(node_inputs, 'default_value') == False:
-#                            print (node_inputs.name + " has no default")
-                            continue
-                        if node_inputs.default_value == None:
-#                            print (node_outputs.name + " default is None")
-                            continue
-                        if type(node_inputs.default_value) == str:
-                            tmp_inputs[key] = node_inputs.default_value
-                        else:
-                            try:
-                                try:
-                                    # default values, like if you manually set a Transform
-                                    #  geo node to specific values, are also inputs/outputs
-                                    tmp_inputs[key] = round(node_inputs.default_value, 5)
-                                except:
-                                    tmp_inputs[key] = tuple(round(tmp_v, 5) for tmp_v in node_inputs.default_value)
-                            except Exception as e:
-    #                            print('input ' + str(index) + ' not default value')
-    #                            print(e)
-                                # tmp_inputs[key] = ''
-                                pass
-                    if tmp_inputs != {}:
-                        self.properties[k] = tmp_inputs
-
-                elif k == 'outputs':
-                    tmp_outputs = {}
-                    output_default_value = {}
-                    for index, node_outputs in enumerate(self.blender_source_node.outputs):
-                        # key = '' + str(idx)
-                        print ("Output node socket: " + str(index) + " : of : " + self.blender_source_node.name + " : value : " +node_outputs.type)
-                        key = index
-                        # save default values a node has
-                        if hasattr(node_outputs, 'default_value') == False:
-                            print (node_outputs.name + " has no default")
-                            
-                        elif node_outputs.default_value == None:
-                            print (node_outputs.name + " default is None")
-                            
-                        elif type(node_outputs.default_value) == str:
-                            tmp_outputs[key] = node_outputs.default_value
-                        else:
-                            try:
-                                try:
-                                    print ("!!!")
-                                    output_default_value[key] = round(node_outputs.default_value, 5)
-                                except:
-                                    print("got here")
-                                    try:
-                                        output_default_value[key] = tuple(round(tmp_v, 5) for tmp_v in node_outputs.default_value)
-                                    except AttributeError:
-                                        print('now here')
-                                        pass
-                            except AttributeError:
-                                print('and lastly here')
-                                pass
+        node = self.blender_source_node
+        # Group node sockets come from their group, not the node type
+        defaults = None
+        if self.diff_socket_defaults and getattr(node, 'node_tree', None) is None:
+            defaults = self.get_socket_defaults(node)
+
+        for k, handler in self.get_schema(node):  # for key in node properties
+            value = getattr(node, k, _MISSING)
+            if value is _MISSING:
+                continue
 
-                        try:
-                            print('node outputs of ' + node_outputs.name)
-                            if node_outputs.is_linked:
-                                print("saving links")
-                                tmp_links = {}
-                                for node_links in node_outputs.links:
-                                    s = node_links.to_socket.path_from_id()
-                                    s = int((s.split('inputs['))[1].split(']')[0])
-                                    tmp_link_name = node_links.to_node.name
-                                    if tmp_link_name in tmp_links:
-                                        try:
-                                            tmp_links[tmp_link_name] = tmp_links.get(tmp_link_name) + (s,)
-                                        except:
-                                            tmp_links[tmp_link_name] = (tmp_links.get(tmp_link_name),) + (s,)
-                                    else:
-                                        tmp_links[tmp_link_name] = s
-
-                                tmp_outputs[key] = tmp_links
-                        except:
-                            tmp_outputs[node_outputs] = str(node_outputs.links)
-                    if tmp_outputs != {}:
-                        print ("saved temp outputs?")
-                        self.properties[k] = tmp_outputs
-                    if output_default_value != {}:
-                        print("saved output default")
-                        self.properties['out_dv'] = output_default_value
-
-                elif k == 'location':
-                    try:
-                        self.properties['location'] = (round(tmp_prop[k][0]), round(tmp_prop[k][1]),)
-                    except:
-                        print("location/vector dump failed")
+            if handler == 'inputs':
+                tmp_inputs = {}
+                input_ids = {}
+                input_defaults = defaults and defaults['inputs']
+                for index, node_inputs in enumerate(value):
+                    # links to this input are stored on the node they come from, by index
+                    if self.store_socket_identifiers and node_inputs.is_linked:
+                        input_ids[index] = node_inputs.identifier
+                    # save default values a node has, if they were changed
+                    socket_value = self.socket_value(node_inputs)
+                    if socket_value is _MISSING or self.is_default(input_defaults, index, node_inputs, socket_value):
+                        continue
+                    tmp_inputs[index] = socket_value
+                    if self.store_socket_identifiers:
+                        input_ids[index] = node_inputs.identifier
+                if tmp_inputs != {}:
+                    self.properties[k] = tmp_inputs
+                if input_ids != {}:
+                    self.properties['in_ids'] = dict(sorted(input_ids.items()))
+
+            elif handler == 'outputs':
+                tmp_outputs = {}
+                output_default_value = {}
+                output_defaults = defaults and defaults['outputs']
+                for index, node_outputs in enumerate(value):
+                    key = index
+                    # save default values a node has, if they were changed
+                    socket_value = self.socket_value(node_outputs)
+                    if socket_value is _MISSING or self.is_default(output_defaults, index, node_outputs, socket_value):
+                        pass
+                    elif type(socket_value) == str:
+                        tmp_outputs[key] = socket_value
+                    else:
+                        output_default_value[key] = socket_value
+
+                    # Links are stored as to node name -> input index, or a list of
+                    #  input indices if the output connects to several inputs of that node
+                    targets = self._links_from.get(node_outputs.as_pointer())
+                    if targets:
+                        tmp_outputs[key] = {name: ids[0] if len(ids) == 1 else ids
+                                            for name, ids in targets.items()}
+                if tmp_outputs != {}:
+                    self.properties[k] = tmp_outputs
+                if output_default_value != {}:
+                    self.properties['out_dv'] = output_default_value
+                if self.store_socket_identifiers and (tmp_outputs or output_default_value):
+                    self.properties['out_ids'] = {index: value[index].identifier
+                                                  for index in sorted(set(tmp_outputs) | set(output_default_value))}
+
+            elif handler == 'location':
+                try:
+                    self.properties['location'] = (round(value[0]), round(value[1]),)
+                except:
+                    log.warning('location/vector dump failed for node %s', node.name)
 
-                else:
-                    self.properties[k] = tmp_prop[k]
+            elif handler == 'common':
+                self.properties[k] = value
 
-            elif k in self._prop_optional:
-                value = tmp_prop[k]
+            elif handler == 'optional':
                 if value != self._prop_optional[k]:
                     if k == 'parent':
                         self.properties[k] = value.name
                         continue
                     self.properties[k] = value
                     if k == 'use_custom_color':
-                        self.properties['color'] = tuple(round(tmp_v, 5) for tmp_v in tmp_prop['color'])
+                        self.properties['color'] = tuple(round(tmp_v, 5) for tmp_v in node.color)
 
-            elif k in self._prop_common_ignored:  # Sort out all unwanted properties
-                continue
-
-            elif k[:1] == '_':  # Sort out double underscore
-                continue
-
-            elif k == 'node_tree':
+            elif handler == 'node_tree':
                 try:
-                    self.properties['node_tree'] = tmp_prop[k].name
-                    to_return = {tmp_prop[k].name: NS_group(tmp_prop[k])}
+                    self.properties['node_tree'] = value.name
+                    # The group itself is captured by the NS_nodetree this node is added to,
+                    #  so a group used by many group nodes is only captured once
+                    to_return = value
                 except Exception as e:
-                    print('Group node tree failed')
-                    print(e)
-            elif k == 'color_ramp':
+                    log.warning('Group node tree failed: %s', e)
+
+            elif handler == 'color_ramp':
                 tmp_cr = {}
                 tmp_elements = {}
 
-                tmp_cr['color_mode'] = tmp_prop[k].color_mode
-                tmp_cr['hue_interpolation'] = tmp_prop[k].hue_interpolation
-                tmp_cr['interpolation'] = tmp_prop[k].interpolation
+                tmp_cr['color_mode'] = value.color_mode
+                tmp_cr['hue_interpolation'] = value.hue_interpolation
+                tmp_cr['interpolation'] = value.interpolation
 
-                for element in tmp_prop[k].elements:
+                for element in value.elements:
                     tmp_elements[round(element.position, 5)] = tuple(round(tmp_v, 5) for tmp_v in element.color)
                 tmp_cr['elements'] = tmp_elements
                 self.properties[k] = tmp_cr
 
-            elif k == 'mapping':
+            elif handler == 'mapping':
                 tmp_mapping = {}
                 tmp_curves = {}
 
-                tmp_mapping['clip_max_x'] = tmp_prop[k].clip_max_x
-                tmp_mapping['clip_max_y'] = tmp_prop[k].clip_max_y
-                tmp_mapping['clip_min_x'] = tmp_prop[k].clip_min_x
-                tmp_mapping['clip_min_y'] = tmp_prop[k].clip_min_y
+                tmp_mapping['clip_max_x'] = value.clip_max_x
+                tmp_mapping['clip_max_y'] = value.clip_max_y
+                tmp_mapping['clip_min_x'] = value.clip_min_x
+                tmp_mapping['clip_min_y'] = value.clip_min_y
 
-                tmp_mapping['extend'] = tmp_prop[k].extend
-                tmp_mapping['tone'] = tmp_prop[k].tone
-                tmp_mapping['use_clip'] = tmp_prop[k].use_clip
+                tmp_mapping['extend'] = value.extend
+                tmp_mapping['tone'] = value.tone
+                tmp_mapping['use_clip'] = value.use_clip
 
-                for idc, curve in enumerate(tmp_prop[k].curves):
+                for idc, curve in enumerate(value.curves):
                     tmp_points = {}
                     for idp, point in enumerate(curve.points):
                         tmp_points[idp] = (round(point.location[0], 5), round(point.location[1], 5),)
@@ -261,11 +407,11 @@ class NS_node:
                 self.properties[k] = tmp_mapping
 
             else:  # Catch all. for the random named attributes
-                if isinstance(tmp_prop[k], (int, str, bool, float)):
-                    self.properties[k] = tmp_prop[k]
+                if isinstance(value, (int, str, bool, float)):
+                    self.properties[k] = value
                 else:
                     try:
-                        self.properties[k] = tmp_prop[k].name
+                        self.properties[k] = value.name
                     except:
                         pass
                         # self.properties[k] = 'object'
@@ -273,6 +419,7 @@ class NS_node:
         return to_return  # Return to pass through
 
     def print_prop(self):
+        import pprint
         pprint.pprint(self.properties)
         print('\n')
 
@@ -288,7 +435,11 @@ class NS_nodetree:
     #      Also probably wrap all of NS_mat_constructor in here?
     groups = {}
 
-    def __init__(self, blender_nodetree = None):
+    def __init__(self, blender_nodetree = None, socket_identifiers=False):
+        """
+        :param blender_nodetree: blender node tree to capture
+        :param socket_identifiers: capture nodes with their socket identifiers, see NS_node.__init__()
+        """
         # some data members, filled out by constructor methods
         self.name = None
         self.nodetree_type = None
@@ -298,6 +449,30 @@ class NS_nodetree:
         #  this used to be held in an input and output dict like a node,
         #  but in 4.0 they changed this to be in NodeTree.NodeTreeInterface
         self.interface = None
+        # blender node tree pointer -> links of that tree, see index_links()
+        self._link_indexes = {}
+        # blender node tree pointer -> NS_group, every group met while capturing,
+        #  shared with the NS_groups of this tree so each group is captured once
+        self._group_memo = {}
+        self.socket_identifiers = socket_identifiers
+        # When building: 'COPY' makes every group of the payload,
+        #  'INSTANCE' uses identical groups already in the file, see find_identical_group()
+        self.group_mode = 'COPY'
+        self._group_fingerprints = {}  # payload group name -> fingerprint, in INSTANCE mode
+        self._group_index_refreshed = False
+        # When building in steps, like the modal paste does: time.perf_counter() time to stop at
+        #  and hand control back to Blender, None builds everything in one go, see *_steps() methods
+        self.deadline = None
+        self.steps_done = 0  # nodes created and links made
+        self.build_total = None  # nodes and links to make, None if not known up front
+        self._stream_file = None  # node tree file being built as it's read
+        # (bpy.data collection name, name) of the datablocks created, and the group node
+        #  added to the editor, so a build can be undone, see rollback()
+        self._new_datablocks = []
+        self._new_group_node = None
+        # id(stored nodes) -> (stored nodes, NS_build_plan), see plan_of(). Plans live as long as
+        #  the builder, NS_mat_constructor keeps them with the payload in its payload cache
+        self._plans = {}
         if (blender_nodetree != None):
             self.construct_from_blender_nodetree(blender_nodetree)
         
@@ -313,16 +488,53 @@ class NS_nodetree:
             self.get_interface_info_from_blender(blender_nodetree.interface)
         
 
+    @staticmethod
+    def index_links(blender_node_tree):
+        """Goes over all the links of a tree once and returns them as
+            output socket pointer -> {to node name: [input index, ...]}
+            Input indices are only worked out for nodes that have links going into them
+        """
+        input_indices = {}  # input socket pointer -> index on its node
+        links_from = {}
+        for link in blender_node_tree.links:
+            to_socket = link.to_socket.as_pointer()
+            if to_socket not in input_indices:
+                for index, socket in enumerate(link.to_node.inputs):
+                    input_indices[socket.as_pointer()] = index
+            targets = links_from.setdefault(link.from_socket.as_pointer(), {})
+            targets.setdefault(link.to_node.name, []).append(input_indices[to_socket])
+        return links_from
+
     def add_node(self, blender_node):
         """Add node to this NS_nodetree from a blender node object"""
-        n = NS_node(blender_node)
+        # The links of a tree are indexed once, for the first node added from it
+        blender_node_tree = blender_node.id_data
+        links_from = self._link_indexes.get(blender_node_tree.as_pointer())
+        if links_from is None:
+            links_from = self.index_links(blender_node_tree)
+            self._link_indexes[blender_node_tree.as_pointer()] = links_from
+        n = NS_node(blender_node, links_from, self.socket_identifiers)
         self._nodes[n.name] = n
 
         # A node can be an entire node tree itself, if it is,
         #  add the node tree 
         if n.nodetree_inside_node is not None:
-            k, v = n.nodetree_inside_node.popitem()
-            self.groups[k] = v
+            try:
+                self.add_group(n.nodetree_inside_node)
+            except Exception as e:
+                log.warning('Group node tree failed: %s', e)
+
+    def add_group(self, blender_node_tree):
+        """Capture a group's node tree into self.groups, unless it already was.
+            Groups nested in it end up in the same flat self.groups, before it
+        """
+        key = blender_node_tree.as_pointer()
+        ns_group = self._group_memo.get(key)
+        if ns_group is None:
+            ns_group = NS_group(blender_node_tree, self.groups, self._group_memo, self.socket_identifiers)
+            self._group_memo[key] = ns_group
+            self.groups[blender_node_tree.name] = ns_group
+        return ns_group
     
     
     def populate_nodetree(self, blender_node_tree):
@@ -340,7 +552,7 @@ class NS_nodetree:
         return tmp_dict
 
     def print_tree(self):
-        """Print tree"""
+        """Print tree, for debugging"""
         for k in self._nodes:
             print('\n')
             self._nodes[k].print_prop()
@@ -359,6 +571,11 @@ class NS_nodetree:
         # return json.dumps(d, separators=(',', ':'), default=lambda o: o.toJSON())
 
     def dumps_nodetree_JSON(self):
+        #print('JSON dump of nodes')
+        return self.dumps_JSON(self.make_nodetree_dict())
+
+    def make_nodetree_dict(self):
+        """The node tree as the dict that gets saved as JSON"""
         # All trees have name, type, and nodes
         nodetree_dict_to_jsonify = {'name': self.name,
                          'type': self.nodetree_type,
@@ -369,8 +586,7 @@ class NS_nodetree:
         # Add interface data
         if self.interface != None:
             nodetree_dict_to_jsonify['interface'] = self.interface
-        #print('JSON dump of nodes')
-        return self.dumps_JSON(nodetree_dict_to_jsonify)
+        return nodetree_dict_to_jsonify
     
     def get_interface_info_from_blender(self, blender_nodetree_interface : bpy.types.NodeTreeInterface):
         """ We're storing a direct link to the blender NodeTreeInterface for this node tree
@@ -433,19 +649,17 @@ class NS_nodetree:
                     try:
                         # If it's a list/vector, this should work
                         interface_properties[property] = tuple(interface_properties[property])
-                        print("Saved " + property + " as a tuple, " + str(interface_properties[property]))
+                        log.debug('Saved %s as a tuple, %s', property, interface_properties[property])
                     except Exception as e:
                         # It was probably an object
-                        print(e)
-                        print("Couldn't save " + property + " on it's own, trying to save it's blender ID path ")
+                        log.debug("Couldn't save %s on it's own (%s), trying to save it's blender ID path", property, e)
                         
                         try:
                             interface_properties[property] = repr(interface_properties[property])#.id_data
-                            print("Saved " + property + " as a name, " + interface_properties[property])
+                            log.debug('Saved %s as a name, %s', property, interface_properties[property])
                         except Exception as e:
-                            print(e)
                             interface_properties[property] = None
-                            print("Couldn't save " + property + " as a name, either, so saving it as None")
+                            log.warning("Couldn't save %s as a name either (%s), so saving it as None", property, e)
                 # else:
                 #     try:
                 #         propertyValue = repr(interface_properties[property])
@@ -473,13 +687,134 @@ class NS_nodetree:
         self.groups = input_data.get("groups")
         #if hasattr(input_data, "interface"):
         self.interface = input_data.get("interface")
-        print(self.name + " Had an interface")
         #else:
         #    self.interface = None
             
 
         self.create_full_blender_nodetree()
 
+    def construct_from_JSON_steps(self, JSON_input):
+        """
+        construct_from_JSON() in steps, see deadline, JSON_input is read before the first step
+        :param JSON_input: node tree JSON, or the dict of it, like nscodec.load_tree_json() gives
+        """
+        input_data = json.loads(JSON_input) if isinstance(JSON_input, str) else JSON_input
+        self.construct_header(input_data)
+        self._nodes = input_data.get("nodes")
+        self.groups = input_data.get("groups")
+        self.build_total = self.count_steps(self._nodes, self.groups)
+        return self.full_nodetree_steps()
+
+    def construct_from_file(self, file):
+        """
+        Builds a node tree from a node tree file as it's read, see nsstream.
+            Files not written by write_to_file() may have the nodes before the groups,
+            those are read whole and then built
+        :param file: text file, see nsstream.open_tree_file()
+        :return: the name of the blender node tree
+        """
+        for _ in self.construct_from_file_steps(file):
+            pass
+        return self.b_nodeTree_name_actual
+
+    def construct_from_file_steps(self, file):
+        """construct_from_file() in steps, see deadline"""
+        self._stream_file = file
+        header = {}
+        streaming = None  # None until the first groups or nodes, then whether to build as we go
+        buffered_groups = {}
+        for kind, key, value in nsstream.iter_tree(file):
+            if kind == 'header':
+                header[key] = value
+                continue
+            if streaming is None:
+                streaming = header.get('stream') == nsstream.STREAM_VERSION
+                if streaming:
+                    self.construct_header(header)
+                    self.create_blender_nodetree_shell()
+            if not streaming:
+                if kind == 'group':
+                    buffered_groups[key] = dict(value)
+                else:
+                    self._nodes = dict(value)
+            elif kind == 'group':
+                yield from self.group_steps(key, value)
+            else:
+                yield from self.nodes_steps(value, self.b_nodeTree_name_actual, is_nodegroup=True)
+
+        if streaming:
+            return
+        log.debug('Node tree file not written leaves first, built after reading it whole')
+        self.construct_header(header)
+        self.groups = buffered_groups or None
+        self._stream_file = None
+        self.build_total = self.count_steps(self._nodes, self.groups)
+        yield from self.full_nodetree_steps()
+
+    def construct_header(self, header):
+        """Sets name, type and interface from the top level of a node tree dict"""
+        self.name = header.get("name")
+        self.type = header.get("type")
+        self.interface = header.get("interface")
+
+    @classmethod
+    def write_to_file(cls, blender_node_tree, file):
+        """
+        Saves a blender node tree to a node tree file, capturing and writing one node at a time,
+            so memory use doesn't grow with the size of the tree, see nsstream
+        :param blender_node_tree: blender node tree to save
+        :param file: text file, see nsstream.open_tree_file()
+        """
+        header = {'name': blender_node_tree.name,
+                  'type': blender_node_tree.bl_idname}
+        interface = cls.capture_interface(blender_node_tree)
+        if interface is not None:
+            header['interface'] = interface
+        b_groups, order = cls.collect_groups(blender_node_tree)
+
+        def capture(b_tree):
+            links_from = cls.index_links(b_tree)
+            for node in b_tree.nodes:
+                ns_node = NS_node(node, links_from)
+                yield ns_node.name, ns_node.properties
+
+        with timings.phase('capture'):
+            nsstream.write_tree(file, header,
+                                ((name, capture(b_groups[name])) for name in order),
+                                capture(blender_node_tree))
+
+    @classmethod
+    def capture_interface(cls, blender_node_tree):
+        """The interface of a blender node tree the way make_nodetree_dict() stores it, None if it has none"""
+        if not hasattr(blender_node_tree, 'interface'):
+            return None
+        ns_tree = cls()
+        ns_tree.get_interface_info_from_blender(blender_node_tree.interface)
+        return ns_tree.interface
+
+    @classmethod
+    def collect_groups(cls, blender_node_tree):
+        """
+        Finds every group used in a blender node tree, at any depth, without capturing anything
+        :return: (group name -> blender node tree, group names leaves first, see group_build_order())
+        """
+        b_groups = {}
+        uses = {}  # in the form group_build_order() takes
+        to_visit = [blender_node_tree]
+        while to_visit:
+            b_tree = to_visit.pop()
+            tree_uses = {}
+            for node in b_tree.nodes:
+                b_group = getattr(node, 'node_tree', None)
+                if b_group is None:
+                    continue
+                tree_uses[node.name] = {'node_tree': b_group.name}
+                if b_group.name not in b_groups:
+                    b_groups[b_group.name] = b_group
+                    to_visit.append(b_group)
+            if b_tree is not blender_node_tree:
+                uses[b_tree.name] = tree_uses
+        return b_groups, cls.group_build_order(uses)
     
     
     def create_full_blender_nodetree(self, add_as_independent_tree = False):
@@ -491,9 +826,36 @@ class NS_nodetree:
         returns the name of the blender nodetree, since blender python objects are
           only temporary
         """
+        for _ in self.full_nodetree_steps(add_as_independent_tree):
+            pass
+        return self.b_nodeTree_name_actual
+
+    def full_nodetree_steps(self, add_as_independent_tree = False):
+        """create_full_blender_nodetree() in steps, see deadline"""
+        self.create_blender_nodetree_shell(add_as_independent_tree)
+
+        # Construct groups first, groups used inside other groups before the groups using them,
+        #  a group node only gets its sockets once its node tree has been built
+        if self.groups is not None:
+            log.debug('Constructing groups')
+            # NS_groups are only for nodetree info, not group and metadata info
+            for ns_grp in self.group_build_order(self.groups):
+                yield from self.group_steps(ns_grp, self.groups[ns_grp])
+        else:
+            log.debug("Didn't find groups to construct")
+
+        # Now construct the node tree
+        yield from self.nodes_steps(self._nodes, self.b_nodeTree_name_actual, is_nodegroup = True)
+
+    def create_blender_nodetree_shell(self, add_as_independent_tree = False):
+        """
+        Creates the empty blender node tree, with its interface, from self.name, self.type and self.interface,
+            nodes and groups are added to it after, see create_full_blender_nodetree()
+        :param add_as_independent_tree: see create_full_blender_nodetree()
+        """
         # this function can't handle material
         if (self.type == "MATERIAL") or (self.type == "ShaderNodeTree"):
-            print("This function can't handle materials, try NS_mat_constructor")
+            log.warning("This function can't handle materials, try NS_mat_constructor")
         
         # Check for deprecated use of nodetree.type instead of .bl_idname
         if (self.type == "GEOMETRY"):
@@ -508,89 +870,12 @@ class NS_nodetree:
         # b_ = blender
         self.b_nodeTree = bpy.data.node_groups.new(self.name, self.type)
         self.b_nodeTree_name_actual = self.b_nodeTree.name
+        self._new_datablocks.append(('node_groups', self.b_nodeTree_name_actual))
         self.b_nodes = self.b_nodeTree.nodes
 
-        _props_to_skip = ('name', 'parent', 'index', 'socket_type')
-
         # As of blender 4.0, we also need to create an interface
         if hasattr(self.b_nodeTree, 'interface') and self.interface != None:
-            # We need to make sure we're sorting this as we make them, since we'll need the index data
-            #  to restore the original ordering and parental relationships
-            # Place for ns_nodetree interface and b_nodetree interface items
-            list_of_interfaces = [0] * len(self.interface)
-            print ("constructing interface for " + self.name)
-
-            for interfaceItem in self.interface.values():  #sorted(steps, key=lambda key: int(key))
-                if interfaceItem['item_type'] == "SOCKET":
-                    created_interfaceItem = self.b_nodeTree.interface.new_socket(interfaceItem['name'],
-                                                                                 in_out = interfaceItem['in_out'],
-                                                                                 socket_type = interfaceItem['socket_type'])
-                elif interfaceItem['item_type'] == "PANEL":
-                    created_interfaceItem = self.b_nodeTree.interface.new_panel(interfaceItem['name'])
-                else: 
-                    print("Somehow had an interfaceItem that wasn't a socket or panel...")
-                    continue
-                
-                print( "     #### Interface Item " + interfaceItem['name'])
-
-                for property in interfaceItem:
-                    # skip a few properties we'll do later
-                    if property not in _props_to_skip:
-                        propertyValue = interfaceItem[property]
-                        print(interfaceItem['name'] + " has a property " + property + ": " +  str(propertyValue))
-                        if (created_interfaceItem.is_property_readonly(property) == True):
-                            print( property + " was read only")
-                        else:
-                            try:
-                                setattr(created_interfaceItem, property, propertyValue)
-                            except Exception as e:
-                                # Attribute wasn't a base type, this should trigger when
-                                #  we are seeing if we can load in an object reference (to an existing object in the file)
-                                print (e)
-                                if (isinstance(propertyValue, str)):
-                                    bpyDataPrefix = 'bpy.data.'
-                                    if (propertyValue.startswith(bpyDataPrefix)):
-                                        propertyValue = propertyValue[len(bpyDataPrefix):]
-                                        # path_resolve only works with double-quotes in dict lookups
-                                        propertyValue = propertyValue.replace("['", '["')                                        
-                                        propertyValue = propertyValue.replace("']", '"]')
-                                        print("trying to set: " + property + ", object located at: " + propertyValue)
-                                    try:
-                                        attributeObject = bpy.data.path_resolve(propertyValue)
-                                        print(repr(attributeObject))
-                                        setattr(created_interfaceItem, property, attributeObject)
-                                        print("should have set value....")
-                                    except Exception as e:
-                                        print(e)
-                                        print("Failed to assign property: " + property + ", value was: " + propertyValue)
-                                else:
-                                    print("Couldn't assign property: " + property + ", couldn't handle type: " + str(type(propertyValue)))
-                                
-
-                            ####TODO: UPDATE OTHER THINGS TO SETATTR INSTEAD OF dict-LIKE ACCESS
-                        #created_interfaceItem[property] = interfaceItem[property]
-                
-                # store the reference for parenting 
-                list_of_interfaces[interfaceItem['index']] = {'ns_interface_item' : interfaceItem, 'b_interface_item' : created_interfaceItem}
-            # Now we have all the interface items instantiated,
-            #  we can set up ordering and parent relationships
-            i = 0
-            while i < len(list_of_interfaces):
-                self.b_nodeTree.interface.move(list_of_interfaces[i]['b_interface_item'], i)
-                i = i + 1
-            i = 0
-            # Set up parents
-            while i < len(list_of_interfaces):
-                ns_item = list_of_interfaces[i]['ns_interface_item']
-                b_item = list_of_interfaces[i]['b_interface_item']
-                parent_index = ns_item['parent']
-                if parent_index != -1:
-                    b_item_parent = list_of_interfaces[parent_index]['b_interface_item']
-                    index_to_move_to = (ns_item['index'] - parent_index) - 1
-                    self.b_nodeTree.interface.move_to_parent(b_item, b_item_parent , index_to_move_to)
-                i = i + 1
-
-
+            self.build_interface(self.b_nodeTree)
 
         if (add_as_independent_tree == True):
             # Try to get it to show up to the top level editor
@@ -604,52 +889,200 @@ class NS_nodetree:
             group_node = editor_node_tree.nodes.new( group_node_type)
             # Link it to our data
             group_node.node_tree = self.b_nodeTree
+            self._new_group_node = (editor_node_tree, group_node.name)
 
         self._created_nodes = []
         self._created_groups = {}
 
-        # Construct groups first
-        if self.groups is not None:
-            print("Constructing groups")
-            # NS_groups are only for nodetree info, not group and metadata info
-            ns_grp : NS_group  
-            for ns_grp in self.groups:
-                print('Constructing group:' + ns_grp + '\n')
-                b_group = bpy.data.node_groups.new(ns_grp, self.type)
-                self._created_groups[ns_grp] = b_group.name
-                # self._created_groups[grp] = group
-            for b_grp in self._created_groups:
-                try:
-                    # self.construct(self.ns_groups[grp], group)
-                    self.create_blender_nodes(self.groups[b_grp],
-                                   self._created_groups[b_grp], is_nodegroup=True)  # causes crash when linking
-                except Exception as e:
-                    print('Constructing node group node tree failed')
-                    print(e)
-        else:
-            print ("Didn't find groups to construct")
+    def build_interface(self, b_tree):
+        """
+        Creates the interface items of self.interface in a blender node tree, Blender 4.0 and up
+        :param b_tree: blender node tree, with an empty interface
+        """
+        _props_to_skip = ('name', 'parent', 'index', 'socket_type')
 
-        # Now construct the node tree
-        self.create_blender_nodes(self._nodes, self.b_nodeTree_name_actual, is_nodegroup = True)
+        # We need to make sure we're sorting this as we make them, since we'll need the index data
+        #  to restore the original ordering and parental relationships
+        # Place for ns_nodetree interface and b_nodetree interface items
+        list_of_interfaces = [0] * len(self.interface)
+        log.debug('constructing interface for %s', self.name)
+
+        for interfaceItem in self.interface.values():  #sorted(steps, key=lambda key: int(key))
+            if interfaceItem['item_type'] == "SOCKET":
+                created_interfaceItem = b_tree.interface.new_socket(interfaceItem['name'],
+                                                                    in_out = interfaceItem['in_out'],
+                                                                    socket_type = interfaceItem['socket_type'])
+            elif interfaceItem['item_type'] == "PANEL":
+                created_interfaceItem = b_tree.interface.new_panel(interfaceItem['name'])
+            else: 
+                log.warning("Somehow had an interfaceItem that wasn't a socket or panel...")
+                continue
+            
+            log.debug('Interface item %s', interfaceItem['name'])
+
+            for property in interfaceItem:
+                # skip a few properties we'll do later
+                if property not in _props_to_skip:
+                    propertyValue = interfaceItem[property]
+                    log.debug('%s has a property %s: %s', interfaceItem['name'], property, propertyValue)
+                    if (created_interfaceItem.is_property_readonly(property) == True):
+                        log.debug('%s was read only', property)
+                    else:
+                        try:
+                            setattr(created_interfaceItem, property, propertyValue)
+                        except Exception as e:
+                            # Attribute wasn't a base type, this should trigger when
+                            #  we are seeing if we can load in an object reference (to an existing object in the file)
+                            log.debug('%s', e)
+                            if (isinstance(propertyValue, str)):
+                                bpyDataPrefix = 'bpy.data.'
+                                if (propertyValue.startswith(bpyDataPrefix)):
+                                    propertyValue = propertyValue[len(bpyDataPrefix):]
+                                    # path_resolve only works with double-quotes in dict lookups
+                                    propertyValue = propertyValue.replace("['", '["')                                        
+                                    propertyValue = propertyValue.replace("']", '"]')
+                                    log.debug('trying to set: %s, object located at: %s', property, propertyValue)
+                                try:
+                                    attributeObject = bpy.data.path_resolve(propertyValue)
+                                    setattr(created_interfaceItem, property, attributeObject)
+                                except Exception as e:
+                                    log.warning('Failed to assign property: %s, value was: %s (%s)', property, propertyValue, e)
+                            else:
+                                log.warning("Couldn't assign property: %s, couldn't handle type: %s", property, type(propertyValue))
+                            
 
-        return self.b_nodeTree_name_actual
+                        ####TODO: UPDATE OTHER THINGS TO SETATTR INSTEAD OF dict-LIKE ACCESS
+                    #created_interfaceItem[property] = interfaceItem[property]
+            
+            # store the reference for parenting 
+            list_of_interfaces[interfaceItem['index']] = {'ns_interface_item' : interfaceItem, 'b_interface_item' : created_interfaceItem}
+        # Now we have all the interface items instantiated,
+        #  we can set up ordering and parent relationships
+        i = 0
+        while i < len(list_of_interfaces):
+            b_tree.interface.move(list_of_interfaces[i]['b_interface_item'], i)
+            i = i + 1
+        i = 0
+        # Set up parents
+        while i < len(list_of_interfaces):
+            ns_item = list_of_interfaces[i]['ns_interface_item']
+            b_item = list_of_interfaces[i]['b_interface_item']
+            parent_index = ns_item['parent']
+            if parent_index != -1:
+                b_item_parent = list_of_interfaces[parent_index]['b_interface_item']
+                index_to_move_to = (ns_item['index'] - parent_index) - 1
+                b_tree.interface.move_to_parent(b_item, b_item_parent , index_to_move_to)
+            i = i + 1
+
+    def create_blender_group(self, ns_grp, ns_nodes):
+        """
+        Creates a node group used in this tree, the groups used inside it have to be created already
+        :param ns_grp: name of the group
+        :param ns_nodes: node sharer dict of the group's nodes, or an iterable of (name, node) pairs
+        """
+        for _ in self.group_steps(ns_grp, ns_nodes):
+            pass
+
+    def group_steps(self, ns_grp, ns_nodes):
+        """create_blender_group() in steps, see deadline"""
+        log.debug('Constructing group: %s', ns_grp)
+        if self.group_mode == 'INSTANCE' and not isinstance(ns_nodes, dict):
+            ns_nodes = dict(ns_nodes)  # from a file being read, the fingerprint needs the whole group
+        existing, fingerprint = self.find_identical_group(ns_grp, ns_nodes, self.type)
+        if existing is not None:
+            self._created_groups[ns_grp] = existing.name
+            return
+        b_group = bpy.data.node_groups.new(ns_grp, self.type)
+        self._created_groups[ns_grp] = b_group.name
+        self._new_datablocks.append(('node_groups', b_group.name))
+        try:
+            yield from self.nodes_steps(ns_nodes, b_group.name, is_nodegroup=True)
+        except Exception as e:
+            log.warning('Constructing node group node tree failed: %s', e)
+        if fingerprint is not None:
+            group_index.add(fingerprint, b_group)
+
+    def find_identical_group(self, ns_grp, ns_nodes, tree_type):
+        """
+        In INSTANCE group mode, looks for a node group in the file with the same content as a payload group,
+            groups have to be looked for leaves first, the fingerprint of a group depends on the groups inside it
+        :param ns_grp: name of the group in the payload
+        :param ns_nodes: node sharer dict of the group's nodes
+        :param tree_type: bl_idname of the node tree
+        :return: (existing blender group or None, fingerprint of the payload group or None in COPY mode)
+        """
+        if self.group_mode != 'INSTANCE':
+            return None, None
+        if not self._group_index_refreshed:
+            group_index.refresh()
+            self._group_index_refreshed = True
+        fingerprint = nscodec.group_fingerprint(ns_nodes, self._group_fingerprints)
+        self._group_fingerprints[ns_grp] = fingerprint
+        existing = group_index.find(fingerprint, tree_type)
+        if existing is not None:
+            log.debug('Using existing group %s for %s', existing.name, ns_grp)
+        return existing, fingerprint
     
 
+    @staticmethod
+    def group_build_order(ns_groups):
+        """
+        Sorts groups so that every group comes after the groups used inside it
+        :param ns_groups: group name -> stored nodes of the group
+        :return: list of group names, leaves first
+        """
+        # group name -> names of the groups its group nodes use
+        uses = {}
+        for name, ns_nodes in ns_groups.items():
+            uses[name] = [ns_node['node_tree'] for ns_node in ns_nodes.values()
+                          if ns_node.get('node_tree') in ns_groups]
+
+        # Depth first, with our own stack so deeply nested groups can't hit the recursion limit
+        order = []
+        visiting = set()
+        done = set()
+        for root in ns_groups:
+            if root in done:
+                continue
+            stack = [(root, iter(uses[root]))]
+            visiting.add(root)
+            while stack:
+                name, children = stack[-1]
+                for child in children:
+                    if child in done:
+                        continue
+                    if child in visiting:
+                        log.warning('Group %s uses itself through %s, ignoring that', child, name)
+                        continue
+                    visiting.add(child)
+                    stack.append((child, iter(uses[child])))
+                    break
+                else:
+                    stack.pop()
+                    visiting.discard(name)
+                    done.add(name)
+                    order.append(name)
+        return order
+
     def create_blender_nodes(self, ns_nodes, nt_parent_name, ns_interface = None, is_nodegroup=False):
         """
         Constructs a node tree
-        :param ns_nodes: node sharer dict
+        :param ns_nodes: node sharer dict, or an iterable of (name, node) pairs, like a node tree file being read
         :param nt_parent_name: name of node tree parent, either material or node group
         :param is_nodegroup: bool is node group
         
         """
+        for _ in self.nodes_steps(ns_nodes, nt_parent_name, is_nodegroup):
+            pass
+
+    def nodes_steps(self, ns_nodes, nt_parent_name, is_nodegroup=False):
+        """create_blender_nodes() in steps, see deadline"""
         # b_nodes = nt.nodes  # original
-        to_link = []
-        to_parent = {}
-        b_node_names = {}  # Node sharer name: blender actual name
         
-        # Find the node tree that is open in the editor
-        b_nodes = bpy.data.node_groups[nt_parent_name].nodes
+        # Find the node tree that is open in the editor, and keep handles to it
+        #  and the nodes we create, looking them up by name for every link is slow
+        b_tree = bpy.data.node_groups[nt_parent_name]
+        b_nodes = b_tree.nodes
         
 
         # Remove all the existing nodes in the current node tree,
@@ -659,172 +1092,688 @@ class NS_nodetree:
             for node_to_remove in b_nodes:
                 b_nodes.remove(node_to_remove)
                 
-        # Look at the nodes in ns_nodes, and make nodes in our blender node graph
-        for key in ns_nodes:
-            print('Constructing node:' + key + '\n')
+        if isinstance(ns_nodes, dict):
+            plan = self.plan_of(ns_nodes)
+            node_plans = plan.nodes
+        else:
+            # A file being read, nodes are compiled and built as they come in and not kept
+            plan = NS_build_plan()
+            node_plans = (plan.add_node(stored_ns_node, keep=False) for key, stored_ns_node in ns_nodes)
+        yield from self.plan_steps(b_tree, plan, node_plans)
+
+    def plan_of(self, ns_nodes):
+        """The NS_build_plan of stored nodes, compiled the first time it's asked for, see self._plans"""
+        entry = self._plans.get(id(ns_nodes))
+        # The entry keeps the dict alive, so its id can't have been reused
+        if entry is None or entry[0] is not ns_nodes:
+            entry = (ns_nodes, NS_build_plan(ns_nodes))
+            self._plans[id(ns_nodes)] = entry
+        return entry[1]
+
+    def count_steps(self, ns_nodes, ns_groups=None):
+        """Nodes and links of a tree and its groups, the steps building them takes"""
+        total = 0
+        for nodes in [ns_nodes] + list((ns_groups or {}).values()):
+            plan = self.plan_of(nodes)
+            total += len(plan.nodes) + len(plan.edges)
+        return total
+
+    def progress(self):
+        """How far building in steps has got, 0 to 1"""
+        if self.build_total:
+            return min(1.0, self.steps_done / self.build_total)
+        if self._stream_file is not None:
+            return nsstream.read_fraction(self._stream_file) or 0.0
+        return 0.0
+
+    def rollback(self):
+        """Removes everything a build created, for a build in steps that was cancelled"""
+        if self._new_group_node is not None:
+            editor_node_tree, name = self._new_group_node
+            try:
+                editor_node_tree.nodes.remove(editor_node_tree.nodes[name])
+            except Exception as e:
+                log.warning('Failed to remove group node %s: %s', name, e)
+            self._new_group_node = None
+        # Groups using other groups were created after them
+        for collection, name in reversed(self._new_datablocks):
+            datablocks = getattr(bpy.data, collection)
+            datablock = datablocks.get(name)
+            if datablock is not None:
+                datablocks.remove(datablock)
+        self._new_datablocks = []
+
+    def apply_build_plan(self, b_tree, plan, node_plans=None):
+        """
+        Creates the nodes of a build plan in a blender node tree, links and parents them
+        :param b_tree: blender node tree, already emptied if it needs to be
+        :param plan: NS_build_plan
+        :param node_plans: the node plans to create, plan.nodes if None
+        """
+        for _ in self.plan_steps(b_tree, plan, node_plans):
+            pass
 
-            stored_ns_node = ns_nodes[key]
+    def plan_steps(self, b_tree, plan, node_plans=None):
+        """apply_build_plan() in steps, see deadline"""
+        b_created = {}
+        yield from self.create_plan_nodes_steps(b_tree.nodes, plan.nodes if node_plans is None else node_plans,
+                                                b_created)
 
-            bl_idname = stored_ns_node.get('bl_idname')
-            name = stored_ns_node.get('name')
+        # Now link together our nodes in the blender node graph
+        edges = plan.resolve_edges(b_created) if plan.socket_ids else plan.edges
+        yield from self.link_steps(b_tree, b_created, edges)
+
+        # And set up our parent/child relationships of the nodes on the blender node graph
+        self.parent_blender_nodes(b_created, plan.parents)
 
-            # if is_material is True:
-            # if True:
-            created_blender_node = b_nodes.new(bl_idname)
+    def create_plan_nodes(self, b_nodes, node_plans):
+        """
+        Creates the nodes of node plans, without links or parents
+        :param b_nodes: nodes of the blender node tree to create them in
+        :param node_plans: NS_node_plans, see NS_build_plan
+        :return: node sharer name -> created blender node
+        """
+        b_created = {}  # Node sharer name: created blender node
+        for _ in self.create_plan_nodes_steps(b_nodes, node_plans, b_created):
+            pass
+        return b_created
+
+    def create_plan_nodes_steps(self, b_nodes, node_plans, b_created):
+        """create_plan_nodes() in steps, see deadline, b_created is filled in as nodes are created"""
+        build_start = timings.clock()
+        for node_plan in node_plans:
+            name = node_plan.name
+            log.debug('Constructing node: %s', name)
+            created_blender_node = b_nodes.new(node_plan.bl_idname)
             created_blender_node.name = name
-            b_node_names[name] = created_blender_node.name
-            # else:
-            #     try:
-            #         node = b_nodes[name]
-            #     except Exception as e:
-            #         print('No existing node with that name, creating...')
-            #         print(e)
-            #         node = b_nodes.new(bl_idname)
-            #         node.name = name
-
-            # self._created_nodes.append(node)
-
-            loc = stored_ns_node.pop('location')
-            created_blender_node.location = (loc[0], loc[1])
-
-            ns_node_tree = stored_ns_node.pop('node_tree', None)
-            if ns_node_tree is not None:
+            b_created[name] = created_blender_node
+
+            # Before the input values, a group node only has its sockets once it has its tree
+            if node_plan.node_tree is not None:
                 try:
-                    created_blender_node.node_tree = bpy.data.node_groups[self._created_groups[ns_node_tree]]
+                    created_blender_node.node_tree = bpy.data.node_groups[self._created_groups[node_plan.node_tree]]
                 except Exception as e:
-                    print('Group node node tree assignment failed')
-                    print(e)
-
-            inputs = stored_ns_node.pop('inputs', None)
-            if inputs is not None:
-                for i in inputs:
-                    v = inputs[i]
-                    try:
-                        created_blender_node.inputs[int(i)].default_value = v
-                    except Exception as e:
-                        print('Failed to set input default value')
-                        print(e)
+                    log.warning('Group node node tree assignment failed: %s', e)
 
-            out_dv = stored_ns_node.pop('out_dv', None)
-            if out_dv is not None:
-                for i in out_dv:
-                    v = out_dv[i]
-                    try:
-                        created_blender_node.outputs[int(i)].default_value = v
-                    except Exception as e:
-                        print('Failed to set output default value')
-                        print(e)
-
-            outputs = stored_ns_node.pop('outputs', None)
-            if outputs is not None:
-                to_link.append({name: outputs})
-
-            color_ramp = stored_ns_node.pop('color_ramp', None)
-            if color_ramp is not None:
-                elements = color_ramp['elements']
-                created_blender_node.color_ramp.color_mode = color_ramp['color_mode']
-                created_blender_node.color_ramp.hue_interpolation = color_ramp['hue_interpolation']
-                created_blender_node.color_ramp.interpolation = color_ramp['interpolation']
-                i = 0
-                for p, c in elements.items():
-                    if i > 1:
-                        new_cr_ele = created_blender_node.color_ramp.elements.new(position=float(p))
-                        new_cr_ele.color = c
-                    else:
-                        created_blender_node.color_ramp.elements[i].position = float(p)
-                        created_blender_node.color_ramp.elements[i].color = c
-                    i += 1
-
-            mapping = stored_ns_node.pop('mapping', None)
-            if mapping is not None:
-                curves = mapping.pop('curves')
-                for idc, curve in curves.items():
-                    for idp, point in curve.items():
-                        if int(idp) > 1:
-                            created_blender_node.mapping.curves[int(idc)].points.new(point[0], point[1])
-                        else:
-                            created_blender_node.mapping.curves[int(idc)].points[int(idp)].location = point
-
-                while len(mapping) > 0:
-                    key, v = mapping.popitem()
-                    try:
-                        setattr(created_blender_node.mapping, key, v)
-                    except Exception as e:
-                        print('failed to set mapping attribute: ' + str(key))
-                        print(e)
-
-            parent = stored_ns_node.pop('parent', None)
-            if parent is not None:
-                to_parent[name] = parent
-
-            while len(stored_ns_node) > 0:
-                key, v = stored_ns_node.popitem()
+            for setter, value, what in node_plan.ops:
                 try:
-                    # We can check for read only properties,
-                    if (created_blender_node.is_property_readonly(key) == True):
-                        print (" Property ' " + key + " ' was read only, didn't set")
-                    else:
-                        setattr(created_blender_node, key, v)
+                    setter(created_blender_node, value)
                 except Exception as e:
-                    print('failed to set attribute: ' + str(key))
-                    print(e)
-                    
-        
-
-        # Now set up the top level nodegroup interface for Blender 4.0 and higher
-
-        
+                    log.warning('Failed to set %s on %s: %s', what, name, e)
+
+            settable = node_plan.settable
+            if settable is None:
+                settable = NS_build_plan.settable_attributes(created_blender_node, node_plan.attributes)
+                if NS_build_plan.use_attribute_cache:
+                    node_plan.settable = settable
+            for key, v in settable:
+                try:
+                    setattr(created_blender_node, key, v)
+                except AttributeError as e:
+                    # Can't be set on this type of node at all, don't try again
+                    NS_build_plan.cannot_set_attribute(created_blender_node, key)
+                    node_plan.settable = None
+                    log.warning('failed to set attribute: %s: %s', key, e)
+                except Exception as e:
+                    log.warning('failed to set attribute: %s: %s', key, e)
 
-        # Now link together our nodes in the blender node graph
-        print ("#####  LINKING  #####")
-        for l in to_link:
-            print(repr(l))
-            key, v = l.popitem()
+            self.steps_done += 1
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                # Time spent outside of building isn't build time
+                timings.add('build', build_start)
+                yield
+                build_start = timings.clock()
+        timings.add('build', build_start)
 
-            for output, targets in v.items():
+    @staticmethod
+    def make_edges(to_link):
+        """Flattens stored node outputs into a list of
+            (from node name, output index, to node name, input index) edges
+        :param to_link: list of (node name, stored outputs dict) pairs
+        """
+        edges = []
+        for key, outputs in to_link:
+            for output, targets in outputs.items():
                 # Check to make sure it's actually connected - non-connections can happen if
                 #  there's a default value, but it's not actually connected
-                if not isinstance(targets, (str, int, float, bool)):
-                    for name, ids in targets.items():
-                        input_ids = []
-                        if isinstance(ids, int):  # ids can be int or list.
-                            input_ids.append(ids)  # This is the very first backwards compatabilty compromise!
-                        else:
-                            input_ids.extend(ids)
-                        for i in input_ids:
-                            try:
-                                # groups changed from using node.input / node.output to 
-                                #  using nodegroup.interface
-                                # nt.links.new(b_nodes[k].outputs[int(output)], b_nodes[name].inputs[i])  # original
-                                bpy.data.node_groups[nt_parent_name].links.new(
-                                    bpy.data.node_groups[nt_parent_name].nodes[b_node_names[key]].outputs[int(output)],
-                                    bpy.data.node_groups[nt_parent_name].nodes[b_node_names[name]].inputs[i])  # test
-                                
-
-                            except Exception as e:
-                                print('Failed to link')
-                                print(e)
-        
-        # And set up our parent/child relationships of the nodes on the blender node graph
+                if isinstance(targets, (str, int, float, bool)):
+                    continue
+                output = int(output)
+                for name, ids in targets.items():
+                    if isinstance(ids, int):  # ids can be int or list.
+                        edges.append((key, output, name, ids))  # This is the very first backwards compatabilty compromise!
+                    else:
+                        for i in ids:
+                            edges.append((key, output, name, i))
+        return edges
+
+    def link_blender_nodes(self, b_tree, b_created, edges):
+        """
+        Creates the links of a tree
+        :param b_tree: blender node tree to create the links in
+        :param b_created: node sharer name -> created blender node
+        :param edges: edge list from make_edges()
+        """
+        for _ in self.link_steps(b_tree, b_created, edges):
+            pass
+
+    def link_steps(self, b_tree, b_created, edges):
+        """link_blender_nodes() in steps, see deadline"""
+        link_start = timings.clock()
+        new_link = b_tree.links.new
+        from_key = None
+        from_outputs = None
+        for key, output, name, i in edges:
+            try:
+                # edges from the same node come one after another,
+                #  so only get the outputs when the node changes
+                if key != from_key:
+                    from_outputs = b_created[key].outputs
+                    from_key = key
+                new_link(from_outputs[output], b_created[name].inputs[i])
+            except Exception as e:
+                log.warning('Failed to link %s to %s: %s', key, name, e)
+
+            self.steps_done += 1
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                timings.add('link', link_start)
+                yield
+                link_start = timings.clock()
+        timings.add('link', link_start)
+
+    @staticmethod
+    def parent_blender_nodes(b_created, to_parent):
+        """
+        Sets node parents, usually frames
+        :param b_created: node sharer name -> created blender node
+        :param to_parent: node sharer name -> node sharer name of its parent
+        """
         for key, v in to_parent.items():
             try:
-                bpy.data.node_groups[nt_parent_name].nodes[b_node_names[key]].parent = \
-                    bpy.data.node_groups[nt_parent_name].nodes[b_node_names[v]]
+                b_created[key].parent = b_created[v]
                 # Location of the frame, if shrink is active, depends on the location of the nodes parented to the frame
                 # but the location of the nodes parented to the frame depends on the location of the frame
                 # the end result is that the frame does not appear in correct position as when copied
                 # tasking the location of a node and re-applying it after parenting to a frame does not solve the issue
             except Exception as e:
-                print('Failed to parent node')
-                print(e)
+                log.warning('Failed to parent node %s: %s', key, e)
+
+
+# Setters of build plan operations, called as setter(blender node, stored value)
+
+def _set_location(b_node, loc):
+    b_node.location = (loc[0], loc[1])
+
+
+def _set_input(index, b_node, value):
+    inputs = b_node.inputs
+    # Sockets the node doesn't have, like ones a newer version of Blender added, are skipped
+    if index < len(inputs):
+        inputs[index].default_value = value
+
+
+def _set_output(index, b_node, value):
+    outputs = b_node.outputs
+    if index < len(outputs):
+        outputs[index].default_value = value
+
+
+def _set_input_by_id(identifier, b_node, value):
+    index = NS_build_plan.socket_index(b_node, 'inputs', identifier)
+    if index is not None:
+        b_node.inputs[index].default_value = value
+
+
+def _set_output_by_id(identifier, b_node, value):
+    index = NS_build_plan.socket_index(b_node, 'outputs', identifier)
+    if index is not None:
+        b_node.outputs[index].default_value = value
+
+
+def _build_color_ramp(b_node, color_ramp):
+    ramp = b_node.color_ramp
+    ramp.color_mode = color_ramp['color_mode']
+    ramp.hue_interpolation = color_ramp['hue_interpolation']
+    ramp.interpolation = color_ramp['interpolation']
+    # A new ramp already has two elements
+    for i, (p, c) in enumerate(color_ramp['elements'].items()):
+        if i > 1:
+            ramp.elements.new(position=float(p)).color = c
+        else:
+            ramp.elements[i].position = float(p)
+            ramp.elements[i].color = c
+
+
+def _build_curves(b_node, curves):
+    for idc, curve in curves.items():
+        b_curve = b_node.mapping.curves[int(idc)]
+        for idp, point in curve.items():
+            # and a new curve two points
+            if int(idp) > 1:
+                b_curve.points.new(point[0], point[1])
+            else:
+                b_curve.points[int(idp)].location = point
+
+
+def _set_mapping_attribute(key, b_node, value):
+    setattr(b_node.mapping, key, value)
+
+
+# Setters for changing nodes that already exist, see NS_delta_patcher
+
+def _rebuild_color_ramp(b_node, color_ramp):
+    elements = b_node.color_ramp.elements
+    while len(elements) > 2:
+        elements.remove(elements[len(elements) - 1])
+    _build_color_ramp(b_node, color_ramp)
+
+
+def _rebuild_mapping(b_node, mapping):
+    for curve in b_node.mapping.curves:
+        while len(curve.points) > 2:
+            curve.points.remove(curve.points[len(curve.points) - 1])
+    curves = mapping.get('curves')
+    if curves is not None:
+        _build_curves(b_node, curves)
+    for key, v in mapping.items():
+        if key != 'curves':
+            _set_mapping_attribute(key, b_node, v)
+
+
+_PATCH_SETTERS = {'location': _set_location, 'color_ramp': _rebuild_color_ramp, 'mapping': _rebuild_mapping}
+
+
+class NS_node_plan:
+    """What building one stored node takes, see NS_build_plan"""
+    __slots__ = ('name', 'bl_idname', 'node_tree', 'ops', 'attributes', 'settable')
+
+    def __init__(self, name, bl_idname, node_tree, ops, attributes):
+        self.name = name
+        self.bl_idname = bl_idname
+        self.node_tree = node_tree  # payload name of the group of a group node
+        self.ops = ops  # tuple of (setter, stored value, what it sets for warnings)
+        self.attributes = attributes  # tuple of (attribute, value) of the plain node properties
+        # The attributes that can be set on this type of node, worked out when it's first built,
+        #  see NS_build_plan.settable_attributes()
+        self.settable = None
+
+
+class NS_build_plan:
+    """
+    The stored nodes of a tree worked out once into what has to be done to build them:
+        a NS_node_plan per node, and the links and parents of the tree.
+    Nothing in the payload is changed or copied, so a plan, and the payload, can be built any number of times
+    """
+    # (bl_idname, blender version) -> {attribute: True if it can be set, False if it's read only or missing}.
+    #  Checking an attribute means asking Blender, so it is only done for the first node
+    #  of each type that has it, like NS_node._schema_cache when capturing
+    _attribute_cache = {}
+    use_attribute_cache = True  # False checks every attribute of every node again, for benchmarking
+
+    # (bl_idname, blender version) -> {'inputs': {identifier: index}, 'outputs': ...}, of the first node
+    #  of each type built from a payload with socket identifiers, see NS_node.__init__()
+    _socket_index_cache = {}
+
+    def __init__(self, ns_nodes=None):
+        """
+        :param ns_nodes: node sharer dict of the tree's nodes, or None to add them with add_node()
+        """
+        self.nodes = []
+        self.edges = []  # see NS_nodetree.make_edges()
+        self.parents = {}  # node name -> parent node name
+        # node name -> ({input index: identifier}, {output index: identifier}), of the nodes stored with them
+        self.socket_ids = {}
+        if ns_nodes is not None:
+            for stored_ns_node in ns_nodes.values():
+                self.add_node(stored_ns_node)
+
+    def add_node(self, stored_ns_node, keep=True):
+        """
+        Compiles a stored node, and adds its links and parent to the plan
+        :param keep: add the node plan to self.nodes, streamed trees are built a node at a time instead
+        :return: NS_node_plan
+        """
+        name = stored_ns_node['name']
+        ops = [(_set_location, stored_ns_node['location'], 'location')]
+
+        in_ids = stored_ns_node.get('in_ids')
+        out_ids = stored_ns_node.get('out_ids')
+        if in_ids is not None or out_ids is not None:
+            in_ids = {int(i): identifier for i, identifier in (in_ids or {}).items()}
+            out_ids = {int(i): identifier for i, identifier in (out_ids or {}).items()}
+            self.socket_ids[name] = (in_ids, out_ids)
+
+        inputs = stored_ns_node.get('inputs')
+        if inputs is not None:
+            for i, v in inputs.items():
+                identifier = in_ids and in_ids.get(int(i))
+                setter = partial(_set_input_by_id, identifier) if identifier else partial(_set_input, int(i))
+                ops.append((setter, v, 'input {} default value'.format(i)))
+
+        out_dv = stored_ns_node.get('out_dv')
+        if out_dv is not None:
+            for i, v in out_dv.items():
+                identifier = out_ids and out_ids.get(int(i))
+                setter = partial(_set_output_by_id, identifier) if identifier else partial(_set_output, int(i))
+                ops.append((setter, v, 'output {} default value'.format(i)))
+
+        outputs = stored_ns_node.get('outputs')
+        if outputs is not None:
+            self.edges.extend(NS_nodetree.make_edges(((name, outputs),)))
+
+        color_ramp = stored_ns_node.get('color_ramp')
+        if color_ramp is not None:
+            ops.append((_build_color_ramp, color_ramp, 'color ramp'))
+
+        mapping = stored_ns_node.get('mapping')
+        if mapping is not None:
+            curves = mapping.get('curves')
+            if curves is not None:
+                ops.append((_build_curves, curves, 'curves'))
+            # Last stored first, the order they used to be popped in
+            for key, v in reversed(list(mapping.items())):
+                if key != 'curves':
+                    ops.append((partial(_set_mapping_attribute, key), v, 'mapping attribute ' + key))
+
+        parent = stored_ns_node.get('parent')
+        if parent is not None:
+            self.parents[name] = parent
+
+        # Everything else is a plain node property, last stored first like they used to be popped
+        attributes = tuple((key, v) for key, v in reversed(list(stored_ns_node.items())) if key not in _BUILD_HANDLED)
+
+        node_plan = NS_node_plan(name, stored_ns_node['bl_idname'], stored_ns_node.get('node_tree'), tuple(ops),
+                                 attributes)
+        if keep:
+            self.nodes.append(node_plan)
+        return node_plan
+
+    @classmethod
+    def settable_attributes(cls, b_node, attributes):
+        """
+        Leaves out the attributes that can't be set on nodes of b_node's type
+        :param b_node: a blender node of the type the attributes are for
+        :param attributes: tuple of (attribute, value)
+        :return: tuple of the (attribute, value) pairs to set
+        """
+        if cls.use_attribute_cache:
+            known = cls._attribute_cache.setdefault((b_node.bl_idname, bpy.app.version), {})
+        else:
+            known = {}
+        settable = []
+        for key, v in attributes:
+            can_set = known.get(key)
+            if can_set is None:
+                can_set = known[key] = cls.can_set_attribute(b_node, key)
+            if can_set:
+                settable.append((key, v))
+        return tuple(settable)
+
+    @staticmethod
+    def can_set_attribute(b_node, key):
+        if not hasattr(b_node, key):
+            log.debug("Node %s has no property '%s', won't set it", b_node.bl_idname, key)
+            return False
+        try:
+            # We can check for read only properties,
+            if b_node.is_property_readonly(key):
+                log.debug("Property '%s' of %s is read only, won't set it", key, b_node.bl_idname)
+                return False
+        except Exception:
+            pass  # not a blender property, setting it will tell
+        return True
+
+    @classmethod
+    def socket_index(cls, b_node, kind, identifier):
+        """
+        Index of a socket of a node by its identifier
+        :param kind: 'inputs' or 'outputs'
+        :return: the index, None if the node has no socket with that identifier, like one
+                 this version of Blender doesn't have. The stored index would be the wrong socket then
+        """
+        sockets = getattr(b_node, kind)
+        # Group nodes get their sockets from their group, not the node type
+        if getattr(b_node, 'node_tree', None) is None:
+            key = (b_node.bl_idname, bpy.app.version)
+            indices = cls._socket_index_cache.get(key)
+            if indices is None:
+                indices = cls._socket_index_cache[key] = {
+                    k: {socket.identifier: i for i, socket in enumerate(getattr(b_node, k))}
+                    for k in ('inputs', 'outputs')}
+            found = indices[kind].get(identifier)
+            # Some nodes add sockets as they're used, like group input and output nodes
+            if found is not None and found < len(sockets) and sockets[found].identifier == identifier:
+                return found
+        for i, socket in enumerate(sockets):
+            if socket.identifier == identifier:
+                return i
+        return None
+
+    def resolve_edges(self, b_created):
+        """
+        The plan's edges with the socket indices of nodes stored with socket identifiers
+            changed to the indices of those sockets on the built nodes, links to sockets they don't have left out
+        :param b_created: node sharer name -> created blender node
+        """
+        socket_ids = self.socket_ids
+        socket_index = self.socket_index
+        edges = []
+        for from_name, output, to_name, i in self.edges:
+            try:
+                ids = socket_ids.get(from_name)
+                if ids is not None and output in ids[1]:
+                    output = socket_index(b_created[from_name], 'outputs', ids[1][output])
+                ids = socket_ids.get(to_name)
+                if ids is not None and i in ids[0]:
+                    i = socket_index(b_created[to_name], 'inputs', ids[0][i])
+            except KeyError:
+                pass  # a node that wasn't built, linking it warns
+            if output is None or i is None:
+                log.warning('Failed to link %s to %s: socket not in this version of Blender', from_name, to_name)
+                continue
+            edges.append((from_name, output, to_name, i))
+        return edges
+
+    @classmethod
+    def cannot_set_attribute(cls, b_node, key):
+        """Remember an attribute setting failed in a way it always will on this type of node"""
+        if cls.use_attribute_cache:
+            cls._attribute_cache.setdefault((b_node.bl_idname, bpy.app.version), {})[key] = False
+
+
+class _TreeNodes(dict):
+    """Node sharer name -> blender node, of the nodes just created, and the rest of the tree's nodes by name"""
+
+    def __init__(self, b_nodes):
+        super().__init__()
+        self.b_nodes = b_nodes
+
+    def __missing__(self, name):
+        return self.b_nodes[name]
+
+
+class NS_delta_patcher(NS_nodetree):
+    """Changes an existing material or node tree in place with a delta string, see nsdelta.
+        Only the nodes and links the delta names are touched, the rest of the tree isn't looked at
+    """
+
+    def __init__(self, delta_string, target, group_mode='INSTANCE'):
+        """
+        :param delta_string: Node Sharer delta string
+        :param target: the blender material, or node tree, to change, it should be what the delta was made from
+        :param group_mode: for groups the delta adds, see NS_nodetree.group_mode
+        """
+        super().__init__()
+        self.group_mode = group_mode
+        self.patched = False
+        self.error = None  # why the delta wasn't applied
+        try:
+            info, delta = nsdelta.decode(delta_string)
+        except ValueError as e:
+            self.error = str(e)
+            log.error('Failed to read Node Sharer delta string: %s', e)
+            return
+        if info[1] != int(nscodec.blender_version_code(bpy.app.version)):
+            log.warning('Delta was made in another version of Blender, it is applied as it is')
+
+        # Materials have their nodes in a node tree of their own
+        b_tree = getattr(target, 'node_tree', None) or target
+        self.name = b_tree.name
+        self.type = b_tree.bl_idname
+        # Only to the tree it was made from, patching another one would mangle it
+        base_nodes = delta.get('base_nodes')
+        if base_nodes is not None and base_nodes != nsdelta.base_fingerprint(
+                (b_node.name, b_node.bl_idname) for b_node in b_tree.nodes):
+            self.error = "{} doesn't match {}, the tree the delta was made from".format(target.name, delta.get('base'))
+            log.error('Delta not applied: %s', self.error)
+            return
+        # Groups the delta doesn't add are the ones in the file with the same name,
+        #  groups the delta removes are left in the file, other trees may use them
+        self._created_groups = {b_group.name: b_group.name for b_group in bpy.data.node_groups}
+
+        with timings.phase('patch'):
+            new_groups = delta.get('new_groups', {})
+            for ns_grp in self.group_build_order(new_groups):
+                self.create_blender_group(ns_grp, new_groups[ns_grp])
+            for ns_grp, nodes_delta in delta.get('groups', {}).items():
+                b_group = bpy.data.node_groups.get(self._created_groups.get(ns_grp, ns_grp))
+                if b_group is None:
+                    log.warning('Group %s the delta changes is not in the file', ns_grp)
+                    continue
+                self.patch_nodes(b_group, nodes_delta)
+            self.patch_nodes(b_tree, delta['nodes'], delta.get('interface', _MISSING))
+        self.patched = True
+
+    def patch_nodes(self, b_tree, nodes_delta, interface=_MISSING):
+        """
+        Changes the nodes of a blender node tree, see nsdelta.diff_nodes()
+        :param interface: the new interface of the tree, _MISSING if it didn't change
+        """
+        b_nodes = b_tree.nodes
+        tree_nodes = _TreeNodes(b_nodes)
+        # Links first, while the nodes at both ends are still there
+        for edge in nodes_delta.get('unlink', ()):
+            self.unlink(b_tree, tree_nodes, edge)
+        for name in nodes_delta.get('removed', ()):
+            b_node = b_nodes.get(name)
+            if b_node is None:
+                log.warning('Node %s the delta removes is not in %s', name, b_tree.name)
+            else:
+                b_nodes.remove(b_node)
+
+        if interface is not _MISSING and hasattr(b_tree, 'interface'):
+            b_tree.interface.clear()
+            self.interface = interface
+            if interface is not None:
+                self.build_interface(b_tree)
+
+        parents = {}
+        added = nodes_delta.get('added')
+        if added:
+            # Their links are in the delta's links, with the links to nodes that were already there
+            plan = NS_build_plan(added)
+            tree_nodes.update(self.create_plan_nodes(b_nodes, plan.nodes))
+            parents.update(plan.parents)
+        for name, change in nodes_delta.get('changed', {}).items():
+            try:
+                b_node = tree_nodes[name]
+            except KeyError:
+                log.warning('Node %s the delta changes is not in %s', name, b_tree.name)
+                continue
+            self.patch_node(b_node, change, parents)
+
+        self.link_blender_nodes(b_tree, tree_nodes, nodes_delta.get('link', ()))
+        self.parent_blender_nodes(tree_nodes, parents)
+
+    @staticmethod
+    def unlink(b_tree, tree_nodes, edge):
+        from_name, output, to_name, i = edge
+        try:
+            from_socket = tree_nodes[from_name].outputs[output]
+            for link in tree_nodes[to_name].inputs[i].links:
+                if link.from_socket == from_socket:
+                    b_tree.links.remove(link)
+                    return
+            log.warning('Link from %s to %s the delta removes is not there', from_name, to_name)
+        except Exception as e:
+            log.warning('Failed to unlink %s from %s: %s', from_name, to_name, e)
+
+    def patch_node(self, b_node, change, parents):
+        """
+        Changes one node, see nsdelta.diff_node()
+        :param parents: node name -> new parent name, filled in here, parents are set once every node is there
+        """
+        name = b_node.name
+        sets = change.get('set', {})
+        # Before the input values, a group node only has its sockets once it has its tree
+        node_tree = sets.get('node_tree')
+        if node_tree is not None:
+            try:
+                b_node.node_tree = bpy.data.node_groups[self._created_groups[node_tree]]
+            except Exception as e:
+                log.warning('Group node node tree assignment failed: %s', e)
+
+        for kind, b_sockets in (('inputs', b_node.inputs), ('out_dv', b_node.outputs)):
+            sockets = change.get(kind)
+            if not sockets:
+                continue
+            defaults = None
+            for i, value in sockets.items():
+                index = int(i)
+                if index >= len(b_sockets):
+                    continue
+                if value is None:
+                    # Back to the value a new node has, group node sockets aren't stored that way
+                    if getattr(b_node, 'node_tree', None) is not None:
+                        continue
+                    if defaults is None:
+                        defaults = (NS_node.get_socket_defaults(b_node) or {}).get(
+                            'inputs' if kind == 'inputs' else 'outputs', ())
+                    if index >= len(defaults) or defaults[index][0] != b_sockets[index].identifier \
+                            or defaults[index][1] is _MISSING:
+                        continue
+                    value = defaults[index][1]
+                try:
+                    b_sockets[index].default_value = value
+                except Exception as e:
+                    log.warning('Failed to set %s %s default value on %s: %s', kind, i, name, e)
+
+        for key, value in sets.items():
+            if key in ('node_tree', 'in_ids', 'out_ids'):
+                continue
+            if key == 'parent':
+                parents[name] = value
+                continue
+            try:
+                setter = _PATCH_SETTERS.get(key)
+                if setter is not None:
+                    setter(b_node, value)
+                else:
+                    setattr(b_node, key, value)
+            except Exception as e:
+                log.warning('failed to set attribute: %s: %s', key, e)
+
+        for key in change.get('unset', ()):
+            # Properties that aren't stored are the ones that have their default value
+            if key == 'parent':
+                b_node.parent = None
+            elif key in NS_node._prop_optional:
+                try:
+                    setattr(b_node, key, NS_node._prop_optional[key])
+                except Exception as e:
+                    log.warning('failed to reset attribute: %s: %s', key, e)
 
 
 class NS_material(NS_nodetree):
     """Stores a material and its nodes"""
     """ Weird in that it stores data both as member variables
         but also as the member dictionary ns_mat"""
-    def __init__(self, mat):
-        super().__init__()
+    def __init__(self, mat, socket_identifiers=False):
+        """
+        :param mat: blender material to capture
+        :param socket_identifiers: see NS_node.__init__()
+        """
+        super().__init__(socket_identifiers=socket_identifiers)
         self._mat = mat
         self.name = self._mat.name
         self.groups.clear()
@@ -836,45 +1785,56 @@ class NS_material(NS_nodetree):
             self.ns_mat['groups'] = self.groups
 
     def dumps_mat_JSON(self):
-        print('JSON dump of material')
         return self.dumps_JSON(self.ns_mat)
 
     def dump_mat_JSON(self):
         """Un indented JSON for compression"""
         return self.dump_JSON(self.ns_mat)
 
-    def compress(self):
-        prefix = self.prefix()
+    def dump_mat_binary(self):
+        """Same data as dump_mat_JSON(), in the compact nsbinary encoding"""
+        return nscodec.encode_payload(self.ns_mat, nscodec.FORMAT_BINARY, default=lambda o: o.properties)
+
+    def compress(self, codec=nscodec.DEFAULT_CODEC, binary=False):
+        """
+        :param codec: name of the codec to compress with, from nscodec.CODECS
+        :param binary: use the nsbinary encoding instead of JSON, older versions of the add-on can't paste those
+        :return: (Node Sharer string, its length), the string is also put on the clipboard
+        """
+        payload_format = nscodec.FORMAT_BINARY if binary else nscodec.FORMAT_JSON
+        prefix = self.prefix(codec, payload_format)
         try:
-            # print('json string')
-            json_str = self.dump_mat_JSON().encode("utf8")
-            # print('compressed obj')
-            compressed = zlib.compress(json_str, 9)
-            encoded = base64.b64encode(compressed).decode()
+            with timings.phase('serialize'):
+                payload = nscodec.encode_payload(self.ns_mat, payload_format, default=lambda o: o.properties)
+            with timings.phase('compress'):
+                encoded = nscodec.compress(payload, codec)
             ns_string = prefix + encoded
-            print('base64 encoded string(length = ' + str(len(ns_string)) + ') : \n')
-            print(ns_string)
-            print('\n')
+            log.debug('base64 encoded string(length = %d) : %s', len(ns_string), ns_string)
             bpy.context.window_manager.clipboard = ns_string
             return ns_string, len(ns_string)
         except Exception as e:
-            print("Failed in compress")
-            print(e)
+            log.error('Failed in compress: %s', e)
 
-    def prefix(self):
-        blender_version = bpy.app.version
-        ns_version = str(0)
-        prefix = 'NS' + ns_version + 'B' + str(blender_version[0]) + str(blender_version[1]) + str(
-            blender_version[2]) + '!'
-        return prefix
+    def prefix(self, codec=nscodec.DEFAULT_CODEC, payload_format=nscodec.FORMAT_JSON):
+        return nscodec.make_prefix(bpy.app.version, codec, payload_format)
 
 
 class NS_group(NS_nodetree):
 
-    def __init__(self, nodetree):
-        super().__init__()
+    def __init__(self, nodetree, groups=None, group_memo=None, socket_identifiers=False):
+        """
+        :param nodetree: blender node tree of the group
+        :param groups: groups table of the tree this group is used in, nested groups are added to it
+        :param group_memo: group memo of the tree this group is used in, see NS_nodetree.add_group()
+        :param socket_identifiers: see NS_node.__init__()
+        """
+        super().__init__(socket_identifiers=socket_identifiers)
         self._nt = nodetree
         self.properties = {}
+        if groups is not None:
+            self.groups = groups
+        if group_memo is not None:
+            self._group_memo = group_memo
 
         self.populate_nodetree()
 
@@ -885,6 +1845,7 @@ class NS_group(NS_nodetree):
         self.properties = self.make_dict()
 
     def print_prop(self):
+        import pprint
         pprint.pprint(self.properties)
         print('\n')
 
@@ -893,39 +1854,208 @@ class NS_group(NS_nodetree):
         return d
 
 
+class NS_group_index:
+    """Fingerprints of the node groups in the open .blend file, see nscodec.group_fingerprint(),
+        kept between pastes so pasting a group that's already in the file can use it instead of making a copy.
+        Groups can be edited after they were indexed, so a match is checked again before it's used
+    """
+
+    def __init__(self):
+        self._filepath = None
+        self._fingerprints = {}  # blender group name -> fingerprint
+        self._names = {}  # fingerprint -> blender group names
+
+    def _set(self, name, fingerprint):
+        old = self._fingerprints.get(name)
+        if old is not None:
+            self._names[old].discard(name)
+        self._fingerprints[name] = fingerprint
+        self._names.setdefault(fingerprint, set()).add(name)
+
+    @staticmethod
+    def fingerprint_blender_groups(b_groups):
+        """
+        Captures the groups, and the groups used inside them, once each
+        :return: blender group name -> fingerprint, for all of them
+        """
+        scratch = NS_nodetree()
+        for b_group in b_groups:
+            try:
+                scratch.add_group(b_group)
+            except Exception as e:
+                log.warning('Could not fingerprint group %s: %s', b_group.name, e)
+        # The same plain data a payload has
+        groups = json.loads(scratch.dump_JSON(scratch.groups))
+        return nscodec.group_fingerprints(groups, NS_nodetree.group_build_order(groups))
+
+    def refresh(self):
+        """Index the groups added to the file since the last paste, and forget removed ones"""
+        if bpy.data.filepath != self._filepath:
+            # Another file was opened
+            self.clear()
+            self._filepath = bpy.data.filepath
+        existing = {b_group.name: b_group for b_group in bpy.data.node_groups}
+        for name in [name for name in self._fingerprints if name not in existing]:
+            self._names[self._fingerprints.pop(name)].discard(name)
+        new = [b_group for name, b_group in existing.items() if name not in self._fingerprints]
+        if new:
+            for name, fingerprint in self.fingerprint_blender_groups(new).items():
+                self._set(name, fingerprint)
+
+    def find(self, fingerprint, tree_type):
+        """The blender group with this fingerprint, or None"""
+        for name in list(self._names.get(fingerprint, ())):
+            b_group = bpy.data.node_groups.get(name)
+            if b_group is None or b_group.bl_idname != tree_type:
+                continue
+            current = self.fingerprint_blender_groups([b_group]).get(name)
+            if current == fingerprint:
+                return b_group
+            self._set(name, current)  # edited since it was indexed
+        return None
+
+    def add(self, fingerprint, b_group):
+        """Index a group that was just built from a payload group with this fingerprint"""
+        self._set(b_group.name, fingerprint)
+
+    def clear(self):
+        self._fingerprints.clear()
+        self._names.clear()
+
+
+# Shared by every paste in the session
+group_index = NS_group_index()
+
+
+class NS_incremental_exporter:
+    """
+    Exports the same blender node trees again and again, like a pipeline does after small edits.
+        Every node's JSON is kept with its NS_node.signature(), and on the next export only the nodes
+        with another signature are captured again, the rest of the document is put together from what was kept.
+    The JSON is the same as NS_material.dump_mat_JSON() and NS_nodetree.dump_JSON(make_nodetree_dict()) make,
+        except groups are in leaves first order
+    """
+
+    def __init__(self):
+        self._fragments = {}  # (kind, datablock name) -> {node name: (signature, node JSON)}
+        # Nodes captured again and nodes reused, by the last export
+        self.captured = 0
+        self.reused = 0
+
+    def export_material(self, mat):
+        """JSON of a material, see NS_material"""
+        self.captured = self.reused = 0
+        parts = ['"name":' + json.dumps(mat.name), '"type":"material"',
+                 '"nodes":' + self.nodes_JSON(mat.node_tree, ('material', mat.name_full))]
+        self._add_groups(parts, mat.node_tree)
+        return '{' + ','.join(parts) + '}'
+
+    def export_nodetree(self, blender_node_tree):
+        """JSON of a node tree, see NS_nodetree.make_nodetree_dict()"""
+        self.captured = self.reused = 0
+        parts = ['"name":' + json.dumps(blender_node_tree.name), '"type":' + json.dumps(blender_node_tree.bl_idname),
+                 '"nodes":' + self.nodes_JSON(blender_node_tree, ('node_group', blender_node_tree.name_full))]
+        self._add_groups(parts, blender_node_tree)
+        interface = NS_nodetree.capture_interface(blender_node_tree)
+        if interface is not None:
+            parts.append('"interface":' + json.dumps(interface, separators=(',', ':')))
+        return '{' + ','.join(parts) + '}'
+
+    def _add_groups(self, parts, blender_node_tree):
+        b_groups, order = NS_nodetree.collect_groups(blender_node_tree)
+        if order:
+            parts.append('"groups":{' + ','.join(
+                json.dumps(name) + ':' + self.nodes_JSON(b_groups[name], ('node_group', b_groups[name].name_full))
+                for name in order) + '}')
+
+    def nodes_JSON(self, b_tree, key):
+        """
+        JSON object of the nodes of a tree, capturing only the nodes that changed since the last time
+        :param key: what the tree's nodes are kept under, material node trees all have the same name
+        """
+        kept = self._fragments.get(key, {})
+        fragments = {}
+        links_from = NS_nodetree.index_links(b_tree)
+        for node in b_tree.nodes:
+            signature = NS_node.signature(node, links_from)
+            fragment = kept.get(node.name)
+            if fragment is None or fragment[0] != signature:
+                ns_node = NS_node(node, links_from)
+                fragment = (signature, json.dumps(ns_node.name) + ':'
+                            + json.dumps(ns_node.properties, separators=(',', ':')))
+                self.captured += 1
+            else:
+                self.reused += 1
+            fragments[node.name] = fragment
+        # Only the nodes still in the tree are kept
+        self._fragments[key] = fragments
+        return '{' + ','.join(fragment for signature, fragment in fragments.values()) + '}'
+
+    def clear(self):
+        self._fragments.clear()
+
+
 class NS_mat_constructor(NS_nodetree):
     """NS_nodetree subclass, stores material meta and nodetree data,
         used when importing from JSON"""
     """ It works by uncompressing the JSON string,
         then it stores that into the dictionary ns_nodes.
     """
+    # Decoded and fixed payloads of the last strings pasted, pasting one again skips that work
+    payload_cache = nscodec.PayloadCache()
 
-    def __init__(self, b64_string):
+    def __init__(self, b64_string, group_mode='COPY', build=True, payload=None):
         """
 
         :param b64_string: node sharer compressed base 64 string
+        :param group_mode: 'COPY' or 'INSTANCE', see NS_nodetree.find_identical_group()
+        :param build: False only reads the string, build_steps() builds the material after,
+                      self.ns_nodes is only set if the string could be read
+        :param payload: the string already read, checked and fixed, like nscodec.decode_in_background() does,
+                        it's only read from here on
         """
         super().__init__()
+        self.group_mode = group_mode
+        self.type = 'ShaderNodeTree'  # of the groups, see NS_nodetree.group_steps()
         self.prefix = str(b64_string.split('!')[0])
 
         if str(self.prefix[:2]) != 'NS':
             return
-
-        # uncompressed is a dictionary object, not a string
-        self.uncompressed = self.uncompress(b64_string.split('!')[1])
+        # uncompressed is a dictionary object, not a string, checked and fixed for this
+        #  version of Blender (see nscodec.fix_versions) before anything gets created.
+        #  It's shared with the cache, so it's only read from here on
+        if payload is not None:
+            self.uncompressed = payload
+        else:
+            try:
+                with timings.phase('decode'):
+                    self.uncompressed = self.payload_cache.get(b64_string, bpy.app.version)
+            except ValueError as e:
+                log.error('Failed to read Node Sharer string: %s', e)
+                return
+        # Plans go with the payload in the cache, pasting the string again skips compiling too
+        plans = self.payload_cache.extras(self.uncompressed)
+        if plans is not None:
+            self._plans = plans
         # ns_ = Node Sharer
         self.ns_nodes = self.uncompressed['nodes']
 
-        CompFixer.fix(self.prefix, self.ns_nodes)  # Fix compatability
+        self.ns_mat_name = self.uncompressed['name']
+        self.ns_groups = self.uncompressed.get('groups')
 
+        if build:
+            for _ in self.build_steps():
+                pass
 
-        self.ns_mat_name = self.uncompressed['name']
-        self.ns_groups = self.uncompressed.pop('groups', None)
+    def build_steps(self):
+        """Builds the material, in steps if a deadline is set, see NS_nodetree.deadline"""
+        self.build_total = self.count_steps(self.ns_nodes, self.ns_groups)
 
         # Create a new material in blender
         # b_ = blender
         self.b_mat = bpy.data.materials.new(name=self.ns_mat_name)
         self.b_mat_name_actual = self.b_mat.name
+        self._new_datablocks.append(('materials', self.b_mat_name_actual))
         self.b_mat.use_nodes = True
         self.b_nodes = self.b_mat.node_tree.nodes
 
@@ -944,47 +2074,16 @@ class NS_mat_constructor(NS_nodetree):
         #  them all, because Blender Group nodes only care about a link
         #  to a nodetree, so we can construct those without recursion (?)
         #   HOW DO WE DEAL WITH LINKS TO EXISTING NODES? I don't think we do
-        # Construct groups first
+        # Construct groups first, leaves first, see NS_nodetree.group_build_order()
         if self.ns_groups is not None:
             # NS_groups are only for nodetree info, not group and metadata info
-            ns_grp : NS_group  
-            for ns_grp in self.ns_groups:
-                print('Constructing group:' + ns_grp + '\n')
-                group = bpy.data.node_groups.new(ns_grp, 'ShaderNodeTree')
-                self._created_groups[ns_grp] = group.name
-                # self._created_groups[grp] = group
-            for b_grp in self._created_groups:
-                try:
-                    # self.construct(self.ns_groups[grp], group)
-                    self.constructNodes(self.ns_groups[b_grp],
-                                   self._created_groups[b_grp], is_nodegroup=True)  # causes crash when linking
-                except Exception as e:
-                    print('Constructing node group node tree failed')
-                    print(e)
+            for ns_grp in self.group_build_order(self.ns_groups):
+                yield from self.group_steps(ns_grp, self.ns_groups[ns_grp])
 
         # Construct material node tree
         # self.construct(self.ns_nodes, self.b_mat.node_tree, is_material=True)  # Original
 
-        self.constructNodes(self.ns_nodes, self.b_mat_name_actual,
-                       is_material=True)
-
-    def uncompress(self, s):
-        """
-        Uncompresses the base64 node sharer text string
-        :param s: base64 encoded node sharer text string
-        :return: the uncompressed material dict
-        """
-        try:
-            print('uncompressing \n')
-            compressed = base64.b64decode(s)
-            json_str = zlib.decompress(compressed).decode('utf8')
-            # print('JSON \n' + json_str + '\n')
-            material = json.loads(json_str)
-            print('pprint JSON \n')
-            pprint.pprint(material)
-            return material
-        except Exception as e:
-            print(e)
+        yield from self.construct_steps(self.ns_nodes, self.b_mat_name_actual, is_material=True)
 
     def constructNodes(self, ns_nodes, nt_parent_name, is_material=False, is_nodegroup=False):
         """
@@ -994,572 +2093,27 @@ class NS_mat_constructor(NS_nodetree):
         :param ns_nodes: node sharer dict
         :param is_material: bool is material
         """
+        for _ in self.construct_steps(ns_nodes, nt_parent_name, is_material, is_nodegroup):
+            pass
+
+    def construct_steps(self, ns_nodes, nt_parent_name, is_material=False, is_nodegroup=False):
+        """constructNodes() in steps, see NS_nodetree.deadline"""
         # b_nodes = nt.nodes  # original
-        to_link = []
-        to_parent = {}
-        b_node_names = {}  # Node sharer name: blender actual name
 
+        # Keep handles to the tree and the nodes we create,
+        #  looking them up by name for every link is slow
         if is_material:
-            b_nodes = bpy.data.materials[self.b_mat_name_actual].node_tree.nodes
+            b_tree = bpy.data.materials[self.b_mat_name_actual].node_tree
         elif is_nodegroup:
-            b_nodes = bpy.data.node_groups[nt_parent_name].nodes
+            b_tree = bpy.data.node_groups[nt_parent_name]
         else:
-            print('Did not specify material or node group')
+            log.error('Did not specify material or node group')
             return
+        b_nodes = b_tree.nodes
 
         # remove stock BSDF and output if creating a material
         if is_material is True:
             for node_to_remove in b_nodes:
                 b_nodes.remove(node_to_remove)
 
-        for key in ns_nodes:
-            print('Constructing node:' + key + '\n')
-
-            stored_ns_node = ns_nodes[key]
-
-            bl_idname = stored_ns_node.pop('bl_idname')
-            name = stored_ns_node.pop('name')
-
-            # if is_material is True:
-            # if True:
-            created_blender_node = b_nodes.new(bl_idname)
-            created_blender_node.name = name
-            b_node_names[name] = created_blender_node.name
-            # else:
-            #     try:
-            #         node = b_nodes[name]
-            #     except Exception as e:
-            #         print('No existing node with that name, creating...')
-            #         print(e)
-            #         node = b_nodes.new(bl_idname)
-            #         node.name = name
-
-            # self._created_nodes.append(node)
-
-            loc = stored_ns_node.pop('location')
-            created_blender_node.location = (loc[0], loc[1])
-
-            ns_node_tree = stored_ns_node.pop('node_tree', None)
-            if ns_node_tree is not None:
-                try:
-                    created_blender_node.node_tree = bpy.data.node_groups[self._created_groups[ns_node_tree]]
-                except Exception as e:
-                    print('Group node node tree assignment failed')
-                    print(e)
-
-            inputs = stored_ns_node.pop('inputs', None)
-            if inputs is not None:
-                for i in inputs:
-                    v = inputs[i]
-                    try:
-                        created_blender_node.inputs[int(i)].default_value = v
-                    except Exception as e:
-                        print('Failed to set input default value')
-                        print(e)
-
-            out_dv = stored_ns_node.pop('out_dv', None)
-            if out_dv is not None:
-                for i in out_dv:
-                    v = out_dv[i]
-                    try:
-                        created_blender_node.outputs[int(i)].default_value = v
-                    except Exception as e:
-                        print('Failed to set output default value')
-                        print(e)
-
-            outputs = stored_ns_node.pop('outputs', None)
-            if outputs is not None:
-                to_link.append({name: outputs})
-
-            color_ramp = stored_ns_node.pop('color_ramp', None)
-            if color_ramp is not None:
-                elements = color_ramp['elements']
-                created_blender_node.color_ramp.color_mode = color_ramp['color_mode']
-                created_blender_node.color_ramp.hue_interpolation = color_ramp['hue_interpolation']
-                created_blender_node.color_ramp.interpolation = color_ramp['interpolation']
-                i = 0
-                for p, c in elements.items():
-                    if i > 1:
-                        new_cr_ele = created_blender_node.color_ramp.elements.new(position=float(p))
-                        new_cr_ele.color = c
-                    else:
-                        created_blender_node.color_ramp.elements[i].position = float(p)
-                        created_blender_node.color_ramp.elements[i].color = c
-                    i += 1
-
-            mapping = stored_ns_node.pop('mapping', None)
-            if mapping is not None:
-                curves = mapping.pop('curves')
-                for idc, curve in curves.items():
-                    for idp, point in curve.items():
-                        if int(idp) > 1:
-                            created_blender_node.mapping.curves[int(idc)].points.new(point[0], point[1])
-                        else:
-                            created_blender_node.mapping.curves[int(idc)].points[int(idp)].location = point
-
-                while len(mapping) > 0:
-                    key, v = mapping.popitem()
-                    try:
-                        setattr(created_blender_node.mapping, key, v)
-                    except Exception as e:
-                        print('failed to set mapping attribute: ' + str(key))
-                        print(e)
-
-            parent = stored_ns_node.pop('parent', None)
-            if parent is not None:
-                to_parent[name] = parent
-
-            while len(stored_ns_node) > 0:
-                key, v = stored_ns_node.popitem()
-                try:
-                    setattr(created_blender_node, key, v)
-                except Exception as e:
-                    print('failed to set attribute: ' + str(key))
-                    print(e)
-
-        for l in to_link:
-            key, v = l.popitem()
-
-            for output, targets in v.items():
-                for name, ids in targets.items():
-                    input_ids = []
-                    if isinstance(ids, int):  # ids can be int or list.
-                        input_ids.append(ids)  # This is the very first backwards compatabilty compromise!
-                    else:
-                        input_ids.extend(ids)
-                    for i in input_ids:
-                        try:
-                            # nt.links.new(b_nodes[k].outputs[int(output)], b_nodes[name].inputs[i])  # original
-                            if is_material:
-                                bpy.data.materials[self.b_mat_name_actual].node_tree.links.new(
-                                    bpy.data.materials[self.b_mat_name_actual].node_tree.nodes[b_node_names[key]].outputs[
-                                        int(output)],
-                                    bpy.data.materials[self.b_mat_name_actual].node_tree.nodes[
-                                        b_node_names[name]].inputs[i])  # test
-                            elif is_nodegroup:
-                                bpy.data.node_groups[nt_parent_name].links.new(
-                                    bpy.data.node_groups[nt_parent_name].nodes[b_node_names[key]].outputs[int(output)],
-                                    bpy.data.node_groups[nt_parent_name].nodes[b_node_names[name]].inputs[i])  # test
-                        except Exception as e:
-                            print('Failed to link')
-                            print(e)
-
-        for key, v in to_parent.items():
-            try:
-                if is_material:
-                    bpy.data.materials[self.b_mat_name_actual].node_tree.nodes[b_node_names[key]].parent = \
-                        bpy.data.materials[self.b_mat_name_actual].node_tree.nodes[b_node_names[v]]
-                elif is_nodegroup:
-                    bpy.data.node_groups[nt_parent_name].nodes[b_node_names[key]].parent = \
-                        bpy.data.node_groups[nt_parent_name].nodes[b_node_names[v]]
-                # Location of the frame, if shrink is active, depends on the location of the nodes parented to the frame
-                # but the location of the nodes parented to the frame depends on the location of the frame
-                # the end result is that the frame does not appear in correct position as when copied
-                # tasking the location of a node and re-applying it after parenting to a frame does not solve the issue
-            except Exception as e:
-                print('Failed to parent node')
-                print(e)
-
-
-class OBJECT_MT_ns_copy_material(bpy.types.Operator):
-    """Node Sharer: Copy complete material node setup as compressed string"""  # Use this as a tooltip for menu items and buttons.
-    bl_idname = "node.ns_copy_material"  # Unique identifier for buttons and menu items to reference.
-    bl_label = "Copy material as a text string"  # Display name in the interface.
-    bl_options = {'REGISTER'}  # 
-
-    def execute(self, context):  # execute() is called when running the operator.
-        
-        my_mat = NS_material(context.material)
-#        my_mat = NS_material(context.space_data.edit_tree)
-        print("here is text2")
-        my_mat.print_tree()
-        ns_string, length = my_mat.compress()
-        bpy.types.Scene.ns_string = ns_string
-        text = 'Copied material as Node Sharer text string to clipboard. Text length: ' + str(length)
-        self.report({'INFO'}, text)
-
-        return {'FINISHED'}  # Lets Blender know the operator finished successfully.
-
-class OBJECT_MT_ns_export_material(bpy.types.Operator):
-    """Node Sharer: Export complete material node setup as a JSON text string to the clipboard"""  # Use this as a tooltip for menu items and buttons.
-    bl_idname = "node.ns_export_material"  # Unique identifier for buttons and menu items to reference.
-    bl_label = "Export material as text string"  # Display name in the interface.
-    bl_options = {'REGISTER'}  # 
-
-    def execute(self, context):  # execute() is called when running the operator.
-        
-        # Materials have a bunch of properties outside of just the node tree,
-        #  so if we're in the shader editor, we run the original code
-        if (context.material): 
-            print ("The current context has a material")
-            my_mat = NS_material(context.material)
-#        my_mat = NS_material(context.space_data.edit_tree) #DEBUG
-        #my_mat.print_tree()
-            json_string = my_mat.dumps_mat_JSON()
-            print("jsonString type: {}".format(type(json_string)))
-            bpy.context.window_manager.clipboard = json_string
-        #text = 'yyyCopied material as Node Sharer text string to clipboard. Text length: '
-        #self.report({'INFO'}, text)
-        else:
-            print("We were in a different node editor")
-            editor_node_tree = context.space_data.edit_tree
-            my_node_tree = NS_nodetree(editor_node_tree)
-            for node in editor_node_tree.nodes:
-                my_node_tree.add_node(node)
-                print("Added node")
-                
-            json_string = my_node_tree.dumps_nodetree_JSON()
-            bpy.context.window_manager.clipboard = json_string
-
-        return {'FINISHED'}  # Lets Blender know the operator finished successfully.
-
-class OBJECT_MT_ns_paste_material(bpy.types.Operator):
-    """Node Sharer: Paste complete material node setup from text string"""  # Use this as a tooltip for menu items and buttons.
-    bl_idname = "node.ns_paste_material"  # Unique identifier for buttons and menu items to reference.
-    bl_label = "Paste material from text string in clipboard"  # Display name in the interface.
-    bl_options = {'REGISTER'}  #
-
-    def execute(self, context):  # execute() is called when running the operator.
-        print('Paste material')
-
-        new_mat = NS_mat_constructor(bpy.context.window_manager.clipboard)
-        try:
-            text = 'Pasted material from Node Sharer text string. Material name: ' + str(new_mat.b_mat.name)
-            level = 'INFO'
-        except AttributeError:
-            text = "Failed to paste material, make sure it\'s an actual Node Sharer text string"
-            level = 'ERROR'
-        self.report({level}, text)
-
-        return {'FINISHED'}  # Lets Blender know the operator finished successfully.
-
-class OBJECT_MT_ns_unregister_addon(bpy.types.Operator):
-    """Node Sharer: unregisters the addon for debugging"""  # Use this as a tooltip for menu items and buttons.
-    bl_idname = "node.ns_unregister_addon"  # Unique identifier for buttons and menu items to reference.
-    bl_label = "Unregister NodeSharer"  # Display name in the interface.
-    bl_options = {'REGISTER'}  #
-
-    def execute(self, context):  # execute() is called when running the operator.
-        print('unregistering...')
-        unregister()
-
-        return {'FINISHED'}  # Lets Blender know the operator finished successfully.
-    
-class OBJECT_MT_ns_load_nodetree_from_file(bpy.types.Operator):
-    """Node Sharer: Loads this node tree to a JSON file"""
-    bl_idname = "node.ns_load_nodetree_from_file"
-    bl_label = "Load Nodetree from File"
-    bl_options = {'REGISTER'}
-    
-    # Function signature for the construct method
-    #def construct(self, ns_nodes, nt, nt_parent_name, is_material=False, is_nodegroup=False):   
-    """
-        Constructs a node tree
-        :param nt_parent_name: name of node tree parent, either material or node group
-        :param is_nodegroup: bool is node group
-        :param ns_nodes: node sharer dict
-        :param nt: Blender node tree
-        :param is_material: bool is material
-        """
-    def execute(self, context):  # execute() is called when running the operator.
-        print('Paste tree')
-
-        new_tree = NS_nodetree()
-        new_tree.construct_from_JSON(bpy.context.window_manager.clipboard)
-        try:
-            text = 'Pasted material from Node Sharer text string. Tree name: ' + str(new_tree.b_nodeTree_name_actual)
-            level = 'INFO'
-        except AttributeError:
-            text = "Failed to paste material, make sure it\'s an actual Node Sharer text string"
-            level = 'ERROR'
-        self.report({level}, text)
-
-        return {'FINISHED'}  # Lets Blender know the operator finished successfully.
-
-    # def execute(self, context):
-    #     # Get our node tree
-    #     editor_node_tree = context.space_data.edit_tree
-    #     # make sure we have a node tree open in the editor
-    #     if (editor_node_tree != None):
-    #         my_node_tree = NS_nodetree(editor_node_tree.nodes)
-#            my_node_tree.construct(my_node_tree._nodes,
-#                        bpy.data.node_groups[0], #FIX THIS SO IT'S ACTUALLY THE NODETREE'S NAME
-#                       is_material=False, is_nodegroup=True)
-        
-    
-class OBJECT_MT_ns_save_nodetree_to_file(bpy.types.Operator):
-    """Node Sharer: Saves this node tree to a JSON file"""
-    bl_idname = "node.ns_save_nodetree_to_file"
-    bl_label = "Save Nodetree to File"
-    bl_options = {'REGISTER'}
-    
-    filename: StringProperty(
-        name="Outdir Path",
-        description="Where I will save my stuff",
-        subtype='FILE_NAME'
-        # subtype='DIR_PATH' is not needed to specify the selection mode.
-        # But this will be anyway a directory path.
-        ) # type: ignore
-    
-    
-    filepath: StringProperty(
-        name="Outdir Path",
-        description="Where I will save my stuff",
-        subtype='FILE_PATH'
-        # subtype='DIR_PATH' is not needed to specify the selection mode.
-        # But this will be anyway a directory path.
-        )  # type: ignore
-    @classmethod
-    def poll(cls, context):
-        return context.object is not None
-    
-    def execute(self, context):
-        # guard against a switched context
-        #if self.options.is_invoke:
-            # The context may have changed since invoking the file selector.
-        #        self.report({'ERROR'}, "Invalid context")
-        #        return {'CANCELLED'}
-
-        print("Selected file: '" + self.filename + "'")
-        print("Full path: " + self.filepath)
-        
-        # Get our node tree
-        editor_node_tree = context.space_data.edit_tree
-        # make sure we have one
-        if (editor_node_tree != None):
-            my_node_tree = NS_nodetree(editor_node_tree.nodes)
-            
-            with open( self.filepath, "w") as file:
-                file.write(my_node_tree.dumps_nodetree_JSON())
-            print("finished")
-        else:
-            print("No node tree available, has the context changed?")
-
-        return {'FINISHED'}
-
-    def invoke(self, context, event):
-        nodetree_name = context.space_data.edit_tree.name_full
-        nodetree_name = nodetree_name.replace(" ", "")
-        self.filename =  nodetree_name + ".json"
-        # Open browser, take reference to 'self' read the path to selected
-        # file, put path in predetermined self fields.
-        # See: https://docs.blender.org/api/current/bpy.types.WindowManager.html#bpy.types.WindowManager.fileselect_add
-        context.window_manager.fileselect_add(self)
-        # Tells Blender to hang on for the slow user input
-        return {'RUNNING_MODAL'}
-
-
-
-def menu_func(self, context):
-    self.layout.operator(OBJECT_MT_ns_copy_material.bl_idname)
-    self.layout.operator(OBJECT_MT_ns_export_material.bl_idname)
-    self.layout.operator(OBJECT_MT_ns_paste_material.bl_idname)
-    self.layout.operator(OBJECT_MT_ns_save_nodetree_to_file.bl_idname)
-    self.layout.operator(OBJECT_MT_ns_load_nodetree_from_file.bl_idname)
-    self.layout.operator(OBJECT_MT_ns_unregister_addon.bl_idname)
-    
-
-
-def register():
-    print("\n =============================================== \n")
-    bpy.types.Scene.ns_string = bpy.props.StringProperty(name = "NodeString", default="")
-    bpy.utils.register_class(OBJECT_MT_ns_copy_material)
-    bpy.utils.register_class(OBJECT_MT_ns_export_material)
-    bpy.utils.register_class(OBJECT_MT_ns_paste_material)
-    bpy.utils.register_class(OBJECT_MT_ns_unregister_addon)
-    bpy.utils.register_class(OBJECT_MT_ns_save_nodetree_to_file)
-    bpy.utils.register_class(OBJECT_MT_ns_load_nodetree_from_file)
-    bpy.types.NODE_MT_node.append(menu_func)
-    print("registered Add-on: Node Sharer")
-    print("\n =============================================== \n")
-
-
-def unregister():
-    bpy.utils.unregister_class(OBJECT_MT_ns_copy_material)
-    bpy.utils.unregister_class(OBJECT_MT_ns_export_material)
-    bpy.utils.unregister_class(OBJECT_MT_ns_paste_material)
-    bpy.utils.unregister_class(OBJECT_MT_ns_unregister_addon)
-    bpy.types.NODE_MT_node.remove(menu_func)
-    print("unregistered Add-on: Node Sharer")
-
-
-class CompFixer:
-    """Version compatibility fixing code"""
-
-    def __init__(self):
-        pass
-
-    @staticmethod
-    def upgrade_to_blender2910(nodes):
-        """
-        Blender 2.91 adds a new input to the BSDF node, emit strength in slot 18, moving the previous slot 18 up etc.
-        Anything that connect to slot 18 or above from before 2.91 will have its slot number increased by one.
-        The input default values will also be updated to match
-        :param nodes: node tree as dict, nodes or groups
-        """
-        _BSDF_node_names = []
-        print('Upgrading nodes to Blender 2.91...')
-        for n in nodes:
-            node = nodes[n]
-
-            if node['bl_idname'] == 'ShaderNodeBsdfPrincipled':
-                # Save the node name for so connections can be updated
-                _BSDF_node_names.append(node['name'])
-
-                # Shift the input default values slots up
-                for i in reversed(range(18, 22 + 1)):
-                    nodes[n]['inputs'][str(i)] = node['inputs'][str(i - 1)]
-                del nodes[n]['inputs']['18']
-
-        for n in nodes:
-            node = nodes[n]
-            try:
-                for output, targets in node['outputs'].items():
-                    for name, ids in targets.items():
-                        if name in _BSDF_node_names:
-                            # increment if the slot is 18 or higher
-                            if isinstance(ids, int) and ids >= 18:
-                                nodes[n]['outputs'][output][name] = ids + 1
-                            elif isinstance(ids, list):
-                                tmp_ids = ids.copy()
-                                for pos, i in enumerate(ids):
-                                    if i >= 18:
-                                        tmp_ids[pos] = i + 1
-                                nodes[n]['outputs'][output][name] = tmp_ids
-
-            except KeyError:
-                print('No outputs in node: {}'.format(node['name']))
-
-        print('Nodes upgraded to comply with Blender 2.91')
-
-    @staticmethod
-    def downgrade_from_blender2910(nodes):
-        """
-        Blender 2.91 adds a new input to the BSDF node, emit strength in slot 18, moving the previous slot 18 up etc.
-        Anything that connect to slot 18 or above from 2.91 or after will have its slot number decreased by one.
-        The input default values will also be updated to match
-        :param nodes: node tree as dict, nodes or groups
-        """
-        _BSDF_node_names = []
-        print('Downgrading nodes from Blender 2.91...')
-        for n in nodes:
-            node = nodes[n]
-
-            if node['bl_idname'] == 'ShaderNodeBsdfPrincipled':
-                # Save the node name for so connections can be updated
-                _BSDF_node_names.append(node['name'])
-
-                # Shift the input default values slots down
-                for i in range(18, 22):
-                    nodes[n]['inputs'][str(i)] = node['inputs'][str(i + 1)]
-                del nodes[n]['inputs']['22']
-
-        for n in nodes:
-            node = nodes[n]
-            try:
-                for output, targets in node['outputs'].items():
-                    for name, ids in targets.items():
-                        if name in _BSDF_node_names:
-                            # decrement if the slot is 19 or higher
-                            if isinstance(ids, int) and ids >= 19:
-                                nodes[n]['outputs'][output][name] = ids - 1
-                            elif isinstance(ids, list):
-                                tmp_ids = ids.copy()
-                                for pos, i in enumerate(ids):
-                                    if i >= 19:
-                                        tmp_ids[pos] = i - 1
-                                nodes[n]['outputs'][output][name] = tmp_ids
-
-            except KeyError:
-                print('No outputs in node: {}'.format(node['name']))
-
-        print('Nodes downgraded to comply with pre Blender 2.91')
-
-    @staticmethod
-    def upgrade_to_blender3000(nodes):
-        """
-        Blender 3.0 adds two new(undocumented) inputs to the BSDF node, Subsurface IOR and Subsurface Anisotropy in slots 4 & 5, moving the previous slot 4,5 up etc.
-        Anything that connects to slot 4 or above from before 3.0 will have its slot number increased by two.
-        The input default values will also be updated to match
-        :param nodes: node tree as dict, nodes or groups
-        """
-        _BSDF_node_names = []
-        print('Upgrading nodes to Blender 3.0...')
-        for n in nodes:
-            node = nodes[n]
-
-            if node['bl_idname'] == 'ShaderNodeBsdfPrincipled':
-                # Save the node name for so connections can be updated
-                _BSDF_node_names.append(node['name'])
-
-                # Shift the input default values slots up
-                for i in reversed(range(4, 24 + 1)):
-                    try:
-                        nodes[n]['inputs'][str(i)] = node['inputs'][str(i - 2)]
-                    except KeyError:
-                        """Cant move slots that don't exist, for example slot 18 if the material was previously 
-                        upgraded to blender 2.91 """
-                        pass
-                del nodes[n]['inputs']['4']
-
-        for n in nodes:
-            node = nodes[n]
-            try:
-                for output, targets in node['outputs'].items():
-                    for name, ids in targets.items():
-                        if name in _BSDF_node_names:
-                            # increment by 2 if the slot is 4 or higher
-                            if isinstance(ids, int) and ids >= 4:
-                                nodes[n]['outputs'][output][name] = ids + 2
-                            elif isinstance(ids, list):
-                                tmp_ids = ids.copy()
-                                for pos, i in enumerate(ids):
-                                    if i >= 4:
-                                        tmp_ids[pos] = i + 2
-                                nodes[n]['outputs'][output][name] = tmp_ids
-
-            except KeyError:
-                print('No outputs in node: {}'.format(node['name']))
-
-        print('Nodes upgraded to comply with Blender 3.0')
-
-    @staticmethod
-    def version_difference(prefix):
-        """
-        Not used atm
-        :param prefix:
-        :return:
-        """
-        bv = bpy.app.version
-        blender_version = int(str(bv[0]) + str(bv[1]) + str(bv[2]))
-
-        ns_bv = int(prefix.split('B')[1])
-        if ns_bv != blender_version:
-            return True
-        else:
-            return False
-
-    @staticmethod
-    def fix(prefix, nodes):
-        """
-        Fix compatibility
-        :param prefix: Node Sharer prefix
-        :param nodes: Node Sharer node dict
-        """
-        bv = bpy.app.version
-
-        if bv >= (2, 91, 0):
-            if 2800 < int(prefix.split('B')[1]) < 2910:
-                CompFixer.upgrade_to_blender2910(nodes)
-        if bv >= (3, 0, 0):
-            if 2800 < int(prefix.split('B')[1]) < 3000:
-                CompFixer.upgrade_to_blender3000(nodes)
-        elif bv < (2, 91, 0):
-            if int(prefix.split('B')[1]) >= 2910:
-                CompFixer.downgrade_from_blender2910(nodes)
-
-
-# This allows you to run the script directly from Blender's Text editor
-# to test the add-on without having to install it.
-if __name__ == "__main__":
-    register()
+        yield from self.plan_steps(b_tree, self.plan_of(ns_nodes))
@@ -0,0 +1,291 @@
+"""
+Compact binary encoding of Node Sharer payloads
+
+An alternative to the JSON text inside a Node Sharer string. It holds exactly the same data:
+loads(dumps(payload)) == json.loads(json.dumps(payload)), including dict keys becoming strings,
+but is a lot smaller before compression, and usually after:
+    - every string (node names, bl_idnames, property names) is stored once, in a string table,
+      and referred to by its index everywhere else
+    - dict keys that are socket indices are stored as integers, not as text
+    - lists of numbers, like locations, default values and colors, are packed arrays.
+      Floats that survive it, which is most of them since Node Sharer rounds to 5 decimals,
+      are stored as 4 byte floats and rounded back to 5 decimals when read
+
+Layout: b'NSB' version byte, string count, strings, then the payload value.
+Counts, indices and integers are varints, little endian base 128, integers zigzag encoded first.
+
+Nothing in here needs Blender.
+"""
+
+import struct
+
+MAGIC = b'NSB'
+VERSION = 1
+
+# Value tags
+_NONE = 0
+_FALSE = 1
+_TRUE = 2
+_INT = 3
+_FLOAT64 = 4
+_FLOAT32 = 5  # rounded to 5 decimals when read
+_STRING = 6
+_LIST = 7
+_DICT = 8
+_FLOAT32_ARRAY = 9
+_FLOAT64_ARRAY = 10
+_INT_ARRAY = 11
+
+_pack_f = struct.Struct('<f').pack
+_unpack_f = struct.Struct('<f').unpack_from
+_pack_d = struct.Struct('<d').pack
+_unpack_d = struct.Struct('<d').unpack_from
+
+
+def _fits_float32(value):
+    """True if value comes back unchanged from a 4 byte float rounded to 5 decimals"""
+    try:
+        return round(_unpack_f(_pack_f(value))[0], 5) == value
+    except OverflowError:
+        return False
+
+
+def _key_text(key):
+    """Dict keys as json.dumps writes them"""
+    if isinstance(key, str):
+        return key
+    if key is True:
+        return 'true'
+    if key is False:
+        return 'false'
+    if key is None:
+        return 'null'
+    if isinstance(key, float):
+        return float.__repr__(key)
+    return int.__repr__(key)
+
+
+def _int_key(key):
+    """Index for keys that are stored as integers, socket indices mostly, None for text keys"""
+    if isinstance(key, int) and not isinstance(key, bool):
+        return key if key >= 0 else None
+    if isinstance(key, str) and key.isdigit() and key.isascii() and (key == '0' or key[0] != '0'):
+        return int(key)
+    return None
+
+
+class _Encoder:
+
+    def __init__(self, default):
+        self.default = default
+        self.strings = {}  # string -> use count, then string -> index
+        self.out = bytearray()
+
+    def plain(self, value):
+        """Lets default() turn objects into plain data, like json.dumps does"""
+        if value is None or isinstance(value, (str, int, float, list, tuple, dict)):
+            return value
+        if self.default is None:
+            raise TypeError('Object of type {} is not serializable'.format(type(value).__name__))
+        return self.default(value)
+
+    def count_strings(self, value):
+        """First pass, count every string so the most used get the smallest indices"""
+        value = self.plain(value)
+        strings = self.strings
+        if isinstance(value, str):
+            strings[value] = strings.get(value, 0) + 1
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                if _int_key(key) is None:
+                    key = _key_text(key)
+                    strings[key] = strings.get(key, 0) + 1
+                self.count_strings(item)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                self.count_strings(item)
+
+    def varint(self, number):
+        out = self.out
+        while number > 0x7f:
+            out.append((number & 0x7f) | 0x80)
+            number >>= 7
+        out.append(number)
+
+    def zigzag(self, number):
+        self.varint(number * 2 if number >= 0 else -number * 2 - 1)
+
+    def value(self, value):
+        value = self.plain(value)
+        out = self.out
+        if value is None:
+            out.append(_NONE)
+        elif value is False:
+            out.append(_FALSE)
+        elif value is True:
+            out.append(_TRUE)
+        elif isinstance(value, int):
+            out.append(_INT)
+            self.zigzag(value)
+        elif isinstance(value, float):
+            if _fits_float32(value):
+                out.append(_FLOAT32)
+                out += _pack_f(value)
+            else:
+                out.append(_FLOAT64)
+                out += _pack_d(value)
+        elif isinstance(value, str):
+            out.append(_STRING)
+            self.varint(self.strings[value])
+        elif isinstance(value, dict):
+            out.append(_DICT)
+            self.varint(len(value))
+            for key, item in value.items():
+                index = _int_key(key)
+                if index is None:
+                    self.varint(self.strings[_key_text(key)] << 1)
+                else:
+                    self.varint(index << 1 | 1)
+                self.value(item)
+        elif isinstance(value, (list, tuple)):
+            self.sequence(value)
+        else:
+            raise TypeError('Object of type {} is not serializable'.format(type(value).__name__))
+
+    def sequence(self, value):
+        out = self.out
+        if value and all(type(item) is float for item in value):
+            if all(_fits_float32(item) for item in value):
+                out.append(_FLOAT32_ARRAY)
+                self.varint(len(value))
+                out += struct.pack('<%df' % len(value), *value)
+            else:
+                out.append(_FLOAT64_ARRAY)
+                self.varint(len(value))
+                out += struct.pack('<%dd' % len(value), *value)
+        elif value and all(type(item) is int for item in value):
+            out.append(_INT_ARRAY)
+            self.varint(len(value))
+            for item in value:
+                self.zigzag(item)
+        else:
+            out.append(_LIST)
+            self.varint(len(value))
+            for item in value:
+                self.value(item)
+
+
+def dumps(payload, default=None):
+    """
+    Encode a payload
+    :param payload: dicts, lists, tuples, strings, numbers, bools and None, like json.dumps takes
+    :param default: called for other objects, should return something that can be encoded,
+                    like NS_nodetree.dump_JSON's default
+    :return: bytes
+    """
+    encoder = _Encoder(default)
+    encoder.count_strings(payload)
+    strings = sorted(encoder.strings, key=encoder.strings.get, reverse=True)
+    encoder.strings = {string: index for index, string in enumerate(strings)}
+
+    encoder.out += MAGIC
+    encoder.out.append(VERSION)
+    encoder.varint(len(strings))
+    for string in strings:
+        data = string.encode('utf8')
+        encoder.varint(len(data))
+        encoder.out += data
+    encoder.value(payload)
+    return bytes(encoder.out)
+
+
+class _Decoder:
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.strings = []
+
+    def varint(self):
+        data = self.data
+        number = 0
+        shift = 0
+        while True:
+            byte = data[self.pos]
+            self.pos += 1
+            number |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return number
+            shift += 7
+
+    def zigzag(self):
+        number = self.varint()
+        return number >> 1 if not number & 1 else -(number >> 1) - 1
+
+    def value(self):
+        tag = self.data[self.pos]
+        self.pos += 1
+        if tag == _STRING:
+            return self.strings[self.varint()]
+        if tag == _DICT:
+            strings = self.strings
+            result = {}
+            for _ in range(self.varint()):
+                key = self.varint()
+                key = str(key >> 1) if key & 1 else strings[key >> 1]
+                result[key] = self.value()
+            return result
+        if tag == _INT:
+            return self.zigzag()
+        if tag == _FLOAT32:
+            self.pos += 4
+            return round(_unpack_f(self.data, self.pos - 4)[0], 5)
+        if tag == _FLOAT32_ARRAY:
+            count = self.varint()
+            values = struct.unpack_from('<%df' % count, self.data, self.pos)
+            self.pos += 4 * count
+            return [round(item, 5) for item in values]
+        if tag == _INT_ARRAY:
+            return [self.zigzag() for _ in range(self.varint())]
+        if tag == _LIST:
+            return [self.value() for _ in range(self.varint())]
+        if tag == _FLOAT64_ARRAY:
+            count = self.varint()
+            values = struct.unpack_from('<%dd' % count, self.data, self.pos)
+            self.pos += 8 * count
+            return list(values)
+        if tag == _FLOAT64:
+            self.pos += 8
+            return _unpack_d(self.data, self.pos - 8)[0]
+        if tag == _TRUE:
+            return True
+        if tag == _FALSE:
+            return False
+        if tag == _NONE:
+            return None
+        raise ValueError('Unknown tag {} at byte {}'.format(tag, self.pos - 1))
+
+
+def loads(data):
+    """
+    Decode bytes from dumps()
+    :return: the payload, as json.loads would have returned it
+    :raises ValueError: if data isn't a Node Sharer binary payload
+    """
+    if data[:3] != MAGIC:
+        raise ValueError('Not a Node Sharer binary payload')
+    if len(data) < 4:
+        raise ValueError('Truncated Node Sharer binary payload')
+    if data[3] > VERSION:
+        raise ValueError('Node Sharer binary payload version {} is newer than this add-on'.format(data[3]))
+    decoder = _Decoder(data)
+    decoder.pos = 4
+    try:
+        strings = decoder.strings
+        for _ in range(decoder.varint()):
+            length = decoder.varint()
+            strings.append(data[decoder.pos:decoder.pos + length].decode('utf8'))
+            decoder.pos += length
+        return decoder.value()
+    except (IndexError, struct.error) as e:
+        raise ValueError('Truncated Node Sharer binary payload') from e
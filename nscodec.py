@@ -0,0 +1,468 @@
+"""
+Node Sharer text string codecs
+
+A Node Sharer text string is a prefix followed by the base64 encoded, compressed JSON payload:
+    NS0B2900!eNqtVk1vozAQ/SuV...     original format, zlib
+    NS1B420Cx!/Td6WFoAAATm1rRG...    version 1, the letter after C is the codec id
+    NS1B420CzFb!eNpj8nP2DQ...        version 1, F(payload format), b is nsbinary instead of JSON
+
+The original prefix is NS(version number)B(Blender version number)!, it has no room for
+a codec, so it always means zlib. Strings compressed with zlib keep using it, so they can still
+be pasted with older versions of the add-on and on NodeShare.io. Other codecs use the
+version 1 prefix, which adds C(codec id), and F(format) when the payload isn't JSON.
+
+Nothing in here needs Blender, so Node Sharer strings can be read, checked, fixed for another
+version of Blender and written again anywhere:
+    info, payload = nscodec.decode(ns_string)
+    nscodec.fix_versions(payload, info, (4, 2, 0))
+    nscodec.encode(payload, (4, 2, 0), 'SMALLEST')
+or all at once with nscodec.transcode().
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+import lzma
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from . import nsbinary
+from .nscodec_items import CODEC_ITEMS, DEFAULT_CODEC
+
+# Preset dictionary for the 'd' codec. zlib can start out already knowing these strings, which
+#  makes small payloads a lot smaller, since most of a payload is the same keys and node types.
+#  The most common strings go last, zlib finds those with the shortest distances.
+#  NEVER change this, strings already shared depend on it. Add a new codec id with a new dictionary instead.
+_DICTIONARY_V1 = (
+    '"ShaderNodeTexImage""ShaderNodeTexNoise""ShaderNodeTexCoord""ShaderNodeMapping""ShaderNodeBump"'
+    '"ShaderNodeMixRGB""ShaderNodeMix""ShaderNodeSeparateXYZ""ShaderNodeCombineXYZ""ShaderNodeInvert"'
+    '"ShaderNodeNormalMap""ShaderNodeTexVoronoi""ShaderNodeTexWave""ShaderNodeRGB""ShaderNodeValue"'
+    '"GeometryNodeGroup""ShaderNodeGroup""NodeGroupInput""NodeGroupOutput""NodeReroute""NodeFrame"'
+    '"blend_type":"MIX","use_clamp":false,"data_type":"FLOAT","interpolation":"Linear",'
+    '"extension":"REPEAT","projection":"FLAT","vector_type":"POINT","noise_dimensions":"3D",'
+    '"color_ramp":{"color_mode":"RGB","hue_interpolation":"NEAR","interpolation":"LINEAR","elements":{'
+    '"mapping":{"clip_max_x":1.0,"clip_max_y":1.0,"clip_min_x":0.0,"clip_min_y":0.0,"extend":"EXTRAPOLATED",'
+    '"tone":"STANDARD","use_clip":true,"curves":{"0":{"0":[0.0,0.0],"1":[1.0,1.0]}'
+    '"distribution":"MULTI_GGX","subsurface_method":"RANDOM_WALK","is_active_output":true,"target":"ALL",'
+    '"ShaderNodeOutputMaterial""ShaderNodeBsdfPrincipled""ShaderNodeValToRGB""ShaderNodeMath",'
+    '"operation":"MULTIPLY","hide":true,"label":"","parent":"Frame","width":140.0,"use_custom_color":true,'
+    '{"name":"Material","type":"material","nodes":{"groups":{"out_dv":{"0":'
+    '[0.8,0.8,0.8,1.0]},[0.0,0.0,0.0,1.0]},[0.0,0.0,0.0]},0.5,"1":0.0,"2":1.0,"3":'
+    '"id_data":"Shader Nodetree","inputs":{"0":,"location":[0,0],'
+    '"outputs":{"0":{"Principled BSDF":0}},"select":false},'
+    '"bl_idname":"ShaderNodeMath","id_data":"Shader Nodetree","inputs":{"0":0.5,"1":0.5,"2":0.5},'
+    '"location":[-200,300],"name":"Math","outputs":{"0":{"'
+).encode('utf8')
+
+# Raw LZMA2 has no header, so the decoder has to be given the same filters, don't change these either.
+#  Preset 6 has an 8 MB window, preset 9 barely compresses node data better and is 3 times slower
+_LZMA_FILTERS = [{'id': lzma.FILTER_LZMA2, 'preset': 6 | lzma.PRESET_EXTREME}]
+
+
+def _zlib_compress(data, level):
+    return zlib.compress(data, level)
+
+
+def _zlib_decompress(data):
+    return zlib.decompress(data)
+
+
+def _lzma_compress(data, level):
+    # Raw LZMA2, without the .xz container, which would add about 60 bytes to every string
+    return lzma.compress(data, format=lzma.FORMAT_RAW, filters=_LZMA_FILTERS)
+
+
+def _lzma_decompress(data):
+    return lzma.decompress(data, format=lzma.FORMAT_RAW, filters=_LZMA_FILTERS)
+
+
+def _dict_compress(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, 9, zlib.Z_DEFAULT_STRATEGY, _DICTIONARY_V1)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _dict_decompress(data):
+    decompressor = zlib.decompressobj(zdict=_DICTIONARY_V1)
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+# codec id in the prefix -> decompress function
+DECODERS = {
+    'z': _zlib_decompress,
+    'x': _lzma_decompress,
+    'd': _dict_decompress,
+}
+
+# name -> (codec id, compress function, level)
+_CODEC_FUNCTIONS = {
+    'FAST': ('z', _zlib_compress, 1),
+    'DEFAULT': ('z', _zlib_compress, 9),
+    'SMALLEST': ('x', _lzma_compress, 9),
+    'DICTIONARY': ('d', _dict_compress, 9),
+}
+# name -> (codec id, compress function, level, label, description), the labels are in nscodec_items
+CODECS = {name: _CODEC_FUNCTIONS[name] + (label, description) for name, label, description in CODEC_ITEMS}
+
+NS_VERSION = 1  # prefix version written for codecs other than zlib
+
+# payload format id in the prefix, JSON has no F in the prefix
+FORMAT_JSON = 'j'
+FORMAT_BINARY = 'b'  # nsbinary
+FORMATS = (FORMAT_JSON, FORMAT_BINARY)
+
+_PREFIX = re.compile(r'^NS(\d+)B(\d+)(?:C([a-z]))?(?:F([a-z]))?$')
+
+
+def blender_version_code(blender_version):
+    """Blender version as it's written in the prefix, (2, 90, 0) -> '2900', (4, 2, 0) -> '420'.
+        Numbers from parse_prefix() are already written that way, 2900 -> '2900'
+    """
+    if isinstance(blender_version, int):
+        return str(blender_version)
+    return str(blender_version[0]) + str(blender_version[1]) + str(blender_version[2])
+
+
+def blender_version_tuple(blender_version):
+    """Version tuple of a Blender version written in a prefix, '2910' -> (2, 91, 0), 420 -> (4, 2, 0).
+        The numbers are just glued together, so it goes by the versions there are:
+        2.xx has two digit minor versions, 3.x and 4.x one digit ones
+    """
+    if not isinstance(blender_version, (int, str)):
+        return tuple(blender_version)
+    code = str(blender_version)
+    if code[0] == '2':
+        return int(code[0]), int(code[1:3] or 0), int(code[3:] or 0)
+    return int(code[0]), int(code[1:2] or 0), int(code[2:] or 0)
+
+
+def make_prefix(blender_version, codec=DEFAULT_CODEC, payload_format=FORMAT_JSON):
+    """
+    :param blender_version: bpy.app.version, or the number from parse_prefix()
+    :param codec: name of the codec in CODECS
+    :param payload_format: one of FORMATS
+    :return: prefix, including the '!'
+    """
+    codec_id = CODECS[codec][0]
+    if codec_id == 'z' and payload_format == FORMAT_JSON:
+        return 'NS0B' + blender_version_code(blender_version) + '!'
+    prefix = 'NS' + str(NS_VERSION) + 'B' + blender_version_code(blender_version) + 'C' + codec_id
+    if payload_format != FORMAT_JSON:
+        prefix += 'F' + payload_format
+    return prefix + '!'
+
+
+def parse_prefix(prefix):
+    """
+    :param prefix: prefix of a Node Sharer string, with or without the '!'
+    :return: (prefix version, Blender version number as written in the prefix, codec id, payload format)
+    :raises ValueError: if it isn't a Node Sharer prefix, or the codec or format isn't known
+    """
+    match = _PREFIX.match(prefix.rstrip('!'))
+    if match is None:
+        raise ValueError('Not a Node Sharer prefix: ' + prefix[:20])
+    ns_version, blender_version, codec_id, payload_format = match.groups()
+    codec_id = codec_id or 'z'
+    payload_format = payload_format or FORMAT_JSON
+    if codec_id not in DECODERS:
+        raise ValueError('Unknown Node Sharer codec: ' + codec_id)
+    if payload_format not in FORMATS:
+        raise ValueError('Unknown Node Sharer payload format: ' + payload_format)
+    return int(ns_version), int(blender_version), codec_id, payload_format
+
+
+def compress(data, codec=DEFAULT_CODEC):
+    """Compress bytes with a codec from CODECS, returns the base64 text, without prefix"""
+    codec_id, compress_function, level = CODECS[codec][:3]
+    return base64.b64encode(compress_function(data, level)).decode()
+
+
+def decompress(text, codec_id='z'):
+    """Decode base64 text, without prefix, compressed with the codec codec_id, returns bytes"""
+    return DECODERS[codec_id](base64.b64decode(text))
+
+
+def encode_payload(payload, payload_format=FORMAT_JSON, default=None):
+    """
+    Turn the payload into bytes, ready to compress
+    :param default: like json.dumps' default, for objects in the payload, like NS_node
+    """
+    if payload_format == FORMAT_BINARY:
+        return nsbinary.dumps(payload, default=default)
+    return json.dumps(payload, separators=(',', ':'), default=default).encode('utf8')
+
+
+def decode_payload(data, payload_format=FORMAT_JSON):
+    """Turn decompressed bytes back into the payload dict"""
+    if payload_format == FORMAT_BINARY:
+        return nsbinary.loads(data)
+    return json.loads(data)
+
+
+def _is_index(key):
+    """Socket dicts are keyed by index, as a string after JSON"""
+    return isinstance(key, (str, int)) and not isinstance(key, bool) and str(key).isdigit()
+
+
+def _check_sockets(node, key, where, name):
+    """A socket dict of a stored node, if it has one, should be keyed by index"""
+    sockets = node.get(key, {})
+    if not isinstance(sockets, dict) or not all(_is_index(i) for i in sockets):
+        raise ValueError('{}: {} of node {} should be a dict of socket indices'.format(where, key, name))
+    return sockets
+
+
+def _check_nodes(nodes, where):
+    # Everything NS_build_plan.add_node() reads from a stored node, a node it can't read would
+    #  only fail once the material or tree is created
+    if not isinstance(nodes, dict):
+        raise ValueError('{}: nodes should be a dict'.format(where))
+    for name, node in nodes.items():
+        if not isinstance(node, dict) or not isinstance(node.get('bl_idname'), str):
+            raise ValueError('{}: node {} has no bl_idname'.format(where, name))
+        if not isinstance(node.get('name'), str):
+            raise ValueError('{}: node {} has no name'.format(where, name))
+        location = node.get('location')
+        if not isinstance(location, (list, tuple)) or len(location) != 2 or \
+                not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in location):
+            raise ValueError('{}: node {} has no location'.format(where, name))
+        for key in ('inputs', 'out_dv'):
+            _check_sockets(node, key, where, name)
+        for key in ('color_ramp', 'mapping'):
+            if not isinstance(node.get(key, {}), dict):
+                raise ValueError('{}: {} of node {} should be a dict'.format(where, key, name))
+        for key in ('in_ids', 'out_ids'):
+            socket_ids = _check_sockets(node, key, where, name)
+            if not all(isinstance(i, str) for i in socket_ids.values()):
+                raise ValueError('{}: {} of node {} should be a dict of identifiers'.format(where, key, name))
+        outputs = _check_sockets(node, 'outputs', where, name)
+        for targets in outputs.values():
+            # plain values are unconnected outputs of old strings, see NS_nodetree.make_edges()
+            if isinstance(targets, (str, int, float, bool)):
+                continue
+            if not isinstance(targets, dict):
+                raise ValueError('{}: node {} has bad links {!r}'.format(where, name, targets))
+            for to_name, ids in targets.items():
+                if to_name not in nodes:
+                    raise ValueError('{}: node {} links to missing node {}'.format(where, name, to_name))
+                if not isinstance(ids, (int, list)) or isinstance(ids, bool) or \
+                        (isinstance(ids, list) and not all(isinstance(i, int) for i in ids)):
+                    raise ValueError('{}: node {} links to bad socket {!r}'.format(where, name, ids))
+
+
+def validate(payload):
+    """
+    Check the payload has the shape the builders expect, so a broken string fails before anything is created
+    :raises ValueError: with what's wrong
+    """
+    if not isinstance(payload, dict):
+        raise ValueError('Payload should be a dict')
+    if not isinstance(payload.get('name'), str):
+        raise ValueError('Payload has no name')
+    _check_nodes(payload.get('nodes'), 'tree')
+    groups = payload.get('groups')
+    if groups is not None:
+        if not isinstance(groups, dict):
+            raise ValueError('groups should be a dict')
+        for name, nodes in groups.items():
+            _check_nodes(nodes, 'group ' + name)
+
+
+def decode(ns_string):
+    """
+    Read a Node Sharer string
+    :return: (parse_prefix() of its prefix, the validated payload)
+    :raises ValueError: if it isn't a readable Node Sharer string
+    """
+    prefix, separator, body = ns_string.strip().partition('!')
+    if not separator:
+        raise ValueError('Not a Node Sharer string, it has no prefix')
+    info = parse_prefix(prefix)
+    try:
+        data = decompress(body, info[2])
+    except (binascii.Error, zlib.error, lzma.LZMAError) as e:
+        raise ValueError('Node Sharer string is damaged: {}'.format(e)) from e
+    # json and nsbinary both raise ValueError, so does utf8 decoding
+    payload = decode_payload(data, info[3])
+    validate(payload)
+    return info, payload
+
+
+def fix_versions(payload, info, blender_version):
+    """
+    Fix a payload copied in one version of Blender to paste in another, see compfixer
+    :param info: parse_prefix() of the string the payload came from
+    :param blender_version: version tuple of the Blender it's for
+    """
+    from .compfixer import CompFixer  # compfixer uses this module
+    prefix = 'NS{}B{}'.format(info[0], info[1])
+    CompFixer.fix(prefix, payload['nodes'], blender_version, payload.get('groups'))
+
+
+def encode(payload, blender_version, codec=DEFAULT_CODEC, payload_format=FORMAT_JSON, default=None):
+    """
+    Write a Node Sharer string
+    :param blender_version: version tuple, or prefix number, of the Blender the payload is for
+    :param default: see encode_payload()
+    """
+    data = encode_payload(payload, payload_format, default)
+    return make_prefix(blender_version, codec, payload_format) + compress(data, codec)
+
+
+def transcode(ns_string, blender_version=None, codec=DEFAULT_CODEC, payload_format=FORMAT_JSON):
+    """
+    Read, check, fix and write a Node Sharer string again, with another codec or for another Blender
+    :param blender_version: version tuple to fix it for, None keeps the Blender version of the string
+    :raises ValueError: if it isn't a readable Node Sharer string
+    """
+    info, payload = decode(ns_string)
+    if blender_version is None:
+        blender_version = info[1]
+    else:
+        fix_versions(payload, info, blender_version)
+    return encode(payload, blender_version, codec, payload_format)
+
+
+def group_fingerprint(nodes, child_fingerprints):
+    """
+    Fingerprint of a group's content, groups with the same nodes, settings and links get the same one,
+        whatever they're called
+    :param nodes: stored nodes of the group, as read from a payload
+    :param child_fingerprints: group name -> fingerprint, of the groups used inside this one
+    :return: hex string
+    """
+    canonical = {}
+    for name, node in nodes.items():
+        # id_data is the name of the group itself
+        node = {key: value for key, value in node.items() if key != 'id_data'}
+        child = node.get('node_tree')
+        if child is not None:
+            node['node_tree'] = child_fingerprints.get(child, child)
+        canonical[name] = node
+    return hashlib.sha1(json.dumps(canonical, sort_keys=True, separators=(',', ':')).encode('utf8')).hexdigest()
+
+
+def group_fingerprints(groups, order):
+    """
+    :param groups: group name -> stored nodes, the groups of a payload
+    :param order: the group names, leaves first, see NS_nodetree.group_build_order()
+    :return: group name -> group_fingerprint()
+    """
+    fingerprints = {}
+    for name in order:
+        fingerprints[name] = group_fingerprint(groups[name], fingerprints)
+    return fingerprints
+
+
+class PayloadCache:
+    """Bounded LRU cache of decoded, checked and version fixed payloads, so pasting the same
+        string again skips all of that. Payloads from it are shared, they must not be changed
+    """
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # (hash of the string, Blender version) -> (payload, extras), see extras()
+        self._entries = OrderedDict()
+        # Strings can be read in the background while another one is pasted, see in_background()
+        self._lock = threading.Lock()
+
+    def get(self, ns_string, blender_version):
+        """
+        :param ns_string: Node Sharer string
+        :param blender_version: version tuple to fix the payload for, see fix_versions()
+        :return: the payload, read only
+        :raises ValueError: if it isn't a readable Node Sharer string
+        """
+        ns_string = ns_string.strip()
+        key = (hashlib.sha1(ns_string.encode('utf8')).digest(), tuple(blender_version))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Not locked, the same string read twice at once is just read twice
+        info, payload = decode(ns_string)
+        fix_versions(payload, info, blender_version)
+        with self._lock:
+            self._entries[key] = (payload, {})
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return payload
+
+    def extras(self, payload):
+        """
+        A dict for what's worked out from a cached payload, like build plans, it goes when the payload does
+        :param payload: payload from get()
+        :return: the dict, None if the payload isn't in the cache (anymore)
+        """
+        with self._lock:
+            for cached, extras in self._entries.values():
+                if cached is payload:
+                    return extras
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Reading strings in the background, one at a time, the worker thread is started on first use
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def in_background(func, *args):
+    """
+    Runs func(*args) in a worker thread, for reading and checking strings while Blender carries on,
+        only for functions that don't touch Blender data, like the ones in here
+    :return: concurrent.futures.Future of its result, result() raises what func raised
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='NodeSharer')
+        return _executor.submit(func, *args)
+
+
+def shutdown_background():
+    """Stop the worker thread, when the add-on is unregistered. Reads still running are finished first"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+
+def decode_in_background(ns_string, blender_version, cache=None):
+    """
+    decode() and fix_versions() in the worker thread, see in_background()
+    :param cache: PayloadCache to read through, the payload is read only then
+    :return: Future of the payload, its result() raises ValueError if it isn't a readable Node Sharer string
+    """
+    if cache is not None:
+        return in_background(cache.get, ns_string, blender_version)
+    return in_background(_decode_and_fix, ns_string, blender_version)
+
+
+def _decode_and_fix(ns_string, blender_version):
+    info, payload = decode(ns_string)
+    fix_versions(payload, info, blender_version)
+    return payload
+
+
+def load_tree_json(text):
+    """
+    Read and check node tree JSON, like NS_nodetree.dumps_nodetree_JSON() writes
+    :raises ValueError: if it isn't node tree JSON
+    """
+    tree = json.loads(text)
+    validate(tree)
+    return tree
@@ -0,0 +1,15 @@
+"""
+Names and labels of the codecs in nscodec, for the compression menus of the operators
+
+Apart from nscodec so registering the add-on doesn't import lzma, hashlib and the rest of it,
+nothing in here imports anything.
+"""
+
+# (name, label, description), in menu order
+CODEC_ITEMS = (
+    ('FAST', 'Fast', 'zlib, quickest to copy, readable by older versions'),
+    ('DEFAULT', 'Default', 'zlib, readable by older versions'),
+    ('SMALLEST', 'Smallest', 'lzma, the shortest strings, for archiving'),
+    ('DICTIONARY', 'Dictionary', 'zlib with a dictionary of common node data, shortest for small materials'),
+)
+DEFAULT_CODEC = 'DEFAULT'
@@ -0,0 +1,298 @@
+"""
+Node Sharer delta strings
+
+A delta string holds what changed between two versions of a material or node tree, so a small
+edit can be shared without sending the whole tree again:
+    ND0B420!eNqrVkpJ...    the same prefixes as Node Sharer strings, with ND instead of NS
+Older versions of the add-on only paste strings starting with NS, so they leave deltas alone.
+
+The delta of two payloads, see nscodec:
+    {"delta": 1, "name": name of the new payload, "type": ..., "base": name of the base payload,
+     "base_nodes": base_fingerprint() of the base's nodes, a delta is only applied to a tree that matches it,
+     "nodes": node changes, see diff_nodes(),
+     "groups": {group name: node changes}, "new_groups": {group name: stored nodes},
+     "removed_groups": [group names],
+     "interface": the new interface, only there if it changed}
+
+Deltas are made between payloads as they come out of JSON, both captured with the same version of Blender.
+
+Nothing in here needs Blender.
+"""
+
+import binascii
+import hashlib
+import lzma
+import zlib
+
+from . import nscodec
+
+DELTA_VERSION = 1
+
+_GROUP_IO = ('NodeGroupInput', 'NodeGroupOutput')
+
+
+def edges(nodes):
+    """The links of stored nodes as a set of (from node, output index, to node, input index),
+        like NS_nodetree.make_edges()
+    """
+    found = set()
+    for name, node in nodes.items():
+        for output, targets in node.get('outputs', {}).items():
+            # plain values are unconnected outputs of old strings
+            if not isinstance(targets, dict):
+                continue
+            for to_name, ids in targets.items():
+                for i in ([ids] if isinstance(ids, int) else ids):
+                    found.add((name, int(output), to_name, i))
+    return found
+
+
+def diff_node(base, new):
+    """
+    Changes to one stored node, links aside, see diff_nodes()
+    :return: {'set': {key: value}, 'unset': [keys],
+              'inputs': {index: value}, 'out_dv': {index: value}}, a None value for a socket means
+              it's back to the value a new node has, see NS_node.diff_socket_defaults.
+              Only the parts with changes are there, an empty dict if nothing changed
+    """
+    change = {}
+    for key in list(new) + [key for key in base if key not in new]:
+        if key in ('outputs', 'name'):
+            continue
+        if key in ('inputs', 'out_dv'):
+            base_sockets = base.get(key, {})
+            new_sockets = new.get(key, {})
+            sockets = {i: new_sockets.get(i) for i in list(new_sockets) + list(base_sockets)
+                       if base_sockets.get(i) != new_sockets.get(i)}
+            if sockets:
+                change[key] = sockets
+        elif key not in new:
+            change.setdefault('unset', []).append(key)
+        elif key not in base or base[key] != new[key]:
+            change.setdefault('set', {})[key] = new[key]
+    return change
+
+
+def diff_nodes(base, new, interface_changed=False):
+    """
+    Changes between two versions of the stored nodes of a tree
+    :param interface_changed: the tree's interface is made again, so the links of its group
+                              input and output nodes have to be too
+    :return: {'removed': [names], 'added': {name: stored node}, 'changed': {name: diff_node()},
+              'unlink': [edges], 'link': [edges]}, only the parts with changes are there.
+              Nodes that changed type are removed and added again
+    """
+    removed = [name for name in base
+               if name not in new or base[name].get('bl_idname') != new[name].get('bl_idname')]
+    gone = set(removed)
+    added = {name: node for name, node in new.items() if name not in base or name in gone}
+    changed = {}
+    for name, node in new.items():
+        if name not in added:
+            change = diff_node(base[name], node)
+            if change:
+                changed[name] = change
+
+    base_edges = edges(base)
+    new_edges = edges(new)
+    # Links of removed nodes go with them, the links of nodes made again have to be made again too
+    remade = {name for name in added if name in base}
+    if interface_changed:
+        remade.update(name for nodes in (base, new) for name, node in nodes.items()
+                      if node.get('bl_idname') in _GROUP_IO and name not in gone)
+    kept = base_edges & new_edges
+    unlink = [edge for edge in base_edges - new_edges if edge[0] not in gone and edge[2] not in gone]
+    unlink += [edge for edge in kept if (edge[0] in remade or edge[2] in remade)
+               and edge[0] not in gone and edge[2] not in gone]
+    link = list(new_edges - base_edges) + [edge for edge in kept if edge[0] in remade or edge[2] in remade]
+
+    nodes_delta = {}
+    for key, value in (('removed', removed), ('added', added), ('changed', changed),
+                       ('unlink', sorted(unlink)), ('link', sorted(link))):
+        if value:
+            nodes_delta[key] = value
+    return nodes_delta
+
+
+def base_fingerprint(node_types):
+    """
+    What a tree has to have for a delta to be applied to it, its nodes by name and type.
+        Groups and materials get other names when pasted, nodes don't
+    :param node_types: iterable of (node name, bl_idname)
+    """
+    text = '\n'.join(sorted('{}\t{}'.format(name, bl_idname) for name, bl_idname in node_types))
+    return hashlib.sha1(text.encode('utf8')).hexdigest()[:16]
+
+
+def diff(base, new):
+    """
+    :param base: the payload the delta is applied to
+    :param new: the payload it should become
+    :return: the delta, see the top of this file
+    """
+    interface_changed = base.get('interface') != new.get('interface')
+    delta = {'delta': DELTA_VERSION, 'name': new.get('name'), 'type': new.get('type'), 'base': base.get('name'),
+             'base_nodes': base_fingerprint((name, node.get('bl_idname')) for name, node in base['nodes'].items()),
+             'nodes': diff_nodes(base['nodes'], new['nodes'], interface_changed)}
+    base_groups = base.get('groups') or {}
+    new_groups = new.get('groups') or {}
+    groups = {}
+    added_groups = {}
+    for name, nodes in new_groups.items():
+        if name not in base_groups:
+            added_groups[name] = nodes
+        else:
+            nodes_delta = diff_nodes(base_groups[name], nodes)
+            if nodes_delta:
+                groups[name] = nodes_delta
+    removed_groups = [name for name in base_groups if name not in new_groups]
+    for key, value in (('groups', groups), ('new_groups', added_groups), ('removed_groups', removed_groups)):
+        if value:
+            delta[key] = value
+    if interface_changed:
+        delta['interface'] = new.get('interface')
+    return delta
+
+
+def is_empty(delta):
+    """True if the delta doesn't change anything"""
+    return not any(key in delta for key in ('groups', 'new_groups', 'removed_groups', 'interface')) \
+        and not delta['nodes']
+
+
+def _link(nodes, edge):
+    from_name, output, to_name, i = edge
+    targets = nodes[from_name].setdefault('outputs', {}).setdefault(str(output), {})
+    ids = targets.get(to_name)
+    if ids is None:
+        targets[to_name] = i
+    else:
+        ids = [ids] if isinstance(ids, int) else ids
+        targets[to_name] = ids + [i]
+
+
+def _unlink(nodes, edge):
+    from_name, output, to_name, i = edge
+    targets = nodes[from_name]['outputs'][str(output)]
+    ids = targets[to_name]
+    ids = [j for j in ([ids] if isinstance(ids, int) else ids) if j != i]
+    if not ids:
+        del targets[to_name]
+    else:
+        targets[to_name] = ids[0] if len(ids) == 1 else ids
+
+
+def patch_nodes(nodes, nodes_delta):
+    """Returns a copy of stored nodes with the changes from diff_nodes() made, the nodes given aren't changed"""
+    # Copied two levels deep, that's as deep as changes go, outputs are copied where links change
+    nodes = {name: dict(node) for name, node in nodes.items()}
+    removed = set(nodes_delta.get('removed', ()))
+    for name in removed:
+        del nodes[name]
+    touched = {edge[0] for key in ('unlink', 'link') for edge in nodes_delta.get(key, ())}
+    # Links into removed nodes go with them, like they do in Blender
+    touched.update(name for name, node in nodes.items()
+                   if any(isinstance(targets, dict) and not removed.isdisjoint(targets)
+                          for targets in node.get('outputs', {}).values()))
+    for name in touched:
+        if name in nodes and 'outputs' in nodes[name]:
+            nodes[name]['outputs'] = {output: dict(targets) if isinstance(targets, dict) else targets
+                                      for output, targets in nodes[name]['outputs'].items()}
+    for name in touched:
+        for targets in nodes.get(name, {}).get('outputs', {}).values():
+            if isinstance(targets, dict):
+                for to_name in removed.intersection(targets):
+                    del targets[to_name]
+    for edge in nodes_delta.get('unlink', ()):
+        _unlink(nodes, edge)
+    for name, node in nodes_delta.get('added', {}).items():
+        # without its links, those come in 'link'
+        nodes[name] = {key: value for key, value in node.items() if key != 'outputs'}
+    for name, change in nodes_delta.get('changed', {}).items():
+        node = nodes[name]
+        node.update(change.get('set', {}))
+        for key in change.get('unset', ()):
+            node.pop(key, None)
+        for key in ('inputs', 'out_dv'):
+            if key in change:
+                sockets = dict(node.get(key, {}))
+                for i, value in change[key].items():
+                    if value is None:
+                        sockets.pop(i, None)
+                    else:
+                        sockets[i] = value
+                if sockets:
+                    node[key] = sockets
+                else:
+                    node.pop(key, None)
+    for edge in nodes_delta.get('link', ()):
+        _link(nodes, edge)
+    # Outputs without links left aren't stored
+    for node in nodes.values():
+        outputs = node.get('outputs')
+        if outputs is not None:
+            outputs = {output: targets for output, targets in outputs.items() if targets != {}}
+            if outputs:
+                node['outputs'] = outputs
+            else:
+                del node['outputs']
+    return nodes
+
+
+def patch(base, delta):
+    """
+    The payload a delta makes of its base payload, without Blender. The base isn't changed
+    """
+    new = {key: value for key, value in base.items() if key not in ('nodes', 'groups', 'interface')}
+    new['name'] = delta['name']
+    new['nodes'] = patch_nodes(base['nodes'], delta['nodes'])
+    groups = dict(base.get('groups') or {})
+    for name in delta.get('removed_groups', ()):
+        groups.pop(name, None)
+    for name, nodes_delta in delta.get('groups', {}).items():
+        groups[name] = patch_nodes(groups[name], nodes_delta)
+    groups.update(delta.get('new_groups', {}))
+    if groups:
+        new['groups'] = groups
+    interface = delta['interface'] if 'interface' in delta else base.get('interface')
+    if interface is not None:
+        new['interface'] = interface
+    return new
+
+
+def make_prefix(blender_version, codec=nscodec.DEFAULT_CODEC, payload_format=nscodec.FORMAT_JSON):
+    """The prefix nscodec.make_prefix() makes, with ND for NS"""
+    return 'ND' + nscodec.make_prefix(blender_version, codec, payload_format)[2:]
+
+
+def is_delta_string(text):
+    return text.lstrip().startswith('ND')
+
+
+def encode(delta, blender_version, codec=nscodec.DEFAULT_CODEC, payload_format=nscodec.FORMAT_JSON):
+    """Write a delta string"""
+    data = nscodec.encode_payload(delta, payload_format)
+    return make_prefix(blender_version, codec, payload_format) + nscodec.compress(data, codec)
+
+
+def decode(delta_string):
+    """
+    Read a delta string
+    :return: (nscodec.parse_prefix() of its prefix, the delta)
+    :raises ValueError: if it isn't a readable delta string
+    """
+    prefix, separator, body = delta_string.strip().partition('!')
+    if not separator or not prefix.startswith('ND'):
+        raise ValueError('Not a Node Sharer delta string')
+    # Same prefix as a Node Sharer string after the first two letters
+    info = nscodec.parse_prefix('NS' + prefix[2:])
+    try:
+        data = nscodec.decompress(body, info[2])
+    except (binascii.Error, zlib.error, lzma.LZMAError) as e:
+        raise ValueError('Node Sharer delta string is damaged: {}'.format(e)) from e
+    delta = nscodec.decode_payload(data, info[3])
+    if not isinstance(delta, dict) or not isinstance(delta.get('nodes'), dict):
+        raise ValueError('Not a Node Sharer delta')
+    if not isinstance(delta.get('delta'), int) or delta['delta'] > DELTA_VERSION:
+        raise ValueError('Delta made by a newer version of Node Sharer')
+    return info, delta
@@ -0,0 +1,114 @@
+"""
+Logging and profiling for Node Sharer
+
+All Node Sharer messages go to the "nodesharer" logger, which is off by default,
+so copying and pasting big node trees doesn't spend its time printing to the console.
+Messages are formatted lazily, log.debug('node %s', name) costs next to nothing when it's off.
+
+Turn it on from Blender's Python console with:
+    from <addon> import nslog
+    nslog.enable()                  # DEBUG and up to the system console
+    nslog.enable(logging.WARNING)   # just the failures
+    nslog.enable_profiling()        # per phase timing counters
+    nslog.timings.report()
+
+or set the NODESHARER_LOG environment variable to a level name, like NODESHARER_LOG=DEBUG,
+before starting Blender.
+"""
+
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger('nodesharer')
+log.addHandler(logging.NullHandler())
+log.propagate = False
+log.setLevel(logging.CRITICAL + 1)  # off
+
+_handler = None
+
+
+def enable(level=logging.DEBUG):
+    """Send Node Sharer messages of level and up to stderr, which is Blender's system console"""
+    global _handler
+    if _handler is None:
+        _handler = logging.StreamHandler()
+        _handler.setFormatter(logging.Formatter('Node Sharer %(levelname)s: %(message)s'))
+        log.addHandler(_handler)
+    log.setLevel(level)
+
+
+def disable():
+    """Turn Node Sharer logging off again"""
+    global _handler
+    if _handler is not None:
+        log.removeHandler(_handler)
+        _handler = None
+    log.setLevel(logging.CRITICAL + 1)
+
+
+class PhaseTimings:
+    """Accumulates time spent in each phase of a copy or paste.
+        Timing is off by default, phase() then only costs a function call
+    """
+    PHASES = ('capture', 'serialize', 'compress', 'decode', 'build', 'link')
+
+    def __init__(self):
+        self.enabled = False
+        self.totals = {}
+        self.counts = {}
+        self.reset()
+
+    def reset(self):
+        self.totals = dict.fromkeys(self.PHASES, 0.0)
+        self.counts = dict.fromkeys(self.PHASES, 0)
+
+    @contextmanager
+    def phase(self, name):
+        """with timings.phase('capture'): ... adds the time spent in the block to that phase"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start)
+
+    def clock(self):
+        """Start time for add(), for phases that don't fit in a with block"""
+        return time.perf_counter() if self.enabled else None
+
+    def add(self, name, start):
+        """Add the time since start, from clock(), to a phase"""
+        if start is None:
+            return
+        self.totals[name] = self.totals.get(name, 0.0) + time.perf_counter() - start
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def report(self):
+        """Returns the totals as text, and logs them at INFO level"""
+        lines = ['{:<10} {:>6} calls {:>10.2f} ms'.format(name, self.counts[name], self.totals[name] * 1000)
+                 for name in self.totals]
+        text = '\n'.join(lines)
+        log.info('Phase timings:\n%s', text)
+        return text
+
+
+timings = PhaseTimings()
+
+
+def enable_profiling(reset=True):
+    """Start counting time per phase, see timings.report()"""
+    if reset:
+        timings.reset()
+    timings.enabled = True
+
+
+def disable_profiling():
+    timings.enabled = False
+
+
+if os.environ.get('NODESHARER_LOG'):
+    enable(getattr(logging, os.environ['NODESHARER_LOG'].upper(), logging.DEBUG))
@@ -0,0 +1,210 @@
+"""
+Streaming node tree files
+
+Node tree files are the same JSON document NS_nodetree.dumps_nodetree_JSON() makes, but written
+and read a node at a time, so saving or loading a huge tree never holds the whole document in memory.
+
+Files written here have their keys in a fixed order:
+    {"name":..., "type":..., "interface":..., "stream":1, "groups":{...}, "nodes":{...}}
+with the groups leaves first, so a reader can build every group, and then the tree,
+as the nodes come in. "stream" marks files that keep that promise, any other
+node tree JSON can still be read, it's just buffered first.
+
+Paths ending in .gz are gzip compressed, gzip files are also recognized when reading.
+
+Nothing in here needs Blender.
+"""
+
+import gzip
+import json
+import os
+
+STREAM_VERSION = 1
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_WHITESPACE = ' \t\n\r'
+_NUMBER_START = frozenset('-0123456789')
+_NUMBER_CHARS = frozenset('0123456789+-.eE')
+_decoder = json.JSONDecoder()
+
+
+def open_tree_file(path, mode='r'):
+    """
+    Open a node tree file as text
+    :param path: file path, written gzip compressed if it ends in .gz
+    :param mode: 'r' or 'w'
+    """
+    if mode == 'r':
+        with open(path, 'rb') as file:
+            gzipped = file.read(2) == _GZIP_MAGIC
+    else:
+        gzipped = path.lower().endswith('.gz')
+    if gzipped:
+        return gzip.open(path, mode + 't', encoding='utf8')
+    return open(path, mode, encoding='utf8')
+
+
+def read_fraction(file):
+    """How far reading a file from open_tree_file() has got, 0 to 1, None if that can't be told"""
+    try:
+        raw = file.buffer
+        # gzip files, how far into the compressed file
+        raw = getattr(raw, 'fileobj', raw)
+        size = os.fstat(raw.fileno()).st_size
+        return min(1.0, raw.tell() / size) if size else None
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _write_nodes(file, nodes, dump):
+    file.write('{')
+    separator = ''
+    for name, properties in nodes:
+        file.write(separator + dump(name) + ':' + dump(properties))
+        separator = ','
+    file.write('}')
+
+
+def write_tree(file, header, groups, nodes, default=None):
+    """
+    Write a node tree document piece by piece
+    :param file: text file to write to
+    :param header: dict of the small top level values, name, type and interface
+    :param groups: iterable of (group name, iterable of (node name, node properties)), leaves first
+    :param nodes: iterable of (node name, node properties) of the tree itself
+    :param default: like json.dumps' default, for objects in the node properties
+    Nodes are only asked for as they are written, so they can be captured on the fly
+    """
+    def dump(value):
+        return json.dumps(value, separators=(',', ':'), default=default)
+
+    file.write('{')
+    for key, value in header.items():
+        file.write(dump(key) + ':' + dump(value) + ',')
+    file.write('"stream":' + str(STREAM_VERSION) + ',"groups":{')
+    separator = ''
+    for name, group_nodes in groups:
+        file.write(separator + dump(name) + ':')
+        _write_nodes(file, group_nodes, dump)
+        separator = ','
+    file.write('},"nodes":')
+    _write_nodes(file, nodes, dump)
+    file.write('}')
+
+
+class _Reader:
+    """Just enough of a JSON parser to walk the top levels of a document,
+        whole values are handed to the json module as soon as they're in the buffer
+    """
+
+    def __init__(self, file, chunk_size):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Read more of the file, at least doubling what's left in the buffer. False at the end of the file"""
+        chunk = self.file.read(max(self.chunk_size, len(self.buffer) - self.pos))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next character that isn't whitespace, without consuming it"""
+        while True:
+            buffer = self.buffer
+            pos = self.pos
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                pos += 1
+            self.pos = pos
+            if pos < len(buffer):
+                return buffer[pos]
+            if not self.fill():
+                raise ValueError('Node tree file ended too soon')
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Expected {!r} in node tree file, found {!r}'.format(char, self.buffer[self.pos]))
+        self.pos += 1
+
+    def value(self):
+        """Parse one whole JSON value"""
+        self.peek()
+        while True:
+            buffer = self.buffer
+            pos = self.pos
+            if buffer[pos] in _NUMBER_START and not self.eof:
+                # A number right at the end of the buffer might go on in the next chunk,
+                #  -1. parses as -1, so it's only whole once something else comes after it
+                end = pos + 1
+                while end < len(buffer) and buffer[end] in _NUMBER_CHARS:
+                    end += 1
+                if end == len(buffer):
+                    self.fill()
+                    continue
+            try:
+                value, end = _decoder.raw_decode(buffer, pos)
+                self.pos = end
+                return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise ValueError('Invalid node tree file: {}'.format(e)) from e
+            self.fill()
+
+    def members(self):
+        """Yields the keys of an object one by one, the caller has to read each value before asking for the next"""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            char = self.peek()
+            self.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError('Expected , or }} in node tree file, found {!r}'.format(char))
+
+    def nodes(self):
+        for name in self.members():
+            yield name, self.value()
+
+
+def _drain(iterator):
+    for _ in iterator:
+        pass
+
+
+def iter_tree(file, chunk_size=1 << 16):
+    """
+    Read a node tree document piece by piece
+    :param file: text file to read from
+    :param chunk_size: characters read at a time
+    Yields, in file order:
+        ('header', key, value) for the small top level values
+        ('group', group name, iterator of (node name, node properties))
+        ('nodes', None, iterator of (node name, node properties))
+    Node iterators have to be used before asking for the next item, anything left in them is skipped
+    :raises ValueError: if the file isn't valid JSON
+    """
+    reader = _Reader(file, chunk_size)
+    for key in reader.members():
+        if key not in ('groups', 'nodes') or reader.peek() != '{':
+            yield 'header', key, reader.value()
+        elif key == 'groups':
+            for name in reader.members():
+                nodes = reader.nodes()
+                yield 'group', name, nodes
+                _drain(nodes)
+        else:
+            nodes = reader.nodes()
+            yield 'nodes', None, nodes
+            _drain(nodes)
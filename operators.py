@@ -0,0 +1,565 @@
+"""
+Node Sharer operators and menu
+
+This is all Blender loads when the add-on is registered. nodesharer, with all the code that
+captures and builds node trees, is only imported the first time one of the operators runs.
+"""
+
+import logging
+import sys
+import time
+
+import bpy  # type: ignore
+from bpy.props import StringProperty, BoolProperty, EnumProperty  # type: ignore
+
+from .nscodec_items import CODEC_ITEMS
+from .nslog import log, timings
+
+
+class NS_build_in_steps:
+    """Operator mixin for building big trees a bit at a time from a timer, so Blender stays responsive.
+        Esc cancels, and removes everything built so far
+    """
+    step_seconds = 0.05  # time spent building per timer tick
+
+    def start_steps(self, context, builder=None, steps=None, future=None, then=None):
+        """
+        :param builder: the NS_nodetree doing the building
+        :param steps: generator from one of its *_steps() methods
+        :param future: instead of builder and steps, concurrent.futures.Future of a string being read in
+                       the background, see nscodec.in_background(). Nothing is created before it's read
+        :param then: with future, called with its result once it's read, returns (builder, steps)
+        """
+        self._builder = builder
+        self._steps = steps
+        self._future = future
+        self._then = then
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.01, window=context.window)
+        wm.progress_begin(0, 100)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if self._timer is None:
+            return {'PASS_THROUGH'}  # already ended
+        try:
+            return self.step(context, event)
+        except Exception as e:
+            # Whatever went wrong, the timer, progress bar and status text go, and so does what was built
+            log.exception('Building in steps failed')
+            self.end_steps(context)
+            if self._future is not None:
+                self._future.cancel()
+            elif self._builder is not None:
+                self._builder.rollback()
+            self.report({'ERROR'}, 'Node Sharer: failed, nothing was added: ' + str(e))
+            return {'CANCELLED'}
+
+    def step(self, context, event):
+        """modal() without the clean up if something fails"""
+        if event.type == 'ESC':
+            self.end_steps(context)
+            if self._future is not None:
+                self._future.cancel()  # if it's already being read, it's just never used
+            else:
+                self._builder.rollback()
+            self.report({'WARNING'}, 'Node Sharer: cancelled, nothing was added')
+            return {'CANCELLED'}
+        if event.type != 'TIMER' or event.timer != self._timer:
+            return {'PASS_THROUGH'}
+
+        if self._future is not None:
+            if not self._future.done():
+                context.workspace.status_text_set('Node Sharer: reading, Esc to cancel')
+                return {'PASS_THROUGH'}
+            future = self._future
+            self._future = None
+            try:
+                result = future.result()
+            except ValueError as e:
+                # A broken string, nothing was created
+                self.end_steps(context)
+                self.report({'ERROR'}, "Failed to paste, make sure it\'s an actual Node Sharer text string: " + str(e))
+                return {'CANCELLED'}
+            self._builder, self._steps = self._then(result)
+
+        self._builder.deadline = time.perf_counter() + self.step_seconds
+        try:
+            next(self._steps)
+        except StopIteration:
+            self.end_steps(context)
+            self.steps_finished(context)
+            return {'FINISHED'}
+        progress = self._builder.progress()
+        context.window_manager.progress_update(int(progress * 100))
+        context.workspace.status_text_set('Node Sharer: building {:.0%}, Esc to cancel'.format(progress))
+        return {'PASS_THROUGH'}
+
+    def end_steps(self, context):
+        """Removes the timer, progress bar and status text, and closes the steps, so a file being
+            built from is closed right away. Only the first time it's called
+        """
+        if self._timer is None:
+            return
+        if self._steps is not None:
+            self._steps.close()
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        self._timer = None
+        wm.progress_end()
+        context.workspace.status_text_set(None)
+
+    def steps_finished(self, context):
+        """Called once everything is built"""
+        pass
+
+
+class OBJECT_MT_ns_copy_material(bpy.types.Operator):
+    """Node Sharer: Copy complete material node setup as compressed string"""  # Use this as a tooltip for menu items and buttons.
+    bl_idname = "node.ns_copy_material"  # Unique identifier for buttons and menu items to reference.
+    bl_label = "Copy material as a text string"  # Display name in the interface.
+    bl_options = {'REGISTER'}  # 
+
+    codec: EnumProperty(
+        name="Compression",
+        description="How the text string is compressed",
+        items=CODEC_ITEMS,
+        default='FAST',
+        )  # type: ignore
+    binary: BoolProperty(
+        name="Compact binary",
+        description="Encode the nodes in a compact binary format instead of JSON, "
+                    "older versions of Node Sharer can't paste these",
+        default=False,
+        )  # type: ignore
+    socket_identifiers: BoolProperty(
+        name="Socket identifiers",
+        description="Also store which sockets values and links are on by identifier, "
+                    "so they end up on the same sockets in versions of Blender that add sockets to nodes",
+        default=False,
+        )  # type: ignore
+
+    def execute(self, context):  # execute() is called when running the operator.
+        # Imported on first use, so registering the add-on stays quick
+        from . import nodesharer
+
+        with timings.phase('capture'):
+            my_mat = nodesharer.NS_material(context.material, socket_identifiers=self.socket_identifiers)
+#        my_mat = nodesharer.NS_material(context.space_data.edit_tree)
+        if log.isEnabledFor(logging.DEBUG):
+            my_mat.print_tree()
+        ns_string, length = my_mat.compress(self.codec, self.binary)
+        bpy.types.Scene.ns_string = ns_string
+        text = 'Copied material as Node Sharer text string to clipboard. Text length: ' + str(length)
+        self.report({'INFO'}, text)
+
+        return {'FINISHED'}  # Lets Blender know the operator finished successfully.
+
+class OBJECT_MT_ns_export_material(bpy.types.Operator):
+    """Node Sharer: Export complete material node setup as a JSON text string to the clipboard"""  # Use this as a tooltip for menu items and buttons.
+    bl_idname = "node.ns_export_material"  # Unique identifier for buttons and menu items to reference.
+    bl_label = "Export material as text string"  # Display name in the interface.
+    bl_options = {'REGISTER'}  # 
+
+    def execute(self, context):  # execute() is called when running the operator.
+        from . import nodesharer
+
+        # Materials have a bunch of properties outside of just the node tree,
+        #  so if we're in the shader editor, we run the original code
+        if (context.material): 
+            log.debug('The current context has a material')
+            with timings.phase('capture'):
+                my_mat = nodesharer.NS_material(context.material)
+#        my_mat = nodesharer.NS_material(context.space_data.edit_tree) #DEBUG
+        #my_mat.print_tree()
+            with timings.phase('serialize'):
+                json_string = my_mat.dumps_mat_JSON()
+            bpy.context.window_manager.clipboard = json_string
+        #text = 'yyyCopied material as Node Sharer text string to clipboard. Text length: '
+        #self.report({'INFO'}, text)
+        else:
+            log.debug('We were in a different node editor')
+            editor_node_tree = context.space_data.edit_tree
+            with timings.phase('capture'):
+                my_node_tree = nodesharer.NS_nodetree(editor_node_tree)
+                for node in editor_node_tree.nodes:
+                    my_node_tree.add_node(node)
+                
+            with timings.phase('serialize'):
+                json_string = my_node_tree.dumps_nodetree_JSON()
+            bpy.context.window_manager.clipboard = json_string
+
+        return {'FINISHED'}  # Lets Blender know the operator finished successfully.
+
+class OBJECT_MT_ns_paste_material(NS_build_in_steps, bpy.types.Operator):
+    """Node Sharer: Paste complete material node setup from text string"""  # Use this as a tooltip for menu items and buttons.
+    bl_idname = "node.ns_paste_material"  # Unique identifier for buttons and menu items to reference.
+    bl_label = "Paste material from text string in clipboard"  # Display name in the interface.
+    bl_options = {'REGISTER'}  #
+
+    group_mode: EnumProperty(
+        name="Node groups",
+        description="What to do with node groups that are already in the file",
+        items=[('COPY', "Copy", "Always make new copies of the node groups"),
+               ('INSTANCE', "Use existing", "Use identical node groups already in the file instead of copying them")],
+        default='COPY',
+        )  # type: ignore
+    in_steps: BoolProperty(
+        name="In steps",
+        description="Build the material a bit at a time, so Blender stays responsive while pasting big trees. "
+                    "Esc cancels and removes what was built",
+        default=False,
+        )  # type: ignore
+
+    def execute(self, context):  # execute() is called when running the operator.
+        from . import nodesharer
+        log.debug('Paste material')
+
+        if self.in_steps:
+            from . import nscodec
+            # The string is read, checked and fixed in the background, before anything is built
+            self._ns_string = bpy.context.window_manager.clipboard
+            future = nscodec.decode_in_background(self._ns_string, bpy.app.version,
+                                                  nodesharer.NS_mat_constructor.payload_cache)
+            return self.start_steps(context, future=future, then=self.start_build)
+
+        new_mat = nodesharer.NS_mat_constructor(bpy.context.window_manager.clipboard, self.group_mode)
+        try:
+            text = 'Pasted material from Node Sharer text string. Material name: ' + str(new_mat.b_mat.name)
+            level = 'INFO'
+        except AttributeError:
+            text = "Failed to paste material, make sure it\'s an actual Node Sharer text string"
+            level = 'ERROR'
+        self.report({level}, text)
+
+        return {'FINISHED'}  # Lets Blender know the operator finished successfully.
+
+    def start_build(self, payload):
+        """The builder and its steps, once the string is read, see start_steps()"""
+        from . import nodesharer
+        new_mat = nodesharer.NS_mat_constructor(self._ns_string.strip(), self.group_mode, build=False, payload=payload)
+        return new_mat, new_mat.build_steps()
+
+    def steps_finished(self, context):
+        self.report({'INFO'}, 'Pasted material from Node Sharer text string. Material name: '
+                    + str(self._builder.b_mat_name_actual))
+
+class OBJECT_MT_ns_copy_delta(bpy.types.Operator):
+    """Node Sharer: Copy what changed in the material since it was last copied, as a delta string"""
+    bl_idname = "node.ns_copy_delta"
+    bl_label = "Copy material changes as a delta string"
+    bl_options = {'REGISTER'}
+
+    codec: EnumProperty(
+        name="Compression",
+        description="How the text string is compressed",
+        items=CODEC_ITEMS,
+        default='FAST',
+        )  # type: ignore
+
+    def execute(self, context):
+        import json
+        from . import nodesharer, nscodec, nsdelta
+
+        # Deltas are of materials, not of node trees open in other node editors
+        if context.material is None:
+            self.report({'ERROR'}, 'No active material to copy the changes of')
+            return {'CANCELLED'}
+        # The delta is made against the last string copied in this session
+        base_string = getattr(bpy.types.Scene, 'ns_string', '')
+        if not isinstance(base_string, str) or not base_string:
+            self.report({'ERROR'}, 'Copy the material as a text string first, the delta is made from that')
+            return {'CANCELLED'}
+        try:
+            info, base = nscodec.decode(base_string)
+        except ValueError as e:
+            self.report({'ERROR'}, 'Failed to read the last copied string: ' + str(e))
+            return {'CANCELLED'}
+        if base.get('name') != context.material.name:
+            self.report({'ERROR'}, 'The last copied string is of ' + str(base.get('name'))
+                        + ', copy this material as a text string first, the delta is made from that')
+            return {'CANCELLED'}
+        if info[1] != int(nscodec.blender_version_code(bpy.app.version)):
+            nscodec.fix_versions(base, info, bpy.app.version)
+
+        with timings.phase('capture'):
+            my_mat = nodesharer.NS_material(context.material)
+            new = json.loads(my_mat.dump_mat_JSON())
+        delta = nsdelta.diff(base, new)
+        delta_string = nsdelta.encode(delta, bpy.app.version, self.codec)
+        bpy.context.window_manager.clipboard = delta_string
+        # The next delta is made from this version
+        bpy.types.Scene.ns_string = nscodec.encode(new, bpy.app.version, self.codec)
+        text = 'Copied material changes as Node Sharer delta string to clipboard. Text length: ' \
+            + str(len(delta_string)) + ', whole material: ' + str(len(bpy.types.Scene.ns_string))
+        self.report({'INFO'}, text)
+
+        return {'FINISHED'}
+
+class OBJECT_MT_ns_apply_delta(bpy.types.Operator):
+    """Node Sharer: Change the material or node tree with a delta string from the clipboard"""
+    bl_idname = "node.ns_apply_delta"
+    bl_label = "Apply delta string in clipboard"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        from . import nodesharer, nsdelta
+        log.debug('Apply delta')
+
+        delta_string = bpy.context.window_manager.clipboard
+        if not nsdelta.is_delta_string(delta_string):
+            self.report({'ERROR'}, "The clipboard doesn't hold a Node Sharer delta string")
+            return {'CANCELLED'}
+        target = context.material or context.space_data.edit_tree
+        patcher = nodesharer.NS_delta_patcher(delta_string, target)
+        if patcher.patched:
+            self.report({'INFO'}, 'Applied Node Sharer delta string to ' + str(patcher.name))
+        else:
+            self.report({'ERROR'}, 'Failed to apply delta: ' + str(patcher.error))
+
+        return {'FINISHED'}
+
+class OBJECT_MT_ns_unregister_addon(bpy.types.Operator):
+    """Node Sharer: unregisters the addon for debugging"""  # Use this as a tooltip for menu items and buttons.
+    bl_idname = "node.ns_unregister_addon"  # Unique identifier for buttons and menu items to reference.
+    bl_label = "Unregister NodeSharer"  # Display name in the interface.
+    bl_options = {'REGISTER'}  #
+
+    def execute(self, context):  # execute() is called when running the operator.
+        log.debug('unregistering...')
+        unregister()
+
+        return {'FINISHED'}  # Lets Blender know the operator finished successfully.
+    
+class NS_load_nodetree(NS_build_in_steps):
+    """Loading a node tree, from the clipboard or a file, for the two load operators"""
+    # Function signature for the construct method
+    #def construct(self, ns_nodes, nt, nt_parent_name, is_material=False, is_nodegroup=False):   
+    """
+        Constructs a node tree
+        :param nt_parent_name: name of node tree parent, either material or node group
+        :param is_nodegroup: bool is node group
+        :param ns_nodes: node sharer dict
+        :param nt: Blender node tree
+        :param is_material: bool is material
+        """
+    filepath: StringProperty(
+        name="File Path",
+        description="Node tree file to load, loads from the clipboard if empty",
+        subtype='FILE_PATH'
+        )  # type: ignore
+    group_mode: EnumProperty(
+        name="Node groups",
+        description="What to do with node groups that are already in the file",
+        items=[('COPY', "Copy", "Always make new copies of the node groups"),
+               ('INSTANCE', "Use existing", "Use identical node groups already in the file instead of copying them")],
+        default='COPY',
+        )  # type: ignore
+    in_steps: BoolProperty(
+        name="In steps",
+        description="Build the node tree a bit at a time, so Blender stays responsive while loading big trees. "
+                    "Esc cancels and removes what was built",
+        default=False,
+        )  # type: ignore
+
+    def execute(self, context):  # execute() is called when running the operator.
+        from . import nodesharer, nscodec, nsstream
+        log.debug('Paste tree')
+
+        new_tree = nodesharer.NS_nodetree()
+        new_tree.group_mode = self.group_mode
+        if self.in_steps:
+            if self.filepath:
+                # Files are read as they're built, there's never much read ahead of building
+                return self.start_steps(context, new_tree, self.file_steps(new_tree, self.filepath))
+            self._new_tree = new_tree
+            future = nscodec.in_background(nscodec.load_tree_json, bpy.context.window_manager.clipboard)
+            return self.start_steps(context, future=future, then=self.start_build)
+
+        if self.filepath:
+            # Build the nodes as they're read, big trees never have to fit in memory as a string
+            with nsstream.open_tree_file(self.filepath) as file:
+                new_tree.construct_from_file(file)
+        else:
+            new_tree.construct_from_JSON(bpy.context.window_manager.clipboard)
+        try:
+            text = 'Pasted material from Node Sharer text string. Tree name: ' + str(new_tree.b_nodeTree_name_actual)
+            level = 'INFO'
+        except AttributeError:
+            text = "Failed to paste material, make sure it\'s an actual Node Sharer text string"
+            level = 'ERROR'
+        self.report({level}, text)
+
+        return {'FINISHED'}  # Lets Blender know the operator finished successfully.
+
+    @staticmethod
+    def file_steps(new_tree, filepath):
+        """Builds from the file in steps, the file is open until it's done or cancelled"""
+        from . import nsstream
+        with nsstream.open_tree_file(filepath) as file:
+            yield from new_tree.construct_from_file_steps(file)
+
+    def start_build(self, tree):
+        """The builder and its steps, once the JSON is read, see start_steps()"""
+        return self._new_tree, self._new_tree.construct_from_JSON_steps(tree)
+
+    def steps_finished(self, context):
+        self.report({'INFO'}, 'Pasted material from Node Sharer text string. Tree name: '
+                    + str(self._builder.b_nodeTree_name_actual))
+
+
+class OBJECT_MT_ns_load_nodetree_from_file(NS_load_nodetree, bpy.types.Operator):
+    """Node Sharer: Loads a node tree from JSON text in the clipboard, or from filepath if it's set"""
+    bl_idname = "node.ns_load_nodetree_from_file"
+    bl_label = "Load Nodetree from Clipboard"
+    bl_options = {'REGISTER'}
+
+    # def execute(self, context):
+    #     # Get our node tree
+    #     editor_node_tree = context.space_data.edit_tree
+    #     # make sure we have a node tree open in the editor
+    #     if (editor_node_tree != None):
+    #         my_node_tree = nodesharer.NS_nodetree(editor_node_tree.nodes)
+#            my_node_tree.construct(my_node_tree._nodes,
+#                        bpy.data.node_groups[0], #FIX THIS SO IT'S ACTUALLY THE NODETREE'S NAME
+#                       is_material=False, is_nodegroup=True)
+        
+    
+class OBJECT_MT_ns_open_nodetree_file(NS_load_nodetree, bpy.types.Operator):
+    """Node Sharer: Loads a node tree from a file, see Save Nodetree to File"""
+    bl_idname = "node.ns_open_nodetree_file"
+    bl_label = "Load Nodetree from File"
+    bl_options = {'REGISTER'}
+
+    def execute(self, context):
+        if not self.filepath:
+            self.report({'ERROR'}, 'No node tree file to load')
+            return {'CANCELLED'}
+        return super().execute(context)
+
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+
+class OBJECT_MT_ns_save_nodetree_to_file(bpy.types.Operator):
+    """Node Sharer: Saves this node tree to a JSON file"""
+    bl_idname = "node.ns_save_nodetree_to_file"
+    bl_label = "Save Nodetree to File"
+    bl_options = {'REGISTER'}
+    
+    filename: StringProperty(
+        name="Outdir Path",
+        description="Where I will save my stuff",
+        subtype='FILE_NAME'
+        # subtype='DIR_PATH' is not needed to specify the selection mode.
+        # But this will be anyway a directory path.
+        ) # type: ignore
+    
+    
+    filepath: StringProperty(
+        name="Outdir Path",
+        description="Where I will save my stuff",
+        subtype='FILE_PATH'
+        # subtype='DIR_PATH' is not needed to specify the selection mode.
+        # But this will be anyway a directory path.
+        )  # type: ignore
+
+    use_gzip: BoolProperty(
+        name="Gzip",
+        description="Compress the file with gzip, adds .gz to the file name",
+        default=False,
+        )  # type: ignore
+
+    @classmethod
+    def poll(cls, context):
+        return context.object is not None
+    
+    def execute(self, context):
+        from . import nodesharer, nsstream
+        # guard against a switched context
+        #if self.options.is_invoke:
+            # The context may have changed since invoking the file selector.
+        #        self.report({'ERROR'}, "Invalid context")
+        #        return {'CANCELLED'}
+
+        log.debug("Selected file: '%s', full path: %s", self.filename, self.filepath)
+        
+        # Get our node tree
+        editor_node_tree = context.space_data.edit_tree
+        # make sure we have one
+        if (editor_node_tree != None):
+            filepath = self.filepath
+            if self.use_gzip and not filepath.lower().endswith('.gz'):
+                filepath += '.gz'
+            # Nodes are written as they're captured, so big trees don't have to fit in memory as a string
+            with nsstream.open_tree_file(filepath, 'w') as file:
+                nodesharer.NS_nodetree.write_to_file(editor_node_tree, file)
+            log.debug('finished')
+        else:
+            log.warning('No node tree available, has the context changed?')
+
+        return {'FINISHED'}
+
+    def invoke(self, context, event):
+        nodetree_name = context.space_data.edit_tree.name_full
+        nodetree_name = nodetree_name.replace(" ", "")
+        self.filename =  nodetree_name + ".json"
+        # Open browser, take reference to 'self' read the path to selected
+        # file, put path in predetermined self fields.
+        # See: https://docs.blender.org/api/current/bpy.types.WindowManager.html#bpy.types.WindowManager.fileselect_add
+        context.window_manager.fileselect_add(self)
+        # Tells Blender to hang on for the slow user input
+        return {'RUNNING_MODAL'}
+
+
+
+def menu_func(self, context):
+    self.layout.operator(OBJECT_MT_ns_copy_material.bl_idname)
+    self.layout.operator(OBJECT_MT_ns_export_material.bl_idname)
+    self.layout.operator(OBJECT_MT_ns_paste_material.bl_idname)
+    self.layout.operator(OBJECT_MT_ns_copy_delta.bl_idname)
+    self.layout.operator(OBJECT_MT_ns_apply_delta.bl_idname)
+    self.layout.operator(OBJECT_MT_ns_save_nodetree_to_file.bl_idname)
+    self.layout.operator(OBJECT_MT_ns_load_nodetree_from_file.bl_idname)
+    self.layout.operator(OBJECT_MT_ns_open_nodetree_file.bl_idname)
+    self.layout.operator(OBJECT_MT_ns_unregister_addon.bl_idname)
+    
+
+
+classes = (
+    OBJECT_MT_ns_copy_material,
+    OBJECT_MT_ns_export_material,
+    OBJECT_MT_ns_paste_material,
+    OBJECT_MT_ns_copy_delta,
+    OBJECT_MT_ns_apply_delta,
+    OBJECT_MT_ns_unregister_addon,
+    OBJECT_MT_ns_save_nodetree_to_file,
+    OBJECT_MT_ns_load_nodetree_from_file,
+    OBJECT_MT_ns_open_nodetree_file,
+)
+
+
+def register():
+    bpy.types.Scene.ns_string = bpy.props.StringProperty(name = "NodeString", default="")
+    for cls in classes:
+        bpy.utils.register_class(cls)
+    bpy.types.NODE_MT_node.append(menu_func)
+    log.info('registered Add-on: Node Sharer')
+
+
+def unregister():
+    nscodec = sys.modules.get(__package__ + '.nscodec')
+    if nscodec is not None:  # only imported if something was pasted
+        nscodec.shutdown_background()
+    bpy.types.NODE_MT_node.remove(menu_func)
+    for cls in reversed(classes):
+        bpy.utils.unregister_class(cls)
+    log.info('unregistered Add-on: Node Sharer')
+
+
+# This allows you to run the script directly from Blender's Text editor
+# to test the add-on without having to install it.
+if __name__ == "__main__":
+    register()
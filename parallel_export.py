@@ -0,0 +1,150 @@
+"""
+Node Sharer parallel export
+
+Exports every .blend file in a folder into one zip archive, running a background Blender
+per file, as many at a time as there are cores. Run it with plain Python, not inside Blender:
+    python parallel_export.py path/to/library --out library.zip --blender path/to/blender
+
+Every Blender runs batch_export.py on its file. The archive has a folder per .blend file, with the
+files batch_export.py makes, and an index.json of every exported datablock:
+    {"files": {"props/wood.blend": {"materials": {"Oak": {"file": "props/wood/materials/Oak.txt",
+                                                          "hash": ...}},
+                                    "node_groups": {...}}},
+     "failed_datablocks": {"props/rocks.blend": {"materials": {"Granite": "error message"}}},
+     "failed": {"props/broken.blend": "error message"}}
+A .blend file is only listed in "failed" when Blender didn't get as far as writing the manifest,
+datablocks that failed on their own don't lose the ones that exported.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+BATCH_EXPORT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'batch_export.py')
+INDEX = 'index.json'
+# already compressed, deflating them again only costs time
+_STORED = ('.txt', '.gz')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Export the node trees of many .blend files in parallel')
+    parser.add_argument('folder', help='folder to look for .blend files in, sub folders included')
+    parser.add_argument('--out', required=True, help='zip archive to write')
+    parser.add_argument('--blender', default='blender', help='Blender executable')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='Blenders to run at a time')
+    parser.add_argument('--timeout', type=float, default=None, help='seconds to give each .blend file')
+    parser.add_argument('--codec', help='compression of the material text strings, see batch_export.py')
+    parser.add_argument('--binary', action='store_true', help='compact binary material strings')
+    return parser.parse_args(argv)
+
+
+def find_blend_files(folder):
+    """Relative paths of the .blend files in folder, biggest first, so a big file
+        doesn't start last and keep the others waiting
+    """
+    found = []
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            if name.endswith('.blend'):
+                path = os.path.join(root, name)
+                found.append((os.path.getsize(path), os.path.relpath(path, folder)))
+    return [path for size, path in sorted(found, reverse=True)]
+
+
+def worker_command(blender, blend_file, out_dir, args):
+    """Command line of the background Blender exporting one file"""
+    command = [blender, '--background', '--factory-startup', blend_file,
+               '--python-exit-code', '1', '--python', BATCH_EXPORT, '--', '--out', out_dir, '--force']
+    if args.codec:
+        command += ['--codec', args.codec]
+    if args.binary:
+        command.append('--binary')
+    return command
+
+
+def export_file(folder, blend_file, args):
+    """
+    Export one .blend file with a background Blender, runs in a pool thread, the work is in the Blender process
+    :return: (manifest batch_export.py wrote, {archive path: file content},
+        {kind: {datablock name: error message}} of the datablocks that failed)
+    :raises RuntimeError: if Blender failed before writing the manifest
+    """
+    with tempfile.TemporaryDirectory(prefix='nodesharer-') as out_dir:
+        result = subprocess.run(worker_command(args.blender, os.path.join(folder, blend_file), out_dir, args),
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=args.timeout)
+        manifest_path = os.path.join(out_dir, 'manifest.json')
+        # batch_export.py exits with 1 when any datablock failed, the manifest still has the others
+        if not os.path.exists(manifest_path):
+            lines = result.stdout.decode('utf8', 'replace').strip().splitlines()
+            raise RuntimeError('Blender exited with {}: {}'.format(result.returncode, lines[-1] if lines else ''))
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+        failed = manifest.pop('failed', {})
+
+        archive_dir = os.path.splitext(blend_file)[0].replace(os.sep, '/')
+        contents = {}
+        for entries in manifest.values():
+            for entry in entries.values():
+                with open(os.path.join(out_dir, entry['file']), 'rb') as file:
+                    contents[archive_dir + '/' + entry['file'].replace(os.sep, '/')] = file.read()
+                entry['file'] = archive_dir + '/' + entry['file'].replace(os.sep, '/')
+        return manifest, contents, failed
+
+
+def export_folder(folder, out, args, export=export_file):
+    """
+    Export every .blend file in folder to the zip archive out, args.jobs at a time
+    :param export: function exporting one file, see export_file()
+    :return: the index written to the archive
+    """
+    blend_files = find_blend_files(folder)
+    index = {'files': {}, 'failed_datablocks': {}, 'failed': {}}
+    # Worker threads only wait on their Blender, the archive is written from this thread
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool, \
+            zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as archive:
+        futures = {pool.submit(export, folder, blend_file, args): blend_file for blend_file in blend_files}
+        for future in as_completed(futures):
+            blend_file = futures[future].replace(os.sep, '/')
+            try:
+                manifest, contents, failed = future.result()
+            except Exception as e:
+                print('Failed to export {}: {}'.format(blend_file, e))
+                index['failed'][blend_file] = str(e)
+                continue
+            for path, data in sorted(contents.items()):
+                compression = zipfile.ZIP_STORED if path.endswith(_STORED) else zipfile.ZIP_DEFLATED
+                archive.writestr(path, data, compress_type=compression)
+            index['files'][blend_file] = manifest
+            if failed:
+                index['failed_datablocks'][blend_file] = failed
+            print('Exported {}, {} datablocks, {} failed'.format(
+                blend_file, len(contents), sum(len(names) for names in failed.values())))
+        archive.writestr(INDEX, json.dumps(index, indent=1, sort_keys=True))
+    return index
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    start = time.perf_counter()
+    index = export_folder(args.folder, args.out, args)
+    elapsed = time.perf_counter() - start
+
+    files = len(index['files'])
+    datablocks = sum(len(entries) for manifest in index['files'].values() for entries in manifest.values())
+    failed_datablocks = sum(len(names) for failed in index['failed_datablocks'].values()
+                            for names in failed.values())
+    print('Node Sharer parallel export: {} files, {} datablocks, {} files and {} datablocks failed in {:.1f} s, '
+          '{} jobs'.format(files, datablocks, len(index['failed']), failed_datablocks, elapsed, args.jobs))
+    if elapsed > 0:
+        print('  {:.2f} files/s, {:.1f} datablocks/s'.format(files / elapsed, datablocks / elapsed))
+    return 1 if index['failed'] or index['failed_datablocks'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
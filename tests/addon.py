@@ -0,0 +1,43 @@
+"""Imports the add-on's modules for the tests, the add-on folder is a package with any name"""
+
+import importlib
+import os
+import sys
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if os.path.dirname(ADDON_DIR) not in sys.path:
+    sys.path.insert(0, os.path.dirname(ADDON_DIR))
+
+
+def module(name):
+    """The add-on's module name, like 'nsstream'"""
+    return importlib.import_module(os.path.basename(ADDON_DIR) + '.' + name)
+
+
+def install_bpy_stub():
+    """
+    Outside of Blender, puts just enough of a bpy module in place for the add-on's modules to import.
+        Tests fill in bpy.data themselves, nothing in the stub does anything
+    :return: the bpy module
+    """
+    try:
+        import bpy  # type: ignore
+        return bpy
+    except ImportError:
+        pass
+    import types
+
+    bpy = types.ModuleType('bpy')
+    bpy_types = types.ModuleType('bpy.types')
+    # Any type the add-on names, bpy.types.Operator, bpy.types.NodeTree, ...
+    bpy_types.__getattr__ = lambda name: type(name, (), {})
+    bpy.types = bpy_types
+    bpy.props = types.ModuleType('bpy.props')
+    bpy.props.__getattr__ = lambda name: (lambda **kwargs: None)
+    bpy.app = types.SimpleNamespace(version=(4, 2, 0))
+    bpy.data = types.SimpleNamespace(materials=[], node_groups=[], filepath='')
+    bpy.context = types.SimpleNamespace()
+    bpy.utils = types.SimpleNamespace(register_class=lambda cls: None, unregister_class=lambda cls: None)
+    sys.modules.update({'bpy': bpy, 'bpy.types': bpy_types, 'bpy.props': bpy.props})
+    return bpy
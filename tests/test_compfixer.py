@@ -0,0 +1,82 @@
+import copy
+
+from addon import module
+
+nscodec = module('nscodec')
+compfixer = module('compfixer')
+CompFixer = compfixer.CompFixer
+
+
+def nodes():
+    """A Principled BSDF with values and links on inputs around both changes, see compfixer.MIGRATIONS"""
+    return {
+        'BSDF': {'bl_idname': 'ShaderNodeBsdfPrincipled', 'name': 'BSDF', 'location': [0, 0],
+                 'inputs': {'0': 'base color', '3': 'subsurface radius', '4': 'subsurface color',
+                            '17': 'emission', '18': 'alpha'},
+                 'outputs': {'0': {'Output': 0}}},
+        'Value': {'bl_idname': 'ShaderNodeValue', 'name': 'Value', 'location': [-200, 0],
+                  'outputs': {'0': {'BSDF': [4, 18]}}},
+        'Other': {'bl_idname': 'ShaderNodeValue', 'name': 'Other', 'location': [-200, 100],
+                  'outputs': {'0': {'BSDF': 17}}},
+        'Output': {'bl_idname': 'ShaderNodeOutputMaterial', 'name': 'Output', 'location': [200, 0]},
+    }
+
+
+def test_upgrade_290_to_420():
+    fixed = nodes()
+    CompFixer.fix('NS0B2900', fixed, (4, 2, 0))
+    # 2.91 added Emission Strength at 18, 3.0 Subsurface IOR and Anisotropy at 4
+    assert fixed['BSDF']['inputs'] == {'0': 'base color', '3': 'subsurface radius', '6': 'subsurface color',
+                                       '19': 'emission', '21': 'alpha'}
+    assert fixed['Value']['outputs'] == {'0': {'BSDF': [6, 21]}}
+    assert fixed['Other']['outputs'] == {'0': {'BSDF': 19}}
+    # Outputs of the Principled BSDF didn't change
+    assert fixed['BSDF']['outputs'] == {'0': {'Output': 0}}
+
+
+def test_upgrade_in_steps():
+    fixed = nodes()
+    CompFixer.fix('NS0B2900', fixed, (2, 93, 0))
+    assert fixed['BSDF']['inputs']['19'] == 'alpha'
+    assert fixed['Value']['outputs'] == {'0': {'BSDF': [4, 19]}}
+
+
+def test_downgrade_420_to_290():
+    upgraded = nodes()
+    CompFixer.fix('NS0B2900', upgraded, (4, 2, 0))
+    back = copy.deepcopy(upgraded)
+    CompFixer.fix('NS1B420', back, (2, 90, 0))
+    assert back == nodes()
+
+    # Inputs that weren't there in 2.90 are dropped, with their links
+    upgraded['BSDF']['inputs'].update({'4': 'subsurface ior', '20': 'emission strength'})
+    upgraded['Value']['outputs'] = {'0': {'BSDF': [4, 20, 21]}}
+    upgraded['Other']['outputs'] = {'0': {'BSDF': 5}}
+    CompFixer.fix('NS1B420', upgraded, (2, 90, 0))
+    assert upgraded['BSDF']['inputs'] == nodes()['BSDF']['inputs']
+    assert upgraded['Value']['outputs'] == {'0': {'BSDF': [18]}}
+    assert upgraded['Other']['outputs'] == {'0': {}}
+
+
+def test_groups_and_socket_identifiers():
+    group = nodes()
+    tree = nodes()
+    # Stored with identifiers, found by those when built, indices stay as they are
+    tree['BSDF']['in_ids'] = {'18': 'Alpha'}
+    CompFixer.fix('NS0B2900', tree, (4, 2, 0), groups={'G': group})
+    assert tree['BSDF']['inputs'] == nodes()['BSDF']['inputs']
+    assert group['BSDF']['inputs']['21'] == 'alpha'
+
+
+def test_nothing_to_fix():
+    for prefix, version in (('NS0B420', (4, 2, 0)), ('NS0B300', (4, 2, 0)), ('NS0B279', (4, 2, 0))):
+        fixed = nodes()
+        CompFixer.fix(prefix, fixed, version)
+        assert fixed == nodes(), prefix
+    assert CompFixer.remap_table((3, 0, 0), (4, 2, 0)) == {}
+
+
+def test_fix_versions():
+    payload = {'name': 'M', 'nodes': nodes()}
+    nscodec.fix_versions(payload, nscodec.parse_prefix('NS1B2900Cx'), (3, 6, 0))
+    assert payload['nodes']['BSDF']['inputs']['21'] == 'alpha'
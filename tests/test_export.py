@@ -0,0 +1,117 @@
+import json
+import os
+import sys
+import types
+import zipfile
+
+import pytest
+
+from addon import install_bpy_stub, module
+
+bpy = install_bpy_stub()
+batch_export = module('batch_export')
+parallel_export = module('parallel_export')
+
+
+def datablock(name, content):
+    return types.SimpleNamespace(name_full=name, content=content, use_nodes=True, node_tree=object())
+
+
+def fake_export(block, args):
+    payload = block.content.encode('utf8')
+    return payload, lambda: payload
+
+
+def run_batch_export(monkeypatch, out, materials, exit_code=0):
+    monkeypatch.setattr(bpy.data, 'materials', materials, raising=False)
+    monkeypatch.setattr(bpy.data, 'node_groups', [], raising=False)
+    monkeypatch.setattr(batch_export, 'export_material', fake_export)
+    monkeypatch.setattr(sys, 'argv', ['blender', '--', '--out', str(out)])
+    assert batch_export.main() == exit_code
+    with open(os.path.join(out, batch_export.MANIFEST)) as file:
+        return json.load(file)
+
+
+def test_manifest_skips_unchanged_and_prunes_deleted(monkeypatch, tmp_path, capsys):
+    oak = datablock('Oak', 'oak v1')
+    pine = datablock('Pine/old', 'pine')
+    entries = run_batch_export(monkeypatch, tmp_path, [oak, pine])['materials']
+    assert sorted(entries) == ['Oak', 'Pine/old']
+    pine_file = tmp_path / entries['Pine/old']['file']
+    assert pine_file.read_text() == 'pine'
+
+    oak.content = 'oak v2'
+    capsys.readouterr()
+    entries = run_batch_export(monkeypatch, tmp_path, [oak])['materials']
+    assert '1 exported, 0 unchanged, 1 removed' in capsys.readouterr().out
+    assert sorted(entries) == ['Oak']
+    assert (tmp_path / entries['Oak']['file']).read_text() == 'oak v2'
+    assert not pine_file.exists()
+
+    run_batch_export(monkeypatch, tmp_path, [oak])
+    assert '0 exported, 1 unchanged, 0 removed' in capsys.readouterr().out
+
+
+def test_manifest_lists_failed_datablocks(monkeypatch, tmp_path):
+    broken = datablock('Broken', None)  # None.encode fails in fake_export
+    manifest = run_batch_export(monkeypatch, tmp_path, [datablock('Oak', 'oak'), broken], exit_code=1)
+    assert sorted(manifest['materials']) == ['Oak']
+    assert list(manifest['failed']['materials']) == ['Broken']
+
+    broken.content = 'fixed'
+    manifest = run_batch_export(monkeypatch, tmp_path, [broken])
+    assert sorted(manifest['materials']) == ['Broken']
+    assert manifest['failed'] == {}
+
+
+def test_export_file_keeps_datablocks_when_blender_fails(tmp_path):
+    # Stands in for Blender, writes what batch_export.py would and exits with 1 like it does on failures
+    blender = tmp_path / 'blender'
+    blender.write_text('#!{}\n'.format(sys.executable) + '''
+import json, os, sys
+out = sys.argv[sys.argv.index('--out') + 1]
+os.makedirs(os.path.join(out, 'materials'))
+with open(os.path.join(out, 'materials', 'Oak.txt'), 'w') as file:
+    file.write('oak')
+with open(os.path.join(out, 'manifest.json'), 'w') as file:
+    json.dump({'materials': {'Oak': {'file': os.path.join('materials', 'Oak.txt'), 'hash': 'h'}},
+               'failed': {'materials': {'Broken': 'no'}}}, file)
+sys.exit(1)
+''')
+    blender.chmod(0o755)
+    (tmp_path / 'rocks.blend').write_bytes(b'BLENDER')
+    args = parallel_export.parse_args([str(tmp_path), '--out', 'out.zip', '--blender', str(blender)])
+    manifest, contents, failed = parallel_export.export_file(str(tmp_path), 'rocks.blend', args)
+    assert manifest == {'materials': {'Oak': {'file': 'rocks/materials/Oak.txt', 'hash': 'h'}}}
+    assert contents == {'rocks/materials/Oak.txt': b'oak'}
+    assert failed == {'materials': {'Broken': 'no'}}
+
+    blender.write_text('#!{}\nimport sys\nprint("crashed")\nsys.exit(1)\n'.format(sys.executable))
+    with pytest.raises(RuntimeError, match='crashed'):
+        parallel_export.export_file(str(tmp_path), 'rocks.blend', args)
+
+
+def test_export_folder(tmp_path):
+    folder = tmp_path / 'library'
+    (folder / 'props').mkdir(parents=True)
+    for path in ('a.blend', 'props/b.blend', 'broken.blend', 'rocks.blend'):
+        (folder / path).write_bytes(b'BLENDER')
+    (folder / 'notes.txt').write_text('not a .blend file')
+
+    def export(folder, blend_file, args):
+        if blend_file == 'broken.blend':
+            raise RuntimeError('Blender exited with 1')
+        archive_dir = os.path.splitext(blend_file)[0].replace(os.sep, '/')
+        path = archive_dir + '/materials/Oak.txt'
+        failed = {'materials': {'Granite': 'error'}} if blend_file == 'rocks.blend' else {}
+        return {'materials': {'Oak': {'file': path, 'hash': 'h'}}}, {path: blend_file.encode('utf8')}, failed
+
+    args = parallel_export.parse_args([str(folder), '--out', str(tmp_path / 'out.zip'), '--jobs', '2'])
+    index = parallel_export.export_folder(args.folder, args.out, args, export=export)
+    assert sorted(index['files']) == ['a.blend', 'props/b.blend', 'rocks.blend']
+    assert list(index['failed']) == ['broken.blend']
+    assert index['failed_datablocks'] == {'rocks.blend': {'materials': {'Granite': 'error'}}}
+    with zipfile.ZipFile(args.out) as archive:
+        assert archive.read('props/b/materials/Oak.txt') == os.path.join('props', 'b.blend').encode('utf8')
+        assert archive.getinfo('a/materials/Oak.txt').compress_type == zipfile.ZIP_STORED
+        assert json.loads(archive.read(parallel_export.INDEX)) == index
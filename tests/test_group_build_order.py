@@ -0,0 +1,50 @@
+import sys
+
+from addon import install_bpy_stub, module
+
+install_bpy_stub()
+nodesharer = module('nodesharer')
+group_build_order = nodesharer.NS_nodetree.group_build_order
+
+
+def group(*uses):
+    """Stored nodes of a group with a group node for every group it uses"""
+    nodes = {'Group Input': {'bl_idname': 'NodeGroupInput'}}
+    for i, name in enumerate(uses):
+        nodes['Group.{:03}'.format(i)] = {'bl_idname': 'ShaderNodeGroup', 'node_tree': name}
+    return nodes
+
+
+def check_order(groups, order):
+    assert sorted(order) == sorted(groups)
+    position = {name: i for i, name in enumerate(order)}
+    for name, nodes in groups.items():
+        for node in nodes.values():
+            child = node.get('node_tree')
+            if child in groups and child != name:
+                assert position[child] < position[name], (child, name)
+
+
+def test_leaves_first():
+    groups = {'Top': group('Middle', 'Leaf'), 'Middle': group('Leaf', 'Leaf'), 'Leaf': group(),
+              'Alone': group(), 'Missing': group('Not in the payload')}
+    order = group_build_order(groups)
+    check_order(groups, order)
+    assert order.index('Leaf') < order.index('Middle') < order.index('Top')
+
+
+def test_cycles():
+    groups = {'A': group('B'), 'B': group('C'), 'C': group('A', 'Leaf'), 'Self': group('Self'), 'Leaf': group()}
+    order = group_build_order(groups)
+    # Every group once, the link back that closes the cycle is ignored
+    assert sorted(order) == sorted(groups)
+    assert order.index('C') < order.index('B') < order.index('A')
+    assert order.index('Leaf') < order.index('C')
+
+
+def test_deep_nesting():
+    depth = sys.getrecursionlimit() * 3
+    groups = {'G{}'.format(i): group('G{}'.format(i + 1)) for i in range(depth)}
+    groups['G{}'.format(depth)] = group()
+    order = group_build_order(groups)
+    assert order == ['G{}'.format(i) for i in range(depth, -1, -1)]
@@ -0,0 +1,50 @@
+import json
+
+from addon import install_bpy_stub, module
+
+install_bpy_stub()
+nodesharer = module('nodesharer')
+
+
+class FakeTree:
+    bl_idname = 'ShaderNodeTree'
+
+    def __init__(self, name):
+        self.name = self.name_full = name
+        self.nodes = []
+        self.links = []
+
+
+class FakeNode:
+    """Enough of a blender node for capturing, nodes of one type don't all have the same attributes"""
+    bl_idname = 'ShaderNodeFake'
+
+    def __init__(self, tree, name, **attributes):
+        self.id_data = tree
+        self.name = name
+        self.label = ''
+        self.location = (0.0, 0.0)
+        self.inputs = ()
+        self.outputs = ()
+        self.__dict__.update(attributes)
+        tree.nodes.append(self)
+
+
+def test_node_without_signature_is_captured_again(monkeypatch):
+    monkeypatch.setattr(nodesharer.NS_node, 'diff_socket_defaults', False)
+    monkeypatch.setattr(nodesharer.NS_node, '_schema_cache', {})
+    monkeypatch.setattr(nodesharer.NS_node, '_signature_schema_cache', {})
+    tree = FakeTree('Tree')
+    FakeNode(tree, 'with mode', mode='ADD')
+    odd = FakeNode(tree, 'without mode')  # the signature getter, made from the first node, raises for this one
+    monkeypatch.setattr(nodesharer.NS_nodetree, 'index_links', staticmethod(lambda b_tree: {}))
+    exporter = nodesharer.NS_incremental_exporter()
+    first = json.loads(exporter.nodes_JSON(tree, ('node_group', tree.name)))
+    assert first['without mode']['name'] == 'without mode'
+    assert 'label' not in first['without mode']
+
+    odd.label = 'changed'
+    exporter.captured = exporter.reused = 0  # export_material() and export_nodetree() do this
+    second = json.loads(exporter.nodes_JSON(tree, ('node_group', tree.name)))
+    assert second['without mode']['label'] == 'changed'
+    assert (exporter.captured, exporter.reused) == (1, 1)
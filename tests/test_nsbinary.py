@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from addon import module
+
+nsbinary = module('nsbinary')
+
+PAYLOAD = {
+    'name': 'Wood ünïcode', 'type': 'material',
+    'nodes': {
+        'Math': {'bl_idname': 'ShaderNodeMath', 'location': [-200.0, 300.5], 'hide': True, 'parent': None,
+                 'inputs': {'0': 0.5, '1': 0.1, '2': -3}, 'outputs': {'0': {'Mix': [1, 2]}},
+                 'width': 140.0, 'big': 2 ** 40, 'precise': 1.0000000001, 'curve': [[0.0, 0.25], [1.0, 1.0]],
+                 'ids': [1, -2, 300], 'empty': [], 'nothing': {}},
+        'Mix': {'bl_idname': 'ShaderNodeMix', 'location': [0, 0], 'use_clamp': False, 'label': ''},
+    },
+}
+
+
+def test_round_trip():
+    data = nsbinary.dumps(PAYLOAD)
+    assert data.startswith(nsbinary.MAGIC)
+    assert nsbinary.loads(data) == PAYLOAD
+    assert len(data) < len(json.dumps(PAYLOAD, separators=(',', ':')).encode('utf8'))
+
+
+def test_default_and_keys():
+    class Node:
+        def __init__(self, value):
+            self.value = value
+
+    payload = {'nodes': {'a': Node(1), 2: Node([True])}}
+    assert nsbinary.loads(nsbinary.dumps(payload, default=lambda o: {'value': o.value})) == \
+        json.loads(json.dumps(payload, default=lambda o: {'value': o.value}))
+
+
+def test_truncated():
+    data = nsbinary.dumps(PAYLOAD)
+    for end in range(len(data)):
+        with pytest.raises(ValueError):
+            nsbinary.loads(data[:end])
+
+
+@pytest.mark.parametrize('data', [b'', b'NSB', b'JSON', b'{"name": 1}'])
+def test_not_binary(data):
+    with pytest.raises(ValueError):
+        nsbinary.loads(data)
+
+
+def test_newer_version():
+    data = bytearray(nsbinary.dumps(PAYLOAD))
+    data[3] = nsbinary.VERSION + 1
+    with pytest.raises(ValueError, match='newer'):
+        nsbinary.loads(bytes(data))
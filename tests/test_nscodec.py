@@ -0,0 +1,153 @@
+import base64
+import json
+import zlib
+
+import pytest
+
+from addon import module
+
+nscodec = module('nscodec')
+
+
+def material_payload():
+    return {
+        'name': 'Wood', 'type': 'material',
+        'nodes': {
+            'Principled BSDF': {'bl_idname': 'ShaderNodeBsdfPrincipled', 'name': 'Principled BSDF',
+                                'location': [10.0, 300.0], 'inputs': {'0': [0.8, 0.5, 0.2, 1.0], '7': 0.25},
+                                'outputs': {'0': {'Material Output': 0}}},
+            'Material Output': {'bl_idname': 'ShaderNodeOutputMaterial', 'name': 'Material Output',
+                                'location': [300.0, 300.0], 'is_active_output': True},
+        },
+    }
+
+
+@pytest.mark.parametrize('codec', sorted(nscodec.CODECS))
+@pytest.mark.parametrize('payload_format', nscodec.FORMATS)
+def test_round_trip(codec, payload_format):
+    payload = material_payload()
+    ns_string = nscodec.encode(payload, (4, 2, 0), codec, payload_format)
+    info, decoded = nscodec.decode(ns_string)
+    codec_id = nscodec.CODECS[codec][0]
+    assert info == (0 if ns_string.startswith('NS0B') else nscodec.NS_VERSION, 420, codec_id, payload_format)
+    assert decoded == payload
+
+
+@pytest.mark.parametrize('codec, payload_format, prefix', [
+    ('DEFAULT', nscodec.FORMAT_JSON, 'NS0B420!'),
+    ('FAST', nscodec.FORMAT_JSON, 'NS0B420!'),
+    ('SMALLEST', nscodec.FORMAT_JSON, 'NS1B420Cx!'),
+    ('DICTIONARY', nscodec.FORMAT_JSON, 'NS1B420Cd!'),
+    ('DEFAULT', nscodec.FORMAT_BINARY, 'NS1B420CzFb!'),
+])
+def test_prefix(codec, payload_format, prefix):
+    assert nscodec.make_prefix((4, 2, 0), codec, payload_format) == prefix
+    info = nscodec.parse_prefix(prefix)
+    assert info[1:] == (420, nscodec.CODECS[codec][0], payload_format)
+
+
+@pytest.mark.parametrize('prefix', ['NSxB420', 'NS1B420Cq', 'NS1B420CzFq', 'XX0B420', ''])
+def test_bad_prefix(prefix):
+    with pytest.raises(ValueError):
+        nscodec.parse_prefix(prefix)
+
+
+@pytest.mark.parametrize('code, version', [(2900, (2, 90, 0)), (2910, (2, 91, 0)), (300, (3, 0, 0)),
+                                           (420, (4, 2, 0)), ('361', (3, 6, 1))])
+def test_blender_versions(code, version):
+    assert nscodec.blender_version_tuple(code) == version
+    assert nscodec.blender_version_code(version) == str(code)
+
+
+def test_original_format_strings():
+    # How strings were written before the version 1 prefix, and how NodeShare.io still has them
+    payload = material_payload()
+    ns_string = 'NS0B2900!' + base64.b64encode(zlib.compress(json.dumps(payload).encode('utf8'))).decode()
+    info, decoded = nscodec.decode(ns_string)
+    assert info == (0, 2900, 'z', nscodec.FORMAT_JSON)
+    assert nscodec.blender_version_tuple(info[1]) == (2, 90, 0)
+    assert decoded == payload
+    # zlib strings are still written the original way, so older add-ons can read them
+    assert nscodec.encode(payload, (2, 90, 0)).startswith('NS0B2900!')
+
+
+def test_transcode_fixes_versions():
+    old = nscodec.encode(material_payload(), (2, 90, 0))
+    new = nscodec.transcode(old, (4, 2, 0), 'SMALLEST')
+    info, payload = nscodec.decode(new)
+    assert info[1:3] == (420, 'x')
+    # Subsurface IOR and Anisotropy came in 3.0 at input 4, everything from there moved up two
+    assert payload['nodes']['Principled BSDF']['inputs'] == {'0': [0.8, 0.5, 0.2, 1.0], '9': 0.25}
+    assert nscodec.transcode(old, codec='SMALLEST').startswith('NS1B2900Cx!')
+
+
+@pytest.mark.parametrize('ns_string', ['no prefix', 'NS0B420!not base64!', 'NS0B420!' + 'eJzLSM3JyQcABiwCFQ=='])
+def test_unreadable_strings(ns_string):
+    with pytest.raises(ValueError):
+        nscodec.decode(ns_string)
+
+
+def test_payload_cache():
+    cache = nscodec.PayloadCache(max_entries=2)
+    strings = [nscodec.encode(dict(material_payload(), name=name), (4, 2, 0)) for name in 'ABC']
+    payload = cache.get(strings[0], (4, 2, 0))
+    assert cache.get(' ' + strings[0] + '\n', (4, 2, 0)) is payload
+    assert (cache.hits, cache.misses) == (1, 1)
+    # Fixed for another version, that's another entry
+    assert cache.get(strings[0], (2, 90, 0)) is not payload
+
+    extras = cache.extras(payload)
+    assert extras == {}
+    extras['plan'] = 'built'
+    assert cache.extras(payload) is extras
+    assert cache.extras(material_payload()) is None
+
+    cache.get(strings[1], (4, 2, 0))
+    assert cache.extras(payload) is None  # the oldest of three went
+    assert cache.get(strings[0], (4, 2, 0)) is not payload
+
+    cache.clear()
+    cache.get(strings[2], (4, 2, 0))
+    assert cache.misses == 5
+
+
+def broken(change):
+    """material_payload() with change(nodes) made to its nodes"""
+    payload = material_payload()
+    change(payload['nodes'])
+    return payload
+
+
+@pytest.mark.parametrize('payload', [
+    [],
+    {'nodes': {}},
+    {'name': 'x', 'nodes': []},
+    {'name': 'x', 'nodes': {'a': {'bl_idname': 'X'}}},
+    broken(lambda nodes: nodes['Principled BSDF'].pop('bl_idname')),
+    broken(lambda nodes: nodes['Principled BSDF'].pop('name')),
+    broken(lambda nodes: nodes['Principled BSDF'].pop('location')),
+    broken(lambda nodes: nodes['Principled BSDF'].update(location=[1.0])),
+    broken(lambda nodes: nodes['Principled BSDF'].update(location='0,0')),
+    broken(lambda nodes: nodes['Principled BSDF'].update(inputs=[1, 2])),
+    broken(lambda nodes: nodes['Principled BSDF'].update(inputs={'alpha': 1.0})),
+    broken(lambda nodes: nodes['Principled BSDF'].update(out_dv=0.5)),
+    broken(lambda nodes: nodes['Principled BSDF'].update(color_ramp=[0, 1])),
+    broken(lambda nodes: nodes['Principled BSDF'].update(mapping='curves')),
+    broken(lambda nodes: nodes['Principled BSDF'].update(in_ids={'0': 3})),
+    broken(lambda nodes: nodes['Principled BSDF'].update(outputs={'0': ['Material Output']})),
+    broken(lambda nodes: nodes['Principled BSDF'].update(outputs={'0': {'Gone': 0}})),
+    broken(lambda nodes: nodes['Principled BSDF'].update(outputs={'0': {'Material Output': 'Surface'}})),
+    dict(material_payload(), groups={'G': {'a': {'bl_idname': 'NodeGroupInput'}}}),
+])
+@pytest.mark.parametrize('payload_format', nscodec.FORMATS)
+def test_malformed_payloads(payload, payload_format):
+    # Rejected by decode(), before a builder ever sees them
+    ns_string = nscodec.encode(payload, (4, 2, 0), payload_format=payload_format)
+    with pytest.raises(ValueError):
+        nscodec.decode(ns_string)
+
+
+def test_old_plain_outputs_pass():
+    # Strings from before out_dv have unconnected output values in outputs
+    payload = broken(lambda nodes: nodes['Principled BSDF']['outputs'].update({'1': 0.5, '2': 'text'}))
+    assert nscodec.decode(nscodec.encode(payload, (2, 90, 0)))[1] == payload
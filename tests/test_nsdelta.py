@@ -0,0 +1,107 @@
+import copy
+
+import pytest
+
+from addon import module
+
+nscodec = module('nscodec')
+nsdelta = module('nsdelta')
+
+
+def base_payload():
+    return {
+        'name': 'Wood', 'type': 'material',
+        'nodes': {
+            'Noise': {'bl_idname': 'ShaderNodeTexNoise', 'name': 'Noise', 'location': [-400, 0],
+                      'inputs': {'2': 5.0}, 'outputs': {'0': {'Math': 0}}},
+            'Math': {'bl_idname': 'ShaderNodeMath', 'name': 'Math', 'location': [-200, 0], 'operation': 'ADD',
+                     'inputs': {'1': 0.5}, 'outputs': {'0': {'BSDF': [0, 7]}}},
+            'BSDF': {'bl_idname': 'ShaderNodeBsdfPrincipled', 'name': 'BSDF', 'location': [0, 0],
+                     'outputs': {'0': {'Output': 0}}},
+            'Output': {'bl_idname': 'ShaderNodeOutputMaterial', 'name': 'Output', 'location': [200, 0]},
+        },
+        'groups': {
+            'Old': {'In': {'bl_idname': 'NodeGroupInput', 'name': 'In', 'location': [0, 0]}},
+            'Kept': {'In': {'bl_idname': 'NodeGroupInput', 'name': 'In', 'location': [0, 0],
+                            'outputs': {'0': {'Out': 0}}},
+                     'Out': {'bl_idname': 'NodeGroupOutput', 'name': 'Out', 'location': [200, 0]}},
+        },
+    }
+
+
+def new_payload():
+    new = copy.deepcopy(base_payload())
+    new['name'] = 'Wood.001'
+    nodes = new['nodes']
+    del nodes['Noise']
+    nodes['Math'].update({'operation': 'MULTIPLY', 'inputs': {'0': 2.0}, 'outputs': {'0': {'BSDF': 0}}})
+    nodes['Math'].pop('location')
+    nodes['Output']['bl_idname'] = 'ShaderNodeOutputWorld'  # changed type, removed and added again
+    nodes['Wave'] = {'bl_idname': 'ShaderNodeTexWave', 'name': 'Wave', 'location': [-400, 200],
+                     'outputs': {'0': {'Math': 1}}}
+    del new['groups']['Old']
+    new['groups']['Kept']['Out']['location'] = [300, 0]
+    del new['groups']['Kept']['In']['outputs']
+    new['groups']['New'] = {'In': {'bl_idname': 'NodeGroupInput', 'name': 'In', 'location': [0, 0]}}
+    return new
+
+
+def test_diff_and_patch():
+    base = base_payload()
+    delta = nsdelta.diff(base, new_payload())
+    assert not nsdelta.is_empty(delta)
+    assert delta['nodes']['removed'] == ['Noise', 'Output']
+    assert sorted(delta['nodes']['added']) == ['Output', 'Wave']
+    assert delta['nodes']['changed']['Math'] == {'set': {'operation': 'MULTIPLY'}, 'unset': ['location'],
+                                                 'inputs': {'0': 2.0, '1': None}}
+    assert delta['removed_groups'] == ['Old']
+    assert list(delta['new_groups']) == ['New']
+    assert nsdelta.patch(base, delta) == new_payload()
+    assert base == base_payload()
+
+
+def test_nothing_changed():
+    delta = nsdelta.diff(base_payload(), base_payload())
+    assert nsdelta.is_empty(delta)
+    assert nsdelta.patch(base_payload(), delta) == base_payload()
+
+
+@pytest.mark.parametrize('codec', sorted(nscodec.CODECS))
+@pytest.mark.parametrize('payload_format', nscodec.FORMATS)
+def test_encode_decode(codec, payload_format):
+    delta = nsdelta.diff(base_payload(), new_payload())
+    delta_string = nsdelta.encode(delta, (4, 2, 0), codec, payload_format)
+    assert delta_string.startswith('ND')
+    assert nsdelta.is_delta_string('\n' + delta_string)
+    info, decoded = nsdelta.decode(delta_string)
+    assert info[1] == 420
+    # Links are tuples until they've been through JSON, patching takes either
+    assert nsdelta.patch(base_payload(), decoded) == new_payload()
+
+
+@pytest.mark.parametrize('text', ['NS0B420!eJyrrgUAAXUA+Q==', 'ND0B420!not base64', 'no prefix'])
+def test_not_delta_strings(text):
+    with pytest.raises(ValueError):
+        nsdelta.decode(text)
+
+
+def test_newer_delta():
+    delta = dict(nsdelta.diff(base_payload(), new_payload()), delta=nsdelta.DELTA_VERSION + 1)
+    with pytest.raises(ValueError, match='newer'):
+        nsdelta.decode(nsdelta.encode(delta, (4, 2, 0)))
+
+
+def test_base_fingerprint():
+    base = base_payload()
+    delta = nsdelta.diff(base, new_payload())
+    node_types = [(name, node['bl_idname']) for name, node in base['nodes'].items()]
+    assert delta['base_nodes'] == nsdelta.base_fingerprint(node_types)
+    assert delta['base_nodes'] == nsdelta.base_fingerprint(reversed(node_types))
+    # The new tree, a renamed node or a node of another type is another base
+    new_types = [(name, node['bl_idname']) for name, node in new_payload()['nodes'].items()]
+    assert nsdelta.base_fingerprint(new_types) != delta['base_nodes']
+    renamed = [('Noise.001', bl_idname) if name == 'Noise' else (name, bl_idname) for name, bl_idname in node_types]
+    assert nsdelta.base_fingerprint(renamed) != delta['base_nodes']
+    retyped = [(name, 'ShaderNodeTexWave') if name == 'Noise' else (name, bl_idname)
+               for name, bl_idname in node_types]
+    assert nsdelta.base_fingerprint(retyped) != delta['base_nodes']
@@ -0,0 +1,43 @@
+import io
+import json
+
+from addon import module
+
+nsstream = module('nsstream')
+
+
+def read_all(text, chunk_size):
+    """iter_tree() of text, with the node iterators read into dicts"""
+    found = []
+    for kind, key, value in nsstream.iter_tree(io.StringIO(text), chunk_size):
+        found.append((kind, key, dict(value) if kind != 'header' else value))
+    return found
+
+
+def test_numbers_split_between_chunks():
+    text = '{"name":"T","scale":-1.5e-3,"count":12,"nodes":{"a":-1.5,"b":{"x":2.25}}}'
+    expected = read_all(text, len(text))
+    assert expected == [('header', 'name', 'T'), ('header', 'scale', -1.5e-3), ('header', 'count', 12),
+                        ('nodes', None, {'a': -1.5, 'b': {'x': 2.25}})]
+    for chunk_size in range(1, len(text) + 1):
+        assert read_all(text, chunk_size) == expected, chunk_size
+
+
+def test_number_at_the_end_of_the_file():
+    # Not a node tree, but the reader has to finish a number the file ends with
+    reader = nsstream._Reader(io.StringIO('-1.5'), 2)
+    assert reader.value() == -1.5
+
+
+def test_written_tree_reads_back():
+    header = {'name': 'T', 'type': 'GeometryNodeTree'}
+    groups = [('G', [('g1', {'bl_idname': 'NodeGroupInput'})])]
+    nodes = [('n1', {'location': [-10.5, 3.0]}), ('n2', {'outputs': {'0': {'n1': 1}}})]
+    file = io.StringIO()
+    nsstream.write_tree(file, header, groups, nodes)
+    text = file.getvalue()
+    assert json.loads(text)['stream'] == nsstream.STREAM_VERSION
+    for chunk_size in (1, 7, 1 << 16):
+        found = read_all(text, chunk_size)
+        assert ('group', 'G', dict(groups[0][1])) in found
+        assert found[-1] == ('nodes', None, dict(nodes))